@@ -0,0 +1,98 @@
+import time
+
+
+# --- Спільний планувальник анімацій вікна ---
+# Замість окремих after()-циклів усі анімації крокують разом в одному таймері.
+# Анімація — ітератор: кожен крок — next(), кінець — StopIteration.
+# Нова анімація з тим самим ключем замінює стару (нова прокрутка скасовує попередню).
+# Одноразові таймери (call_later) теж мають ключі, тож повторний виклик переносить, а не дублює.
+# Коли анімувати нічого, таймер не заводиться взагалі; до найближчого таймера — спимо.
+# Згорнуте вікно не тікає, доки його знову не покажуть.
+class FrameScheduler:
+    def __init__(self, window, interval=20):
+        self.window = window
+        self.interval = interval   # мс між кадрами, поки є активні анімації
+        self.animations = {}       # ключ -> ітератор
+        self.timers = {}           # ключ -> (момент спрацювання, callback)
+        self.job = None
+        self.job_due = None
+        self.hidden = False
+
+        window.bind("<Unmap>", self.on_unmap, add="+")
+        window.bind("<Map>", self.on_map, add="+")
+
+    # ====== API ======
+    def animate(self, key, steps):
+        self.animations[key] = iter(steps)
+        self.wake()
+
+    def call_later(self, key, delay_ms, callback):
+        self.timers[key] = (time.monotonic() + delay_ms / 1000, callback)
+        self.wake()
+
+    def cancel(self, key):
+        self.animations.pop(key, None)
+        self.timers.pop(key, None)
+
+    def active(self, key):
+        return key in self.animations or key in self.timers
+
+    # ====== ТАЙМЕР ======
+    def next_delay(self):
+        if self.hidden:
+            return None
+        if self.animations:
+            return self.interval
+        if self.timers:
+            due = min(due for due, _ in self.timers.values())
+            return max(0, int((due - time.monotonic()) * 1000))
+        return None
+
+    def wake(self):
+        delay = self.next_delay()
+        if delay is None:
+            self.stop()
+            return
+        due = time.monotonic() + delay / 1000
+        if self.job is not None:
+            if self.job_due <= due:
+                return  # уже прокинемось не пізніше, ніж треба
+            self.window.after_cancel(self.job)
+        self.job_due = due
+        self.job = self.window.after(delay, self.tick)
+
+    def stop(self):
+        if self.job is not None:
+            self.window.after_cancel(self.job)
+            self.job = None
+
+    def tick(self):
+        self.job = None
+        for key, steps in list(self.animations.items()):
+            if self.animations.get(key) is not steps:
+                continue  # замінена або скасована під час цього кадру
+            try:
+                next(steps)
+            except StopIteration:
+                if self.animations.get(key) is steps:
+                    del self.animations[key]
+
+        now = time.monotonic()
+        for key, timer in list(self.timers.items()):
+            if timer[0] <= now and self.timers.get(key) is timer:
+                del self.timers[key]
+                timer[1]()
+
+        self.wake()
+
+    # ====== ВИДИМІСТЬ ======
+    # <Unmap>/<Map> приходять і від дочірніх віджетів — дивимось лише на саме вікно
+    def on_unmap(self, event):
+        if event.widget is self.window:
+            self.hidden = True
+            self.stop()
+
+    def on_map(self, event):
+        if event.widget is self.window and self.hidden:
+            self.hidden = False
+            self.wake()
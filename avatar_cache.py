@@ -0,0 +1,145 @@
+import os
+import tempfile
+from collections import OrderedDict
+
+import protocol
+
+AVATAR_DISK_BYTES = 32 * 1024 * 1024  # скільки місця на диску займають збережені аватари
+
+
+# --- Кеш готових PhotoImage для аватарів ---
+# Ключ — (нік, хеш аватара, розмір, ефект): кожна картинка декодується, масштабується
+# і перетворюється на PhotoImage один раз. Найдавніше використані записи витісняються.
+# Мітка, що вже показана, тримає власне посилання на PhotoImage, тож витіснення її не ламає.
+class PhotoCache:
+    def __init__(self, build, effect=None, max_items=256):
+        self.build = build        # build(data, size) -> PhotoImage | None
+        self.effect = effect      # назва ефекту, яку застосовує build (входить у ключ)
+        self.max_items = max_items
+        self.items = OrderedDict()
+        self.by_user = {}         # нік -> ключі його записів, щоб швидко інвалідувати
+
+    def get(self, user, digest, data, size=(30, 30)):
+        key = (user, digest, size, self.effect)
+        image = self.items.get(key)
+        if image is not None:
+            self.items.move_to_end(key)
+            return image
+        image = self.build(data, size)
+        if image is None:
+            return None
+        self.items[key] = image
+        self.by_user.setdefault(user, set()).add(key)
+        while len(self.items) > self.max_items:
+            old_key, _ = self.items.popitem(last=False)
+            self.forget_key(old_key)
+        return image
+
+    # новий аватар або зміна ніка — старі картинки цього ніка більше не потрібні
+    def invalidate(self, user):
+        for key in self.by_user.pop(user, ()):
+            self.items.pop(key, None)
+
+    def forget_key(self, key):
+        keys = self.by_user.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.by_user[key[0]]
+
+    def clear(self):
+        self.items.clear()
+        self.by_user.clear()
+
+
+# --- Байти аватарів на диску ---
+# Файл названо хешем вмісту: однакові картинки лежать раз і ніколи не застарівають —
+# новий аватар означає новий хеш. Сервер надсилає лише нік і хеш (AVATARREF), а клієнт
+# просить байти (AVATARGET) тільки за хешами, яких немає ні в пам'яті, ні тут, тож після
+# перепідключення чи перезапуску вже бачені картинки не завантажуються знову.
+# Коли кеш більший за бюджет, витісняються найдавніше використані; час використання —
+# це mtime файлу, тож порядок переживає перезапуск.
+class DiskCache:
+    def __init__(self, directory, max_bytes=AVATAR_DISK_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()  # хеш -> розмір файлу, від найдавніше використаного
+        self.total = 0
+        entries = []
+        try:
+            os.makedirs(directory, exist_ok=True)
+            for entry in os.scandir(directory):
+                if entry.name.startswith("tmp-"):
+                    os.remove(entry.path)  # недописаний файл з минулого запуску
+                elif is_digest(entry.name) and entry.is_file():
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name, stat.st_size))
+        except OSError:
+            self.directory = None  # диск недоступний — працюємо лише з пам'яттю
+            return
+        for _, digest, size in sorted(entries):
+            self.items[digest] = size
+            self.total += size
+        self.evict()
+
+    def get(self, digest):
+        if self.directory is None or digest not in self.items:
+            return None
+        path = os.path.join(self.directory, digest)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # позначаємо як щойно використаний
+        except OSError:
+            self.forget(digest)  # файл прибрав інший екземпляр клієнта
+            return None
+        if protocol.content_hash(data) != digest:
+            self.remove(digest)  # файл пошкоджено — краще завантажити знову
+            return None
+        self.items.move_to_end(digest)
+        return data
+
+    def put(self, digest, data):
+        if self.directory is None or len(data) > self.max_bytes:
+            return
+        if digest in self.items:
+            self.items.move_to_end(digest)
+            return
+        try:
+            # пишемо в тимчасовий файл і перейменовуємо — напівзаписаний аватар не прочитається
+            with tempfile.NamedTemporaryFile(prefix="tmp-", dir=self.directory, delete=False) as f:
+                f.write(data)
+            os.replace(f.name, os.path.join(self.directory, digest))
+        except OSError:
+            return
+        self.items[digest] = len(data)
+        self.total += len(data)
+        self.evict()
+
+    def evict(self):
+        while self.total > self.max_bytes and self.items:
+            self.remove(next(iter(self.items)))
+
+    def remove(self, digest):
+        self.forget(digest)
+        try:
+            os.remove(os.path.join(self.directory, digest))
+        except OSError:
+            pass
+
+    def forget(self, digest):
+        size = self.items.pop(digest, None)
+        if size is not None:
+            self.total -= size
+
+
+def is_digest(name):
+    return len(name) == 64 and all(c in "0123456789abcdef" for c in name)
+
+
+# каталог кешу користувача: %LOCALAPPDATA% на Windows, $XDG_CACHE_HOME або ~/.cache деінде
+def default_cache_dir(name):
+    base = os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME")
+    if not base:
+        base = os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "logitalk", name)
@@ -0,0 +1,418 @@
+import argparse
+import asyncio
+import io
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from array import array
+
+import protocol
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# --- Навантажувальний тест сервера ---
+# N безголових ботів (TEXT/AVATAR/RENAME, v1 або v2) у кількох процесах шлють
+# повідомлення з міткою часу відправки; кожен отримувач рахує затримку розсилки.
+# Поруч знімаємо CPU і RSS процесу сервера. Результат — JSON, щоб порівнювати
+# рушії між собою і ловити регресії.
+BENCH_PREFIX = "bench "
+SAMPLE_EVERY = 0.5   # як часто знімати CPU/RSS сервера, с
+DRAIN_TIME = 1.0     # скільки чекати хвости розсилки після зупинки відправки, с
+
+
+# ====== БОТ ======
+class Bot:
+    def __init__(self, name, args, stats):
+        self.name = name
+        self.args = args
+        self.stats = stats
+        self.reader = None
+        self.writer = None
+        self.frames = None
+        self.proto = protocol.PROTO_TEXT
+        self.task = None
+
+    async def connect(self, avatar):
+        self.reader, self.writer = await asyncio.open_connection(self.args.host, self.args.port)
+        if self.args.proto == protocol.PROTO_BINARY:
+            self.writer.write(protocol.hello_line(protocol.PROTO_BINARY, self.args.features))
+            line = await asyncio.wait_for(self.reader.readline(), protocol.HELLO_TIMEOUT)
+            _, fields = protocol.parse_line(line.decode(errors="ignore").strip())
+            self.proto, _ = protocol.parse_hello(fields)
+        self.frames = protocol.FrameReader(self.proto)
+        self.task = asyncio.ensure_future(self.read_loop())
+        self.send("TEXT", "SYSTEM", f"{self.name} підключився")
+        if avatar is not None:
+            self.send("AVATAR", self.name, "bench.png", avatar)
+        self.stats["connects"] += 1
+
+    def send(self, msg_type, *fields):
+        if self.writer.is_closing():
+            raise ConnectionResetError("з'єднання закрито")  # інакше asyncio засипає лог попередженнями
+        data = protocol.encode(self.proto, msg_type, fields)
+        self.writer.write(data)
+        self.stats["bytes_out"] += len(data)
+
+    async def read_loop(self):
+        latencies = self.stats["latencies"]
+        window = self.stats["window"]
+        try:
+            while True:
+                chunk = await self.reader.read(65536)
+                if not chunk:
+                    break
+                now = time.monotonic_ns()
+                self.stats["bytes_in"] += len(chunk)
+                for msg_type, fields in self.frames.feed(chunk):
+                    self.stats["frames_in"] += 1
+                    if msg_type != "TEXT" or len(fields) < 2 or not fields[1].startswith(BENCH_PREFIX):
+                        continue
+                    sent_at = int(fields[1].split(" ", 2)[1])
+                    if window[0] <= sent_at < window[1]:
+                        latencies.append((now - sent_at) / 1e6)
+                        self.stats["received"] += 1
+        except (OSError, protocol.ProtocolError):
+            self.stats["errors"] += 1
+
+    async def close(self):
+        if self.writer is None:
+            return
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+        if self.task is not None:
+            await self.task
+        self.writer = None
+
+
+# ====== ПРОЦЕС З БОТАМИ ======
+def worker(index, count, args, start_at, results):
+    results.put(asyncio.run(run_worker(index, count, args, start_at)))
+
+
+async def run_worker(index, count, args, start_at):
+    stats = {
+        "connects": 0, "sent": 0, "sent_measured": 0, "received": 0, "frames_in": 0, "bytes_in": 0, "bytes_out": 0,
+        "errors": 0, "connect_errors": 0, "renames": 0, "latencies": array("d"), "window": [0, 0],
+    }
+    measure_from = start_at + args.warmup
+    measure_to = measure_from + args.duration
+    stats["window"][:] = [int(measure_from * 1e9), int(measure_to * 1e9)]
+    avatar = make_avatar(args.avatar_kb)
+    bots = [Bot(f"bot{index}-{i}", args, stats) for i in range(count)]
+    # усі боти підключаються разом — як клієнти після перезапуску сервера; хто не зміг, далі не бере участі
+    started = time.monotonic()
+    connected = await asyncio.gather(*(bot.connect(avatar) for bot in bots), return_exceptions=True)
+    stats["connect_s"] = time.monotonic() - started
+    failed = [bot for bot, result in zip(bots, connected) if isinstance(result, Exception)]
+    stats["connect_errors"] = len(failed)
+    await asyncio.gather(*(bot.close() for bot in failed))
+    bots = [bot for bot, result in zip(bots, connected) if not isinstance(result, Exception)]
+
+    await asyncio.sleep(max(0, start_at - time.monotonic()))
+    tasks = [asyncio.ensure_future(send_loop(bot, stats, measure_to)) for bot in bots]
+    if args.churn > 0:
+        tasks.append(asyncio.ensure_future(churn_loop(bots, args.churn / args.workers, avatar, measure_to)))
+    if args.renames > 0:
+        tasks.append(asyncio.ensure_future(rename_loop(bots, args.renames / args.workers, stats, measure_to)))
+    await asyncio.gather(*tasks)
+
+    await asyncio.sleep(DRAIN_TIME)
+    await asyncio.gather(*(bot.close() for bot in bots))
+    stats["latencies"] = stats["latencies"].tobytes()
+    del stats["window"]
+    return stats
+
+
+async def send_loop(bot, stats, stop_at):
+    interval = 1 / bot.args.rate
+    padding = "x" * max(0, bot.args.message_size - 32)
+    window = stats["window"]
+    # випадковий зсув, щоб боти не стріляли всі в одну мить
+    await asyncio.sleep(random.uniform(0, interval))
+    next_at = time.monotonic()
+    while next_at < stop_at:
+        if bot.writer is not None:
+            try:
+                sent_at = time.monotonic_ns()
+                bot.send("TEXT", bot.name, f"{BENCH_PREFIX}{sent_at} {padding}")
+                stats["sent"] += 1
+                if window[0] <= sent_at < window[1]:
+                    stats["sent_measured"] += 1
+                if bot.writer.transport.get_write_buffer_size() > 1024 * 1024:
+                    await bot.writer.drain()  # сервер не встигає читати — не роздуваємо буфер
+            except OSError:
+                stats["errors"] += 1
+        next_at += interval
+        await asyncio.sleep(max(0, next_at - time.monotonic()))
+
+
+# вихід і повторний вхід випадкового бота
+async def churn_loop(bots, per_second, avatar, stop_at):
+    while time.monotonic() < stop_at:
+        await asyncio.sleep(random.expovariate(per_second))
+        bot = random.choice(bots)
+        await bot.close()
+        try:
+            await bot.connect(avatar)
+        except (OSError, asyncio.TimeoutError):
+            bot.stats["errors"] += 1
+
+
+async def rename_loop(bots, per_second, stats, stop_at):
+    while time.monotonic() < stop_at:
+        await asyncio.sleep(random.expovariate(per_second))
+        bot = random.choice(bots)
+        if bot.writer is None:
+            continue
+        old = bot.name
+        base, _, generation = old.partition("~")
+        bot.name = f"{base}~{int(generation or 0) + 1}"
+        try:
+            bot.send("RENAME", old, bot.name)
+            stats["renames"] += 1
+        except OSError:
+            stats["errors"] += 1
+
+
+# шум у PNG не стискається — розмір файлу близький до заданого
+def make_avatar(size_kb):
+    if size_kb <= 0:
+        return None
+    if Image is None:
+        return os.urandom(size_kb * 1024)  # без Pillow — сирі байти (запускайте сервер з --avatar-workers 0)
+    side = max(1, int(math.sqrt(size_kb * 1024 / 3)))
+    out = io.BytesIO()
+    Image.frombytes("RGB", (side, side), os.urandom(side * side * 3)).save(out, format="PNG")
+    return out.getvalue()
+
+
+# ====== СЕРВЕР ======
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# журнал і файли — у тимчасовому каталозі: кожен прогін починає з чистої історії
+# і не смітить у робочому каталозі (--server-arg може їх перевизначити)
+def start_server(args, directory):
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py"),
+               "--host", args.host, "--port", str(args.port), "--engine", args.engine,
+               "--history-dir", os.path.join(directory, "history"), "--files-dir", os.path.join(directory, "files"),
+               *args.server_arg]
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=directory)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((args.host, args.port), timeout=0.2).close()
+            return server
+        except OSError:
+            if server.poll() is not None:
+                raise SystemExit(f"server.py завершився з кодом {server.returncode}")
+            time.sleep(0.1)
+    server.kill()
+    raise SystemExit("server.py не відкрив порт за 10 с")
+
+
+# --- CPU і пам'ять сервера з /proc (разом з дочірніми процесами пулу аватарів) ---
+def process_tree(pid):
+    pids = [pid]
+    try:
+        for entry in os.listdir("/proc"):
+            if entry.isdigit() and proc_stat(int(entry), 4) == pid:
+                pids.append(int(entry))
+    except OSError:
+        pass
+    return pids
+
+
+def proc_stat(pid, field):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # друге поле (ім'я) може містити пробіли — рахуємо від закриваючої дужки (поля з 3-го)
+            return int(f.read().rsplit(")", 1)[1].split()[field - 3])
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def cpu_seconds(pids):
+    ticks = os.sysconf("SC_CLK_TCK")
+    total = 0
+    for pid in pids:
+        utime, stime = proc_stat(pid, 14), proc_stat(pid, 15)
+        if utime is not None:
+            total += (utime + stime) / ticks
+    return total
+
+
+def rss_bytes(pids):
+    total = 0
+    for pid in pids:
+        rss = proc_stat(pid, 24)
+        if rss is not None:
+            total += rss * os.sysconf("SC_PAGE_SIZE")
+    return total
+
+
+# ====== ЗВІТ ======
+def percentile(values, fraction):
+    if not values:
+        return None
+    index = min(len(values) - 1, int(math.ceil(fraction * len(values))) - 1)
+    return round(values[max(0, index)], 3)
+
+
+def summarize(args, stats_list, server_samples, elapsed):
+    latencies = array("d")
+    totals = {}
+    connect_s = 0.0
+    for stats in stats_list:
+        latencies.frombytes(stats.pop("latencies"))
+        connect_s = max(connect_s, stats.pop("connect_s"))  # процеси підключаються паралельно
+        for key, value in stats.items():
+            totals[key] = totals.get(key, 0) + value
+    values = sorted(latencies)
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key != "out"},
+        "platform": {"python": platform.python_version(), "system": platform.platform(), "cpus": os.cpu_count()},
+        "elapsed_s": round(elapsed, 3),
+        "connect_s": round(connect_s, 3),
+        "totals": totals,
+        "throughput": {
+            "sent_per_s": round(totals["sent"] / elapsed, 1),
+            "delivered_per_s": round(totals["received"] / args.duration, 1),
+            # частка доставлених кадрів від очікуваних (кожне повідомлення — всім, крім автора)
+            "delivery_ratio": round(totals["received"] / max(1, totals["sent_measured"] * (args.clients - 1)), 4)
+            if args.clients > 1 else None,
+        },
+        "latency_ms": {
+            "count": len(values),
+            "p50": percentile(values, 0.50),
+            "p99": percentile(values, 0.99),
+            "p999": percentile(values, 0.999),
+            "max": round(values[-1], 3) if values else None,
+        },
+        "server": server_samples,
+    }
+    return report
+
+
+# ====== ЗАПУСК ======
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Навантажувальний тест сервера LogiTalk")
+    parser.add_argument("--clients", type=int, default=50, help="скільки ботів підключити")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1),
+                        help="процесів з ботами (один процес Python сам стає вузьким місцем)")
+    parser.add_argument("--rate", type=float, default=1.0,
+                        help="повідомлень на секунду від кожного бота (понад --msg-rate сервер стримує, "
+                             "див. --server-arg=--no-flood-limits)")
+    parser.add_argument("--message-size", type=int, default=64, help="приблизний розмір тексту повідомлення, байт")
+    parser.add_argument("--avatar-kb", type=int, default=0, help="аватар такого розміру при кожному вході (0 — без аватарів)")
+    parser.add_argument("--churn", type=float, default=0, help="виходів і повторних входів на секунду (усього)")
+    parser.add_argument("--renames", type=float, default=0, help="змін ніка на секунду (усього)")
+    parser.add_argument("--proto", type=int, choices=(protocol.PROTO_TEXT, protocol.PROTO_BINARY),
+                        default=protocol.PROTO_TEXT, help="1 — текстовий протокол, 2 — v2 через HELLO")
+    parser.add_argument("--features", default="", help="можливості для HELLO у v2 через кому (напр. avatar-ref,deflate)")
+    parser.add_argument("--warmup", type=float, default=2.0, help="секунд розігріву, які не потрапляють у статистику")
+    parser.add_argument("--duration", type=float, default=10.0, help="секунд вимірювання")
+    parser.add_argument("--engine", choices=("thread", "asyncio"), default="thread", help="рушій запущеного сервера")
+    parser.add_argument("--server-arg", action="append", default=[],
+                        help="додатковий аргумент для server.py (можна кілька разів)")
+    parser.add_argument("--connect", metavar="HOST:PORT",
+                        help="не запускати сервер, а навантажувати вже запущений (без CPU/RSS)")
+    parser.add_argument("--out", default="bench_output.json", help="куди записати результат у JSON")
+    args = parser.parse_args(argv)
+    args.features = sorted(filter(None, args.features.split(",")))
+    args.workers = max(1, min(args.workers, args.clients))
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = server_dir = None
+    if args.connect:
+        host, _, port = args.connect.rpartition(":")
+        args.host, args.port = host or "127.0.0.1", int(port)
+    else:
+        args.host, args.port = "127.0.0.1", free_port()
+        server_dir = tempfile.mkdtemp(prefix="logitalk-bench-")
+        try:
+            server = start_server(args, server_dir)
+        except BaseException:
+            shutil.rmtree(server_dir, ignore_errors=True)
+            raise
+
+    try:
+        pids = process_tree(server.pid) if server is not None else []
+        cpu_before, wall_before = cpu_seconds(pids), time.monotonic()
+        # усі процеси починають слати одночасно — після того, як підключать своїх ботів
+        start_at = time.monotonic() + 2 + args.clients / 500
+        results = multiprocessing.Queue()
+        shares = [args.clients // args.workers + (i < args.clients % args.workers) for i in range(args.workers)]
+        processes = [
+            multiprocessing.Process(target=worker, args=(i, count, args, start_at, results), daemon=True)
+            for i, count in enumerate(shares)
+        ]
+        for process in processes:
+            process.start()
+
+        rss_peak = 0
+        stats_list = []
+        while len(stats_list) < len(processes):
+            if server is not None:
+                pids = process_tree(server.pid)
+                rss_peak = max(rss_peak, rss_bytes(pids))
+            try:
+                stats_list.append(results.get(timeout=SAMPLE_EVERY))
+            except Exception:
+                if not any(process.is_alive() for process in processes) and results.empty():
+                    raise SystemExit("процес з ботами впав — дивіться вивід вище")
+        elapsed = args.warmup + args.duration
+        server_samples = None
+        if server is not None:
+            cpu = cpu_seconds(pids) - cpu_before
+            server_samples = {
+                "cpu_s": round(cpu, 3),
+                "cpu_percent": round(100 * cpu / (time.monotonic() - wall_before), 1),
+                "rss_peak_mb": round(rss_peak / 2 ** 20, 1),
+                "rss_end_mb": round(rss_bytes(pids) / 2 ** 20, 1),
+            }
+        for process in processes:
+            process.join()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+            shutil.rmtree(server_dir, ignore_errors=True)
+
+    report = summarize(args, stats_list, server_samples, elapsed)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    latency = report["latency_ms"]
+    print(f"Підключено {report['totals']['connects']} ботів за {report['connect_s']} с, "
+          f"не вдалося {report['totals']['connect_errors']}")
+    print(f"Відправлено {report['totals']['sent']}, доставлено {report['totals']['received']} "
+          f"({report['throughput']['delivered_per_s']}/с)")
+    print(f"Затримка, мс: p50 {latency['p50']}, p99 {latency['p99']}, p999 {latency['p999']}, max {latency['max']}")
+    if server_samples:
+        print(f"Сервер: CPU {server_samples['cpu_percent']}%, RSS пік {server_samples['rss_peak_mb']} МБ")
+    print(f"Результат: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+import hashlib
+import os
+import random
+import socket
+import threading
+import time
+from collections import deque
+
+import protocol
+import tracing
+from transfers import CHUNK_SIZE, UPLOAD_WINDOW
+
+# --- Повторні підключення ---
+RECONNECT_BASE = 0.5   # перша пауза перед повтором, с
+RECONNECT_MAX = 30.0   # найдовша пауза, с
+CONNECT_TIMEOUT = 10.0
+
+
+# експоненційна пауза з джитером: половина — фіксована, половина — випадкова,
+# щоб після перезапуску сервера клієнти не ломились усі в одну мить
+def backoff_delay(attempt):
+    delay = min(RECONNECT_MAX, RECONNECT_BASE * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def format_size(size):
+    for unit in ("Б", "КБ", "МБ"):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} ГБ"
+
+
+# --- Передачі в дорозі ---
+class Upload:
+    def __init__(self, path, kind, name, size):
+        self.path = path
+        self.kind = kind
+        self.name = name
+        self.size = size
+        self.sent = 0       # скільки байтів поставлено в чергу
+        self.acked = 0      # скільки сервер підтвердив
+        self.error = None   # причина, якщо сервер відмовив або зв'язок обірвався
+
+
+class Download:
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+        self.file = open(path, "wb")
+        self.received = 0
+
+
+# --- З'єднання клієнта з сервером (спільне для client.py і show.py) ---
+# Живе у власному потоці: підключається, читає кадри і після обриву сам
+# підключається знову. Сервер нумерує розіслані кадри (seq) і видає токен сесії;
+# при повторному підключенні клієнт надсилає RESUME@токен@останній seq і отримує
+# лише пропущене. Віджетів не чіпає: кадри й події віддає колбекам,
+# які клієнт перекладає у свою чергу для головного потоку.
+#   on_frame(msg_type, parts)
+#   on_status(event, detail): "connected" (True — пробуємо відновити сесію),
+#   "resumed", "resume-failed", "disconnected" (пауза до повтору), "retry" ((помилка, пауза)),
+#   "upload-done" ((kind, name)), "upload-failed" ((kind, name, причина)),
+#   "download-done" (шлях), "download-failed" ((назва, причина))
+# Кадри відправляє окремий потік-письменник із двох черг: звичайні кадри завжди
+# йдуть раніше за шматки завантажень, тож повідомлення не стоїть за мегабайтами файлу,
+# а UI-потік ніколи не блокується на sendall.
+class ChatConnection:
+    def __init__(self, host, port, features, on_frame, on_status, history=0):
+        self.host = host
+        self.port = port
+        self.features = set(features) | {
+            protocol.FEATURE_RESUME, protocol.FEATURE_BLOB, protocol.FEATURE_DEFLATE, protocol.FEATURE_ROOMS,
+        }
+        self.on_frame = on_frame
+        self.on_status = on_status
+        self.history = history          # скільки останніх повідомлень просити при новому вході
+        self.sock = None
+        self.proto = protocol.PROTO_TEXT
+        self.accepted = set()           # можливості, погоджені сервером
+        self.deflate = False            # стискати великі кадри (сервер погодив FEATURE_DEFLATE)
+        self.out_lock = threading.Condition()  # захищає sock і черги відправки
+        self.outbox = (deque(), deque())   # (звичайні кадри, шматки завантажень)
+        self.uploads = {}               # id -> Upload
+        self.downloads = {}             # hash -> Download
+        self.session = None             # токен сесії від сервера
+        self.resuming = False           # надіслали RESUME і чекаємо відповіді
+        self.last_seq = 0               # найбільший seq, який ми отримали (у кожної кімнати свій відлік)
+        self.room = protocol.DEFAULT_ROOM  # кімната, у яку сервер нас перевів
+        self.closed = False
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def close(self):
+        self.closed = True
+        with self.out_lock:
+            sock, self.sock = self.sock, None
+            self.out_lock.notify_all()
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+    # лише ставить кадр у чергу; bulk — шматок завантаження, піде після звичайних кадрів
+    def send(self, msg_type, *fields, bulk=False):
+        data = protocol.encode(self.proto, msg_type, fields, self.deflate)
+        with self.out_lock:
+            if self.sock is None:
+                raise OSError("немає з'єднання з сервером")
+            self.outbox[bulk].append(data)
+            self.out_lock.notify_all()
+
+    def writer_loop(self, sock):
+        while True:
+            with self.out_lock:
+                while self.sock is sock and not (self.outbox[0] or self.outbox[1]):
+                    self.out_lock.wait()
+                if self.sock is not sock:
+                    return
+                data = (self.outbox[0] or self.outbox[1]).popleft()
+                self.out_lock.notify_all()  # потік завантаження чекає на місце в черзі
+            try:
+                sock.sendall(data)
+            except OSError:
+                # читання в recv_loop теж обірветься — далі звичайне перепідключення
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                return
+
+    # ====== ЦИКЛ З'ЄДНАННЯ ======
+    def run(self):
+        attempt = 0
+        while not self.closed:
+            try:
+                pending = self.connect()
+            except OSError as e:
+                delay = backoff_delay(attempt)
+                attempt += 1
+                self.on_status("retry", (e, delay))
+                time.sleep(delay)
+                continue
+            attempt = 0
+            self.recv_loop(pending)
+            with self.out_lock:
+                sock, self.sock = self.sock, None
+                self.out_lock.notify_all()
+            if sock is not None:
+                sock.close()
+            self.abort_transfers("зв'язок із сервером обірвався")
+            if self.closed:
+                break
+            delay = backoff_delay(attempt)
+            attempt += 1
+            self.on_status("disconnected", delay)
+            time.sleep(delay)
+
+    def connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=CONNECT_TIMEOUT)
+        sock.settimeout(None)
+        try:
+            # пропонуємо v2; старий сервер не відповість — лишимось на текстовому протоколі
+            proto, accepted, pending = protocol.client_handshake(sock, self.features)
+        except OSError:
+            sock.close()
+            raise
+        with self.out_lock:
+            self.sock, self.proto, self.accepted = sock, proto, accepted
+            self.deflate = proto == protocol.PROTO_BINARY and protocol.FEATURE_DEFLATE in accepted
+            for queue in self.outbox:
+                queue.clear()  # кадри, не відправлені до обриву, застаріли разом із з'єднанням
+        threading.Thread(target=self.writer_loop, args=(sock,), daemon=True).start()
+        # сервер щойно поставив нас у загальну кімнату — повертаємось у свою до RESUME,
+        # бо seq і журнал, з якого доганяти, у кожної кімнати свої
+        if self.room != protocol.DEFAULT_ROOM:
+            if protocol.FEATURE_ROOMS in accepted:
+                self.send("JOIN", self.room)
+            else:
+                self.room, self.session = protocol.DEFAULT_ROOM, None
+        resuming = self.session is not None and protocol.FEATURE_RESUME in accepted
+        self.resuming = resuming
+        if resuming:
+            self.send("RESUME", self.session, str(self.last_seq))
+        else:
+            self.request_history()
+        self.on_status("connected", resuming)
+        return pending
+
+    # False — сервер без кімнат; перехід підтвердить кадр JOIN від сервера
+    def join(self, room):
+        if protocol.FEATURE_ROOMS not in self.accepted:
+            return False
+        self.send("JOIN", room)
+        return True
+
+    # сервер з журналом віддасть останні повідомлення — просимо їх до власного привітання
+    def request_history(self):
+        if self.history and protocol.FEATURE_HISTORY in self.accepted:
+            self.send("HISTORY", "last", str(self.history))
+
+    def recv_loop(self, pending):
+        reader = protocol.FrameReader(self.proto)
+        frames = reader.feed(pending)  # байти, прочитані разом з відповіддю на HELLO
+        while True:
+            try:
+                with tracing.root("recv", "net"):
+                    for msg_type, parts in frames:
+                        if msg_type == "JOIN" and parts and parts[0] != self.room:
+                            reader.seq = self.last_seq = 0  # далі кадри нової кімнати з її власними seq
+                        elif reader.seq > self.last_seq:
+                            self.last_seq = reader.seq
+                        self.handle_frame(msg_type, parts)
+                if not reader.recv_from(self.sock):
+                    break
+                frames = reader.frames()
+            except (OSError, AttributeError, protocol.ProtocolError):
+                break
+
+    # ====== ЗАВАНТАЖЕННЯ НА СЕРВЕР ======
+    # Файл читається шматками в окремому потоці; False — сервер не вміє BLOB,
+    # тоді клієнт сам вирішує, чи слати дані по-старому.
+    def upload(self, path, kind, user, name):
+        if protocol.FEATURE_BLOB not in self.accepted:
+            return False
+        upload_id = os.urandom(8).hex()
+        upload = Upload(path, kind, name, os.path.getsize(path))
+        self.uploads[upload_id] = upload
+        try:
+            self.send("BLOBSTART", upload_id, kind, str(upload.size), user, name)
+        except OSError:
+            del self.uploads[upload_id]
+            raise
+        threading.Thread(target=self.upload_loop, args=(upload_id, upload, self.sock), daemon=True).start()
+        return True
+
+    def upload_loop(self, upload_id, upload, sock):
+        hasher = hashlib.sha256()
+        try:
+            with open(upload.path, "rb") as f:
+                while True:
+                    with self.out_lock:
+                        # чекаємо кредиту від сервера і поки письменник забере попередній шматок
+                        while (self.sock is sock and upload.error is None and
+                               (upload.sent - upload.acked >= UPLOAD_WINDOW * CHUNK_SIZE or self.outbox[1])):
+                            self.out_lock.wait()
+                        if upload.error is not None:
+                            return  # про відмову вже повідомлено
+                        if self.sock is not sock:
+                            raise OSError("зв'язок із сервером обірвався")
+                    data = f.read(CHUNK_SIZE)
+                    if not data:
+                        break
+                    hasher.update(data)
+                    self.send("BLOBCHUNK", upload_id, data, bulk=True)
+                    upload.sent += len(data)
+            self.send("BLOBEND", upload_id, hasher.hexdigest())
+        except OSError as e:
+            self.fail_upload(upload_id, str(e))
+
+    def fail_upload(self, upload_id, reason):
+        with self.out_lock:
+            upload = self.uploads.pop(upload_id, None)
+            if upload is None:
+                return
+            upload.error = reason
+            self.out_lock.notify_all()
+        self.on_status("upload-failed", (upload.kind, upload.name, reason))
+
+    # ====== ЗАВАНТАЖЕННЯ З СЕРВЕРА ======
+    # шматки пишуться у файл просто в потоці з'єднання, у UI приходить лише результат
+    def download(self, digest, path, name):
+        if digest in self.downloads:
+            return
+        self.downloads[digest] = Download(path, name)
+        try:
+            self.send("FILEGET", digest)
+        except OSError as e:
+            self.fail_download(digest, str(e))
+
+    def download_chunk(self, digest, offset, data):
+        download = self.downloads.get(digest)
+        if download is None:
+            return
+        if offset != str(download.received):
+            self.fail_download(digest, "шматки прийшли не по порядку")
+            return
+        try:
+            download.file.write(data)
+        except OSError as e:
+            self.fail_download(digest, str(e))
+            return
+        download.received += len(data)
+
+    def finish_download(self, digest, status):
+        download = self.downloads.pop(digest, None)
+        if download is None:
+            return
+        if status != "ok":
+            self.downloads[digest] = download
+            self.fail_download(digest, "файлу немає на сервері")
+            return
+        download.file.close()
+        self.on_status("download-done", download.path)
+
+    def fail_download(self, digest, reason):
+        download = self.downloads.pop(digest, None)
+        if download is None:
+            return
+        download.file.close()
+        try:
+            os.remove(download.path)
+        except OSError:
+            pass
+        self.on_status("download-failed", (download.name, reason))
+
+    def abort_transfers(self, reason):
+        for upload_id in list(self.uploads):
+            self.fail_upload(upload_id, reason)
+        for digest in list(self.downloads):
+            self.fail_download(digest, reason)
+
+    # службові кадри сесії й передач обробляємо тут, решту віддаємо клієнту
+    def handle_frame(self, msg_type, parts):
+        if msg_type == "BLOBACK" and len(parts) >= 2:
+            upload = self.uploads.get(parts[0])
+            if upload is not None and parts[1].isdigit():
+                with self.out_lock:
+                    upload.acked = int(parts[1])
+                    self.out_lock.notify_all()
+        elif msg_type == "BLOBEND" and parts:
+            upload = self.uploads.pop(parts[0], None)
+            if upload is not None:
+                self.on_status("upload-done", (upload.kind, upload.name))
+        elif msg_type == "BLOBFAIL" and len(parts) >= 2:
+            self.fail_upload(parts[0], parts[1])
+        elif msg_type == "FILEDATA" and len(parts) >= 3:
+            self.download_chunk(*parts[:3])
+        elif msg_type == "FILEEND" and len(parts) >= 2:
+            self.finish_download(parts[0], parts[1])
+        elif msg_type == "JOIN" and parts:
+            if parts[0] != self.room:
+                self.room = parts[0]
+                self.request_history()
+                self.on_frame(msg_type, parts)
+        elif msg_type == "HISTORY" and len(parts) >= 2 and parts[0] == "end":
+            # досилання могло пропустити наші власні кадри — позиція все одно за останнім прочитаним
+            if parts[1].isdigit() and int(parts[1]) > self.last_seq:
+                self.last_seq = int(parts[1])
+            self.on_frame(msg_type, parts)
+        elif msg_type == "SESSION" and parts:
+            self.session = parts[0]
+        elif msg_type == "RESUME":
+            if not self.resuming:
+                return  # відповідь приймаємо лише на власний RESUME
+            self.resuming = False
+            if parts and parts[0] == "ok":
+                self.on_status("resumed", None)
+            else:
+                # сервер не може догнати нас з журналу — входимо наново
+                self.session = None
+                self.request_history()
+                self.on_status("resume-failed", None)
+        else:
+            self.on_frame(msg_type, parts)
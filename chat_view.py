@@ -0,0 +1,272 @@
+import sys
+import tkinter
+from bisect import bisect_left, bisect_right
+from collections import deque
+from itertools import islice
+
+from customtkinter import CTkFrame, CTkLabel, CTkScrollbar
+
+import tracing
+
+
+# --- Один запис історії чату: вся модель — лише ці поля, без віджетів ---
+class ChatRecord:
+    __slots__ = ("message", "username", "self_message", "system", "action", "height")
+
+    def __init__(self, message, username=None, self_message=False, system=False, action=None):
+        self.message = message
+        self.username = username
+        self.self_message = self_message
+        self.system = system
+        self.action = action  # що робити при кліку на повідомлення (напр. зберегти файл)
+        self.height = None  # виміряна висота рядка; None — ще не показувався
+
+
+# --- Віджети одного рядка; клієнт сам налаштовує їх під запис у bind_row ---
+class MessageRow:
+    def __init__(self, parent, system_style, name_style, text_style):
+        self.frame = CTkFrame(parent, fg_color="transparent")
+        self.system = CTkLabel(self.frame, **system_style)
+        self.avatar = CTkLabel(self.frame, text="")
+        self.bubble = CTkFrame(self.frame, corner_radius=10)
+        self.name = CTkLabel(self.bubble, **name_style)
+        self.text = CTkLabel(self.bubble, wraplength=300, justify="left", anchor="w", **text_style)
+        self.window = None  # id вікна на полотні
+        self.action = None  # клік прив'язуємо раз, а рядок лише підміняє дію під свій запис
+        self.text.bind("<Button-1>", self.on_click)
+
+    # ховаємо все перед повторним використанням рядка
+    def clear(self):
+        for widget in (self.system, self.avatar, self.bubble, self.name, self.text):
+            widget.pack_forget()
+        self.action = None
+
+    def on_click(self, event):
+        if self.action is not None:
+            self.action()
+
+
+# --- Віртуалізований список повідомлень ---
+# Історія живе в компактній моделі (deque з ChatRecord, з необов'язковою межею),
+# а віджети існують лише для рядків у вікні перегляду та поруч із ним.
+# Рядки, що виїхали за межі, повертаються в пул і перевикористовуються.
+class VirtualChatView(CTkFrame):
+    def __init__(self, master, make_row, bind_row, history_limit=None, overscan=4, row_gap=4,
+                 width=200, height=200, **kwargs):
+        super().__init__(master, width=0, height=0, **kwargs)
+        self.make_row = make_row          # make_row(parent) -> MessageRow
+        self.bind_row = bind_row          # bind_row(row, record) — заповнює віджети під запис
+        self.overscan = overscan          # скільки рядків тримати зверху/знизу про запас
+        self.row_gap = row_gap            # відступ між рядками
+        self.records = deque(maxlen=history_limit)
+        self.offsets = [0]                # offsets[i] — y верхнього краю i-го запису
+        self.layout_from = 0              # з якого індексу offsets застаріли
+        self.bound = {}                   # запис -> рядок, який зараз його показує
+        self.pool = []                    # вільні рядки
+        self.estimates = {True: 30, False: 60}  # середня висота системних/звичайних рядків
+        self.refresh_pending = False
+        self.rebind_pending = False
+
+        self.canvas = tkinter.Canvas(self, highlightthickness=0, yscrollincrement=20,
+                                     width=self._apply_widget_scaling(width),
+                                     height=self._apply_widget_scaling(height))
+        self.scrollbar = CTkScrollbar(self, orientation="vertical", command=self.canvas.yview)
+        self.canvas.configure(yscrollcommand=self.on_yscroll)
+        self.grid_columnconfigure(0, weight=1)
+        self.grid_rowconfigure(0, weight=1)
+        self.canvas.grid(row=0, column=0, sticky="nsew", padx=(6, 0), pady=6)
+        self.scrollbar.grid(row=0, column=1, sticky="ns", padx=(0, 3), pady=6)
+        self.update_canvas_bg()
+
+        self.canvas.bind("<Configure>", self.on_canvas_configure)
+        if "linux" in sys.platform:
+            self.bind_all("<Button-4>", self.on_mouse_wheel, add=True)
+            self.bind_all("<Button-5>", self.on_mouse_wheel, add=True)
+        else:
+            self.bind_all("<MouseWheel>", self.on_mouse_wheel, add=True)
+
+    # ====== МОДЕЛЬ ======
+    def append(self, record):
+        if len(self.records) == self.records.maxlen:
+            dropped = self.records[0]
+            self.release(dropped)
+            self.layout_from = 0  # перший запис зникає — зсуваються всі відступи
+        self.records.append(record)
+        self.schedule_refresh()
+
+    def clear(self):
+        for record in list(self.bound):
+            self.release(record)
+        self.records.clear()
+        self.offsets = [0]
+        self.layout_from = 0
+        self.schedule_refresh()
+
+    # перемалювати видимі рядки (новий аватар, зміна теми) — разом з наступним refresh
+    def rebind(self):
+        self.rebind_pending = True
+        self.schedule_refresh()
+
+    # ====== РОЗКЛАДКА ======
+    def estimate(self, record):
+        return record.height if record.height is not None else self.estimates[record.system]
+
+    def update_offsets(self):
+        count = len(self.records)
+        start = min(self.layout_from, len(self.offsets) - 1, count)
+        del self.offsets[start + 1:]
+        y = self.offsets[start]
+        for record in islice(self.records, start, None):
+            y += self.estimate(record)
+            self.offsets.append(y)
+        self.layout_from = count
+
+    def total_height(self):
+        return self.offsets[-1]
+
+    # дешеве оновлення меж прокрутки без створення віджетів (для плавної прокрутки донизу)
+    def sync_scrollregion(self):
+        if self.layout_from < len(self.records):
+            self.update_offsets()
+        self.canvas.configure(scrollregion=(0, 0, self.canvas.winfo_width(), self.total_height()))
+
+    def schedule_refresh(self):
+        if not self.refresh_pending:
+            self.refresh_pending = True
+            self.after_idle(self.refresh)
+
+    def refresh(self):
+        with tracing.root("refresh", "ui", records=len(self.records)):
+            self.redraw()
+
+    def redraw(self):
+        self.refresh_pending = False
+        if self.layout_from < len(self.records):
+            self.update_offsets()
+        self.canvas.configure(scrollregion=(0, 0, self.canvas.winfo_width(), self.total_height()))
+
+        first, last = self.visible_range()
+        wanted = set(islice(self.records, first, last))
+        for record in [r for r in self.bound if r not in wanted]:
+            self.release(record)
+
+        rebind = self.rebind_pending
+        self.rebind_pending = False
+        new_rows = []
+        for index, record in enumerate(islice(self.records, first, last), start=first):
+            row = self.bound.get(record)
+            if row is None:
+                row = self.acquire(record)
+                new_rows.append((index, record, row))
+            elif rebind:
+                row.clear()
+                self.bind_row(row, record)
+                new_rows.append((index, record, row))
+            self.place_row(row, record, self.offsets[index])
+
+        if new_rows and self.measure(new_rows):
+            # справжні висоти відрізнялись від оцінки — переставляємо показані рядки
+            self.update_offsets()
+            self.canvas.configure(scrollregion=(0, 0, self.canvas.winfo_width(), self.total_height()))
+            for index, record in enumerate(islice(self.records, first, last), start=first):
+                row = self.bound.get(record)
+                if row is not None:
+                    self.place_row(row, record, self.offsets[index])
+
+    def visible_range(self):
+        top = self.canvas.canvasy(0)
+        bottom = top + max(self.canvas.winfo_height(), 1)
+        first = max(0, bisect_right(self.offsets, top) - 1 - self.overscan)
+        last = min(len(self.records), bisect_left(self.offsets, bottom) + self.overscan)
+        return first, last
+
+    def measure(self, new_rows):
+        self.canvas.update_idletasks()
+        changed = False
+        for index, record, row in new_rows:
+            height = row.frame.winfo_reqheight() + self.row_gap
+            if record.height != height:
+                record.height = height
+                changed = True
+                self.layout_from = min(self.layout_from, index)
+            # ковзне середнє — краща оцінка для ще не показаних рядків
+            self.estimates[record.system] = (self.estimates[record.system] * 7 + height) // 8
+        return changed
+
+    def place_row(self, row, record, y):
+        width = self.canvas.winfo_width()
+        if record.system:
+            x, anchor = width // 2, "n"
+        elif record.self_message:
+            x, anchor = width - 5, "ne"
+        else:
+            x, anchor = 5, "nw"
+        if row.window is None:
+            row.window = self.canvas.create_window(x, y, window=row.frame, anchor=anchor)
+        else:
+            self.canvas.coords(row.window, x, y)
+            self.canvas.itemconfigure(row.window, anchor=anchor, state="normal")
+
+    # ====== ПУЛ РЯДКІВ ======
+    def acquire(self, record):
+        row = self.pool.pop() if self.pool else self.make_row(self.canvas)
+        row.clear()
+        self.bind_row(row, record)
+        self.bound[record] = row
+        return row
+
+    def release(self, record):
+        row = self.bound.pop(record, None)
+        if row is not None:
+            if row.window is not None:
+                self.canvas.itemconfigure(row.window, state="hidden")
+            self.pool.append(row)
+
+    # ====== ПРОКРУТКА ======
+    def on_yscroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self.schedule_refresh()
+
+    def on_canvas_configure(self, event):
+        for record, row in self.bound.items():
+            self.place_row(row, record, self.canvas.coords(row.window)[1])
+        self.schedule_refresh()
+
+    def on_mouse_wheel(self, event):
+        if not str(event.widget).startswith(str(self.canvas)):
+            return
+        if sys.platform.startswith("win"):
+            step = -int(event.delta / 120) or (-1 if event.delta > 0 else 1)
+        elif sys.platform == "darwin":
+            step = -event.delta
+        else:
+            step = -1 if event.num == 4 else 1
+        self.canvas.yview_scroll(step, "units")
+
+    def scroll_to_bottom(self):
+        self.refresh()
+        self.canvas.yview_moveto(1.0)
+
+    # ====== РОЗМІРИ ТА ТЕМА ======
+    def configure(self, require_redraw=False, **kwargs):
+        if not hasattr(self, "canvas"):
+            return super().configure(require_redraw=require_redraw, **kwargs)
+        if "width" in kwargs:
+            self.canvas.configure(width=self._apply_widget_scaling(kwargs.pop("width")))
+        if "height" in kwargs:
+            self.canvas.configure(height=self._apply_widget_scaling(kwargs.pop("height")))
+        super().configure(require_redraw=require_redraw, **kwargs)
+        if "fg_color" in kwargs:
+            self.update_canvas_bg()
+
+    def _set_appearance_mode(self, mode_string):
+        super()._set_appearance_mode(mode_string)
+        self.update_canvas_bg()
+
+    def update_canvas_bg(self):
+        if not hasattr(self, "canvas"):
+            return
+        color = self.cget("fg_color")
+        if color == "transparent":
+            color = self.cget("bg_color")
+        self.canvas.configure(bg=self._apply_appearance_mode(color))
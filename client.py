@@ -1,11 +1,24 @@
-import threading
-import base64
+import queue
 import io
-from socket import *
+import os
 from customtkinter import *
 from tkinter import filedialog
 from PIL import Image, ImageTk
 
+import protocol
+import tracing
+from avatar_cache import DiskCache, PhotoCache, default_cache_dir
+from chat_view import ChatRecord, MessageRow, VirtualChatView
+from layout import ChatLayout
+from animation import FrameScheduler
+from chat_client import ChatConnection, format_size
+
+HISTORY_LIMIT = 5000  # скільки повідомлень тримати в історії чату (None — без обмеження)
+UI_POLL_MS = 30       # як часто головний потік забирає кадри, отримані recv_loop
+UI_BATCH_LIMIT = 500  # скільки кадрів обробляти за один прохід, щоб не підвішувати інтерфейс
+MENU_WIDTH = 200      # ширина відкритого бокового меню
+HISTORY_BACKFILL = 50  # скільки останніх повідомлень просити в сервера після підключення
+
 # ===== ГОЛОВНЕ ВІКНО ЧАТУ =====
 class MainWindow(CTk):
     def __init__(self, username, host, port, avatar_path=None):
@@ -17,17 +30,26 @@ class MainWindow(CTk):
         self.username = username or "Користувач"
         self.host = host
         self.port = port
-        self.sock = None
+        self.conn = None                  # ChatConnection: підключення, читання і повторні спроби
 
         self.is_show_menu = False
         self.frame_width = 0
         self.menu_show_speed = 20
 
         self.avatar_path = avatar_path
-        self.avatars: dict[str, bytes] = {}
+        self.avatars: dict[str, str] = {}         # нік -> хеш аватара
+        self.avatar_blobs: dict[str, bytes] = {}  # хеш -> байти картинки (однакові зберігаються раз)
+        self.avatar_requested = set()             # хеші, які вже запитали в сервера
+        self.avatar_disk = DiskCache(default_cache_dir("avatars"))  # байти аватарів між запусками
+        # потік з'єднання не чіпає віджети: кадри йдуть у чергу, яку розбирає головний потік
+        self.inbox = queue.SimpleQueue()
+        self.in_batch = False
+        self.animator = FrameScheduler(self)    # усі анімації вікна — в одному таймері
+        self.photo_cache = PhotoCache(self.get_avatar_image)  # готові PhotoImage: декодуємо картинку раз
+        self.own_avatar = None                    # (хеш, байти) власного аватара — файл читаємо один раз
 
         # --- Бокове меню ---
-        self.menu_frame = CTkFrame(self, width=200, height=self.winfo_height())
+        self.menu_frame = CTkFrame(self, width=MENU_WIDTH, height=self.winfo_height())
         self.menu_frame.pack_propagate(False)
         self.menu_frame.configure(width=0)
         self.menu_frame.place(x=0, y=0)
@@ -42,6 +64,19 @@ class MainWindow(CTk):
         )
         self.avatar_button.pack(pady=10)
 
+        self.file_button = CTkButton(
+            self.menu_frame, text="Надіслати файл", command=self.choose_file
+        )
+        self.file_button.pack(pady=10)
+
+        CTkLabel(self.menu_frame, text="Кімната").pack(pady=(10, 0))
+        self.room_box = CTkComboBox(self.menu_frame, values=[protocol.DEFAULT_ROOM], command=self.switch_room)
+        self.room_box.set(protocol.DEFAULT_ROOM)
+        self.room_box.bind("<Return>", lambda event: self.switch_room(self.room_box.get()))  # нова кімната — ввести назву
+        self.room_box.pack()
+        self.members_label = CTkLabel(self.menu_frame, text="", wraplength=MENU_WIDTH - 20, justify="left")
+        self.members_label.pack(pady=5)
+
         self.theme_menu = CTkOptionMenu(self.menu_frame, values=["Темна", "Світла", "Червона"], command=self.change_theme)
         self.theme_menu.pack(side="bottom", pady=20)
 
@@ -50,7 +85,11 @@ class MainWindow(CTk):
         self.menu_btn.place(x=0, y=0)
 
         # --- Область чату ---
-        self.chat_field = CTkScrollableFrame(self, width=400, height=200)
+        # віджети будуються лише для видимих рядків і перевикористовуються під час прокрутки
+        self.chat_field = VirtualChatView(
+            self, make_row=self.make_row, bind_row=self.bind_row,
+            history_limit=HISTORY_LIMIT, width=400, height=200,
+        )
         self.chat_field.place(x=0, y=30)
 
         # --- Нижня панель ---
@@ -59,88 +98,185 @@ class MainWindow(CTk):
         self.message_entry.place(x=0, y=self.winfo_height() + 40)
         self.send_btn.place(x=self.winfo_width() - 50, y=self.winfo_height() - 40)
 
-        # адаптивність
-        self.after(20, self.adaptive_ui)
+        # адаптивність: геометрія перераховується лише при зміні розміру вікна чи меню
+        self.layout = ChatLayout(self, self.menu_frame, self.chat_field, self.message_entry, self.send_btn)
 
         # підключення
         self.connect_to_server()
+        # розбір вхідних кадрів пачками в головному потоці
+        self.after(UI_POLL_MS, self.drain_inbox)
 
     # ====== МЕРЕЖА ======
     def connect_to_server(self):
-        try:
-            self.sock = socket(AF_INET, SOCK_STREAM)
-            self.sock.connect((self.host, self.port))
-            # можна відразу надіслати імʼя
-            self.sock.sendall(f"TEXT@SYSTEM@{self.username} підключився\n".encode())
-            self.add_message(f"Підключено до {self.host}:{self.port}", system=True)
-
-            if self.avatar_path:
-                self.send_avatar()
-
-            threading.Thread(target=self.recv_loop, daemon=True).start()
-        except Exception as e:
-            self.add_message(f"Не вдалося підключитись: {e}", system=True)
-
-    def recv_loop(self):
-        buffer = ""
-        while True:
-            try:
-                chunk = self.sock.recv(8192)
-                if not chunk:
-                    break
-                buffer += chunk.decode(errors="ignore")
-                while "\n" in buffer:
-                    line, buffer = buffer.split("\n", 1)
-                    self.handle_line(line.strip())
-            except:
-                break
-
-        if self.sock:
-            try:
-                self.sock.close()
-            except:
-                pass
+        self.conn = ChatConnection(
+            self.host, self.port, {protocol.FEATURE_AVATAR_REF, protocol.FEATURE_HISTORY},
+            on_frame=lambda msg_type, parts: self.inbox.put((msg_type, parts)),
+            on_status=lambda event, detail: self.inbox.put((None, (event, detail))),
+            history=HISTORY_BACKFILL,
+        )
+        self.conn.start()
 
-        self.add_message("Зʼєднання розірвано", system=True)
+    # привітання і власний аватар — лише при новому вході, не при відновленні сесії
+    def join_chat(self):
+        try:
+            self.send_frame("TEXT", "SYSTEM", f"{self.username} підключився")
+        except:
+            pass
+        if self.avatar_path:
+            self.send_avatar()
 
-    def handle_line(self, line: str):
-        if not line:
-            return
-        parts = line.split("@", 2)  # TEXT@name@message
-        msg_type = parts[0]
-        if msg_type == "TEXT" and len(parts) >= 3:
-            author = parts[1]
-            message = parts[2]
+    def handle_status(self, event, detail):
+        if event == "connected":
+            self.avatar_requested.clear()  # запити, надіслані до обриву, лишились без відповіді
+            if detail:
+                self.add_message("Підключено знову, відновлюємо сесію…", system=True)
+            else:
+                self.add_message(f"Підключено до {self.host}:{self.port}", system=True)
+                self.join_chat()
+        elif event == "resumed":
+            self.add_message("Сесію відновлено", system=True)
+        elif event == "resume-failed":
+            self.join_chat()
+        elif event == "disconnected":
+            self.add_message(f"Зʼєднання розірвано, повтор через {detail:.1f} с", system=True)
+        elif event == "retry":
+            error, delay = detail
+            self.add_message(f"Не вдалося підключитись: {error}; повтор через {delay:.1f} с", system=True)
+        elif event == "upload-done":
+            kind, name = detail
+            if kind == "file":
+                self.add_message(f"📎 {name}", username=self.username, self_message=True)
+        elif event == "upload-failed":
+            kind, name, reason = detail
+            what = "аватар" if kind == "avatar" else "файл"
+            self.add_message(f"Не вдалося надіслати {what} {name}: {reason}", system=True)
+        elif event == "download-done":
+            self.add_message(f"Файл збережено: {detail}", system=True)
+        elif event == "download-failed":
+            name, reason = detail
+            self.add_message(f"Не вдалося завантажити {name}: {reason}", system=True)
+
+    def send_frame(self, msg_type, *fields):
+        self.conn.send(msg_type, *fields)
+
+    # виконується в головному потоці: вся пачка — одне перемальовування і одна прокрутка
+    def drain_inbox(self):
+        count = 0
+        self.in_batch = True
+        try:
+            with tracing.root("drain_inbox", "ui"):
+                while count < UI_BATCH_LIMIT:
+                    try:
+                        msg_type, parts = self.inbox.get_nowait()
+                    except queue.Empty:
+                        break
+                    count += 1
+                    if msg_type is None:
+                        self.handle_status(*parts)
+                    else:
+                        with tracing.span(msg_type, "handle"):
+                            self.handle_frame(msg_type, parts)
+        finally:
+            self.in_batch = False
+            if count:
+                self.smooth_scroll_to_bottom()
+            # черга не спорожніла — продовжуємо одразу, але даємо Tk обробити події
+            self.after(1 if count >= UI_BATCH_LIMIT else UI_POLL_MS, self.drain_inbox)
+
+    def handle_frame(self, msg_type, parts):
+        if msg_type == "TEXT" and len(parts) >= 2:  # TEXT@name@message
+            author = parts[0]
+            message = parts[1]
             if author == "SYSTEM":
                 self.add_message(message, system=True)
             else:
                 self.add_message(message, username=author, 
                                  self_message=(author == self.username))
-        elif msg_type == "AVATAR" and len(parts) >= 4:
-            author = parts[1]
-            filename = parts[2]
-            encoded = parts[3]
-            try:
-                data = base64.b64decode(encoded)
-                self.avatars[author] = data
-                self.add_message(
-                    f"{author} встановив аватар ({filename})", system=True
-                )
-            except:
-                pass
-        elif msg_type == "RENAME" and len(parts) >= 3:
-            old = parts[1]
-            new = parts[2]
+        elif msg_type == "AVATAR" and len(parts) >= 3:
+            # старий сервер надсилає картинку цілком (base64 v1 розкодовано в protocol)
+            author = parts[0]
+            filename = parts[1]
+            digest = protocol.content_hash(parts[2])
+            self.avatar_blobs[digest] = parts[2]
+            self.avatar_disk.put(digest, parts[2])
+            self.avatars[author] = digest
+            self.photo_cache.invalidate(author)
+            self.add_message(
+                f"{author} встановив аватар ({filename})", system=True
+            )
+        elif msg_type == "AVATARREF" and len(parts) >= 3:
+            # лише нік -> хеш; байти запитуємо, тільки якщо такої картинки ще немає
+            author = parts[0]
+            filename = parts[1]
+            digest = parts[2]
+            if self.avatars.get(author) == digest:
+                return  # після відновлення сесії сервер повторює вже відомі аватари
+            self.avatars[author] = digest
+            self.photo_cache.invalidate(author)
+            self.request_avatar(digest)
+            self.add_message(
+                f"{author} встановив аватар ({filename})", system=True
+            )
+        elif msg_type == "AVATARDATA" and len(parts) >= 2:
+            digest = parts[0]
+            if protocol.content_hash(parts[1]) == digest:
+                self.avatar_blobs[digest] = parts[1]
+                self.avatar_disk.put(digest, parts[1])
+                self.chat_field.rebind()  # показані рядки отримають картинку
+            self.avatar_requested.discard(digest)
+        elif msg_type == "RENAME" and len(parts) >= 2:
+            old = parts[0]
+            new = parts[1]
             self.add_message(f"{old} змінив ім'я на {new}", system=True)
             if old in self.avatars:
                 self.avatars[new] = self.avatars.pop(old)
+            self.photo_cache.invalidate(old)
+            self.photo_cache.invalidate(new)
+            self.chat_field.rebind()
             if old == self.username:
                 self.username = new
                 self.name_entry.delete(0, "end")
                 self.name_entry.insert(0, new)
+        elif msg_type == "FILE" and len(parts) >= 4:  # FILE@name@hash@size@filename
+            author, digest, size, filename = parts[:4]
+            size = format_size(int(size)) if size.isdigit() else "?"
+            self.add_message(
+                f"📎 {filename} ({size}) — натисніть, щоб зберегти",
+                username=author, self_message=(author == self.username),
+                action=lambda: self.download_file(digest, filename),
+            )
+        elif msg_type == "JOIN" and parts:  # сервер перевів нас в іншу кімнату
+            room = parts[0]
+            self.chat_field.clear()  # історію нової кімнати сервер надішле слідом
+            self.room_box.set(room)
+            self.members_label.configure(text="")
+            self.add_message(f"Ви в кімнаті {room}", system=True)
+        elif msg_type == "ROOMS" and parts:
+            self.room_box.configure(values=parts[0].split(","))
+        elif msg_type == "MEMBERS" and len(parts) >= 2:
+            if parts[0] == self.conn.room:
+                self.members_label.configure(text=f"Зараз тут: {parts[1]}")
+        elif msg_type == "HISTORY":
+            pass  # кінець підвантаження історії
+        elif msg_type == "HELLO":
+            pass  # старий сервер пересилає чужі HELLO усім — ігноруємо
         else:
             # на випадок інших форматів
-            self.add_message(line, system=True)
+            self.add_message("@".join([msg_type, *parts]), system=True)
+
+    def request_avatar(self, digest):
+        if digest in self.avatar_blobs or digest in self.avatar_requested:
+            return
+        data = self.avatar_disk.get(digest)
+        if data is not None:
+            self.avatar_blobs[digest] = data
+            self.chat_field.rebind()
+            return
+        self.avatar_requested.add(digest)
+        try:
+            self.send_frame("AVATARGET", digest)
+        except:
+            self.avatar_requested.discard(digest)
 
     def send_message(self):
         text = self.message_entry.get().strip()
@@ -152,9 +288,8 @@ class MainWindow(CTk):
             self.username = new_name
 
 
-        data = f"TEXT@{self.username}@{text}\n"
         try:
-            self.sock.sendall(data.encode())
+            self.send_frame("TEXT", self.username, text)
         except:
             self.add_message("Не вдалося надіслати повідомлення", system=True)
         # одразу показуємо у себе
@@ -170,9 +305,8 @@ class MainWindow(CTk):
         
         old = self.username
         self.username = new_name
-        data = f"RENAME@{old}@{new_name}\n"
         try:
-            self.sock.sendall(data.encode())
+            self.send_frame("RENAME", old, new_name)
         except:
             pass
         self.add_message(f"Ви змінили ім'я з {old} на {new_name}", system=True)
@@ -194,19 +328,80 @@ class MainWindow(CTk):
         try:
             with open(self.avatar_path, "rb") as f:
                 data = f.read()
-            encoded = base64.b64encode(data).decode()
+            self.own_avatar = (protocol.content_hash(data), data)
+            self.photo_cache.invalidate(self.username)
             filename = self.avatar_path.split("/")[-1]
-            msg = f"AVATAR@{self.username}@{filename}@{encoded}\n"
             try:
-                self.sock.sendall(msg.encode())
+                # сервер з BLOB отримає файл шматками у фоні; старому — одним кадром
+                if not self.conn.upload(self.avatar_path, "avatar", self.username, filename):
+                    # у v2 байти йдуть як є, для v1 protocol сам закодує base64
+                    self.send_frame("AVATAR", self.username, filename, data)
             except:
                 self.add_message("Не вдалося надіслати аватар", system=True)
         except Exception as e:
             self.add_message(f"Не вдалося відкрити аватар: {e}", system=True)
-        
+
+    # ====== КІМНАТИ ======
+    def switch_room(self, room):
+        room = room.strip()
+        if not room or room == self.conn.room:
+            return
+        try:
+            if not self.conn.join(room):
+                self.add_message("Сервер не підтримує кімнати", system=True)
+                self.room_box.set(self.conn.room)
+        except OSError:
+            self.add_message("Немає з'єднання з сервером", system=True)
+            self.room_box.set(self.conn.room)
+
+    # ====== ФАЙЛИ ======
+    def choose_file(self):
+        path = filedialog.askopenfilename(title="Виберіть файл")
+        if path:
+            self.send_file(path)
+
+    def send_file(self, path):
+        new_name = self.name_entry.get().strip()
+        if new_name:
+            self.username = new_name
+        filename = os.path.basename(path)
+        try:
+            if not self.conn.upload(path, "file", self.username, filename):
+                self.add_message("Сервер не підтримує обмін файлами", system=True)
+                return
+        except OSError as e:
+            self.add_message(f"Не вдалося надіслати файл {filename}: {e}", system=True)
+            return
+        self.add_message(f"Надсилаємо {filename}…", system=True)
+
+    def download_file(self, digest, filename):
+        path = filedialog.asksaveasfilename(title="Зберегти файл", initialfile=filename)
+        if not path:
+            return
+        try:
+            self.conn.download(digest, path, filename)
+        except OSError as e:
+            self.add_message(f"Не вдалося зберегти {filename}: {e}", system=True)
+
+    def load_own_avatar(self):
+        if self.own_avatar is None and self.avatar_path:
+            try:
+                with open(self.avatar_path, "rb") as f:
+                    data = f.read()
+                self.own_avatar = (protocol.content_hash(data), data)
+            except OSError:
+                self.own_avatar = False  # не перечитуємо битий шлях на кожне повідомлення
+        return self.own_avatar
+
     def get_avatar_image(self, data: bytes, size=(30, 30)):
+        with tracing.root("avatar_decode", "ui", bytes=len(data)):
+            return self.decode_avatar(data, size)
+
+    def decode_avatar(self, data: bytes, size):
         try:
-            img = Image.open(io.BytesIO(data)).resize(size, Image.Resampling.LANCZOS)
+            img = Image.open(io.BytesIO(data))
+            if img.size != size:  # сервер уже надсилає готові мініатюри потрібного розміру
+                img = img.resize(size, Image.Resampling.LANCZOS)
             return ImageTk.PhotoImage(img)
         except:
             return None
@@ -219,107 +414,102 @@ class MainWindow(CTk):
             set_appearance_mode("light")
         elif value == "Червона":
             set_default_color_theme("autumn.json")
+        self.chat_field.rebind()  # кольори бульбашок залежать від режиму
 
     def toggle_menu(self):
         self.is_show_menu = not self.is_show_menu
-        if self.is_show_menu:
-            self.show_menu()
-        else:
-            self.hide_menu()
-
-    def show_menu(self):
-        if self.frame_width <= 200:
-            self.frame_width += self.menu_show_speed
-            self.menu_frame.configure(width=self.frame_width, height=self.winfo_height())
-            if self.frame_width >= 30:
-                self.menu_btn.configure(width=self.frame_width, text="◀️")
-        if self.is_show_menu:
-            self.after(20, self.show_menu)
-
-    def hide_menu(self):
-        if self.frame_width >= 0:
-            self.frame_width -= self.menu_show_speed
+        self.animator.animate("menu", self.slide_menu())
+
+    # меню виїжджає/ховається кроками; новий клік замінює анімацію, що ще триває
+    def slide_menu(self):
+        target = MENU_WIDTH if self.is_show_menu else 0
+        while self.frame_width != target:
+            if target > self.frame_width:
+                self.frame_width = min(self.frame_width + self.menu_show_speed, target)
+            else:
+                self.frame_width = max(self.frame_width - self.menu_show_speed, target)
             self.menu_frame.configure(width=self.frame_width)
+            self.layout.set_menu_width(self.frame_width)
             if self.frame_width >= 30:
-                self.menu_btn.configure(width=self.frame_width, text="▶️")
-        if not self.is_show_menu:
-            self.after(20, self.hide_menu)
-
-    def adaptive_ui(self):
-        menu_w = self.menu_frame.winfo_width()
-        win_w = self.winfo_width()
-        win_h = self.winfo_height()
+                self.menu_btn.configure(width=self.frame_width, text="◀️" if self.is_show_menu else "▶️")
+            yield
 
-        self.chat_field.configure(width=win_w - menu_w - 20, height=win_h - 40 - 50)
-        self.chat_field.place(x=menu_w, y=30)
-
-        self.message_entry.configure(width=win_w - menu_w - self.send_btn.winfo_width())
-        self.message_entry.place(x=menu_w, y=win_h - 40)
-
-        self.send_btn.place(x=win_w - self.send_btn.winfo_width(), y=win_h - self.send_btn.winfo_height())
-
-        self.after(20, self.adaptive_ui)
-
-    def smooth_scroll_to_bottom(self, steps=10, delay=20):
-        canvas = self.chat_field._parent_canvas
+    def smooth_scroll_to_bottom(self, steps=10):
+        # нова прокрутка замінює попередню в планувальнику, а не біжить паралельно
+        self.chat_field.sync_scrollregion()
+        canvas = self.chat_field.canvas
         start = canvas.yview()[0]
         end = 1.0
         diff = (end - start) / steps
 
-        def step(i=0):
-            if i < steps:
-                canvas.yview_moveto(start + diff * (i + 1))
-                self.after(delay, lambda: step(i + 1))
-        step()
-
-    def add_message(self, message, username=None, self_message=False, system=False):
-        frame = CTkFrame(self.chat_field, fg_color="transparent")
-        if system:
-            frame.pack(anchor="center", pady=2, padx=5)
-        elif self_message:
-            frame.pack(anchor="e", pady=2, padx=5,)
-        else:
-            frame.pack(anchor="w", pady=2, padx=5)
+        def scroll():
+            for i in range(steps):
+                with tracing.root("scroll", "ui", step=i):
+                    canvas.yview_moveto(start + diff * (i + 1))
+                yield
+        self.animator.animate("scroll", scroll())
 
-        if system:
-            CTkLabel(frame, text=message, text_color="gray", font=("Arial", 11, "italic")).pack(anchor="center", padx=5, pady=2)
-            self.smooth_scroll_to_bottom()
+    def avatar_image_for(self, username):
+        if not username:
+            return None
+        digest = self.avatars.get(username)
+        avatar_data = self.avatar_blobs.get(digest)
+        if avatar_data:
+            return self.photo_cache.get(username, digest, avatar_data)
+        if username == self.username and self.load_own_avatar():
+            return self.photo_cache.get(username, *self.own_avatar)
+        return None
+
+    def make_row(self, parent):
+        return MessageRow(
+            parent,
+            system_style=dict(text_color="gray", font=("Arial", 11, "italic")),
+            name_style=dict(font=("Arial", 17, "bold")),
+            text_style=dict(font=("Arial", 36)),
+        )
+
+    def bind_row(self, row, record):
+        if record.system:
+            row.system.configure(text=record.message)
+            row.system.pack(anchor="center", padx=5, pady=2)
             return
 
-        if username and username in self.avatars:
-            avatar_img = self.get_avatar_image(self.avatars[username])
-            if avatar_img:
-                lbl_img = CTkLabel(frame, image=avatar_img, text="")
-                lbl_img.image = avatar_img
-                lbl_img.pack(side="right" if self_message else "left", padx=5)
-        elif username and username == self.username and self.avatar_path:
-            try:
-                with open(self.avatar_path, "rb") as f:
-                    data = f.read()
-                avatar_img = self.get_avatar_image(data)
-                if avatar_img:
-                    lbl_img = CTkLabel(frame, image=avatar_img, text="")
-                    lbl_img.image = avatar_img
-                    lbl_img.pack(side="right" if self_message else "left", padx=5)
-            except:
-                pass
+        side = "right" if record.self_message else "left"
+        avatar_img = self.avatar_image_for(record.username)
+        if avatar_img:
+            row.avatar.configure(image=avatar_img)
+            row.avatar.image = avatar_img
+            row.avatar.pack(side=side, padx=5)
+
         current_mode = get_appearance_mode()
-        if self_message:
+        if record.self_message:
             bg_color = "#3a7bd5" if current_mode == "dark" else "#cce7ff"
             text_color = "white" if current_mode == "dark" else "black"
         else:
             bg_color = "#2b2b2b" if current_mode == "dark" else "#f0f0f0"
             text_color = "white" if current_mode == "dark" else "black"
-        
-        bubble = CTkFrame(frame, fg_color=bg_color, corner_radius=10)
-        bubble.pack(side="right" if self_message else "left", padx=5, pady=(0, 5))
 
-        if username:
-            CTkLabel(bubble, text=username, font=("Arial", 17, "bold"), text_color=text_color).pack(anchor="w", padx=5, pady=(3, 0))
+        row.bubble.configure(fg_color=bg_color)
+        row.bubble.pack(side=side, padx=5, pady=(0, 5))
+
+        if record.username:
+            row.name.configure(text=record.username, text_color=text_color)
+            row.name.pack(anchor="w", padx=5, pady=(3, 0))
 
-        CTkLabel(bubble, text=message, font=("Arial", 36), wraplength=300, justify="left", anchor="w", text_color=text_color).pack(anchor="w", padx=5, pady=(0, 5))
+        row.text.configure(text=record.message, text_color=text_color)
+        row.text.pack(anchor="w", padx=5, pady=(0, 5))
+        row.action = record.action
 
-        self.smooth_scroll_to_bottom()
+    def add_message(self, message, username=None, self_message=False, system=False, action=None):
+        with tracing.root("add_message", "ui"):
+            self.append_message(message, username, self_message, system, action)
+
+    def append_message(self, message, username, self_message, system, action):
+        # лише додаємо запис у модель — віджет з'явиться, коли рядок буде видно;
+        # під час розбору пачки прокрутка одна, після всієї пачки
+        self.chat_field.append(ChatRecord(message, username, self_message, system, action))
+        if not self.in_batch:
+            self.smooth_scroll_to_bottom()
 
 # ===== ВІКНО РЕЄСТРАЦІЇ =====
 class RegistrationWindow(CTk):
@@ -374,5 +564,6 @@ class RegistrationWindow(CTk):
 
 
 if __name__ == "__main__":
+    tracing.configure_from_env("client")
     reg = RegistrationWindow()
     reg.mainloop()
@@ -0,0 +1,165 @@
+import itertools
+import os
+import queue
+import threading
+import time
+from collections import deque
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+# --- Зв'язок між вузлами (окремими серверами) ---
+# Кожен вузол пересилає сусідам лише те, що сталося в нього самого: розсилки кімнат,
+# аватари, зміни ніків і склад кімнат. Вузли з'єднуються повною сіткою — кожен з кожним;
+# напрямок не важливий, з'єднання двосторонні. Якщо двоє вказали одне одного, між ними
+# буде два з'єднання і кожна подія прийде двічі — друга копія відкидається за ідентифікатором
+# походження (вузол, запуск, номер). Транспорт — multiprocessing.connection поверх TCP:
+# кадри з довжиною, pickle всередині, тож підключатися можуть лише вузли зі спільним ключем.
+RECONNECT_DELAY = 2.0   # пауза між спробами дозвонитися до сусіда
+LINK_QUEUE = 10_000     # подій у черзі на одне з'єднання; переповнилась — рвемо, сусід синхронізується заново
+SEEN_IDS = 100_000      # скільки останніх ідентифікаторів пам'ятаємо для відкидання дублікатів
+
+
+class Link:
+    def __init__(self, conn, address):
+        self.conn = conn
+        self.address = address
+        self.node = None                           # ідентифікатор вузла з іншого боку (з привітання)
+        self.queue = queue.Queue(maxsize=LINK_QUEUE)
+        self.closed = False
+
+    def send(self, event) -> bool:
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except queue.Full:
+            self.close()
+            return False
+
+    # окремий потік: повільний сусід не гальмує рушій чату
+    def write_loop(self):
+        while True:
+            event = self.queue.get()
+            if event is None:
+                return
+            try:
+                self.conn.send(event)
+            except (OSError, ValueError):
+                self.close()
+                return
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self.conn.close()
+
+
+# listen — (адреса, порт) для вхідних з'єднань або None; peers — адреси, до яких дзвонимо самі.
+class Relay:
+    def __init__(self, node, authkey, listen, peers):
+        self.node = node
+        self.run_id = os.urandom(4).hex()  # вузол перезапустився з тим самим ім'ям — нумерація нова
+        self.authkey = authkey
+        self.listen_address = listen
+        self.peer_addresses = peers
+        self.deliver = self.snapshot = self.lost = None
+        self.counter = itertools.count(1)
+        self.links = set()
+        self.seen = set()
+        self.seen_order = deque()
+        self.lock = threading.Lock()  # перевірка дубліката і передача в рушій — атомарно, порядок зберігається
+
+    # deliver(вузол, подія) — подія від сусіда; snapshot() — стан цього вузла для нового
+    # з'єднання (список подій); lost(вузол) — до вузла більше немає жодного з'єднання
+    def start(self, deliver, snapshot, lost):
+        self.deliver = deliver
+        self.snapshot = snapshot
+        self.lost = lost
+        if self.listen_address is not None:
+            listener = Listener(self.listen_address, authkey=self.authkey)
+            threading.Thread(target=self.accept_loop, args=(listener,), daemon=True).start()
+        for address in self.peer_addresses:
+            threading.Thread(target=self.dial_loop, args=(address,), daemon=True).start()
+
+    def accept_loop(self, listener):
+        while True:
+            try:
+                conn = listener.accept()
+            except AuthenticationError:
+                continue  # чужий вузол без ключа
+            except OSError:
+                return
+            threading.Thread(target=self.run_link, args=(Link(conn, None),), daemon=True).start()
+
+    def dial_loop(self, address):
+        while True:
+            try:
+                conn = Client(address, authkey=self.authkey)
+            except (OSError, AuthenticationError):
+                time.sleep(RECONNECT_DELAY)
+                continue
+            self.run_link(Link(conn, address))
+            time.sleep(RECONNECT_DELAY)
+
+    def run_link(self, link):
+        try:
+            link.conn.send(("hello", self.node))
+            _, link.node = link.conn.recv()
+        except (OSError, EOFError, ValueError):
+            link.close()
+            return
+        if link.node == self.node:
+            print(f"Вузол {self.node}: з'єднання із самим собою ({link.address}) — пропускаємо")
+            link.close()
+            return
+        threading.Thread(target=link.write_loop, daemon=True).start()
+        with self.lock:
+            # стан іде першим у черзі з'єднання — раніше за будь-яку нову подію
+            for message in self.snapshot():
+                link.send(self.make_event(message))
+            self.links.add(link)
+        print(f"Вузол {link.node} на зв'язку")
+        try:
+            while True:
+                event = link.conn.recv()
+                self.receive(link, event)
+        except (OSError, EOFError, ValueError):
+            pass
+        link.close()
+        with self.lock:
+            self.links.discard(link)
+            gone = not any(other.node == link.node for other in self.links)
+        print(f"Зв'язок з вузлом {link.node} втрачено")
+        if gone:
+            self.lost(link.node)
+
+    def receive(self, link, event):
+        key, message = event  # key: (вузол, запуск, номер)
+        with self.lock:
+            if key in self.seen:
+                return
+            self.seen.add(key)
+            self.seen_order.append(key)
+            if len(self.seen_order) > SEEN_IDS:
+                self.seen.discard(self.seen_order.popleft())
+            self.deliver(key[0], message)
+
+    # подія цього вузла — усім сусідам
+    def publish(self, message):
+        with self.lock:
+            event = self.make_event(message)
+            for link in list(self.links):
+                if not link.send(event):
+                    self.links.discard(link)
+
+    def make_event(self, message):
+        return (self.node, self.run_id, next(self.counter)), message
+
+    @property
+    def peers(self):
+        with self.lock:
+            return len({link.node for link in self.links})
@@ -0,0 +1,99 @@
+MAX_FRAME = 16 * 1024 * 1024  # більший кадр вважаємо помилкою протоколу
+RECV_SIZE = 64 * 1024         # скільки місця резервуємо під один recv_into
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+# --- Буфер вхідних байтів для розбору кадрів ---
+# Один bytearray, у який сокет пише напряму (recv_into), без проміжних bytes на кожен recv.
+# Розібрані кадри не вирізаються з початку — лише зсувається start; місце звільняється
+# одним переміщенням, коли хвіст упирається в кінець буфера. Буфер росте вдвічі, тож
+# навіть кадр на кілька МБ збирається за лінійний час і кілька виділень пам'яті.
+# Пошук \n продовжується з того місця, де зупинився минулого разу (scan).
+# Буфер виділяється лише під перші дані. Той, у який читає recv_into, живе між читаннями
+# (після великого кадру стискається назад до recv_size); той, що наповнюється через feed
+# (asyncio), звільняється щоразу, коли все розібрано, — тисячі з'єднань, що мовчать,
+# не тримають по recv_size кожне.
+class FrameBuffer:
+    def __init__(self, max_frame=MAX_FRAME, recv_size=RECV_SIZE):
+        self.max_frame = max_frame
+        self.recv_size = recv_size
+        self.buf = bytearray()
+        self.start = 0   # перший ще не розібраний байт
+        self.end = 0     # кінець отриманих даних
+        self.scan = 0    # звідки продовжити пошук кінця рядка
+        self.reuse = False  # буфер для recv_into — тримаємо між читаннями
+
+    def __len__(self):
+        return self.end - self.start
+
+    # гарантує size вільних байтів після end
+    def reserve(self, size):
+        if len(self.buf) - self.end >= size:
+            return
+        pending = self.end - self.start
+        if pending + size <= len(self.buf) // 2:
+            # місця вдосталь — зсуваємо недочитаний хвіст на початок
+            self.buf[:pending] = self.buf[self.start:self.end]
+        else:
+            grown = bytearray(max(len(self.buf) * 2, pending + size))
+            grown[:pending] = self.buf[self.start:self.end]
+            self.buf = grown
+        self.scan -= self.start
+        self.start = 0
+        self.end = pending
+
+    def feed(self, data):
+        size = len(data)
+        self.reserve(size)
+        self.buf[self.end:self.end + size] = data
+        self.end += size
+
+    # читає з сокета просто в буфер; 0 — з'єднання закрито
+    def recv_into(self, sock):
+        self.reuse = True
+        self.reserve(self.recv_size)
+        with memoryview(self.buf)[self.end:] as view:
+            count = sock.recv_into(view)
+        self.end += count
+        return count
+
+    # наступний рядок без \n (bytes) або None, якщо рядок ще не дійшов
+    def take_line(self):
+        idx = self.buf.find(b"\n", max(self.scan, self.start), self.end)
+        if idx < 0:
+            self.scan = self.end
+            if len(self) > self.max_frame:
+                raise ProtocolError("занадто довгий рядок")
+            return None
+        line = bytes(self.buf[self.start:idx])
+        self.start = self.scan = idx + 1
+        self.consumed()
+        return line
+
+    def peek(self, struct_, offset=0):
+        return struct_.unpack_from(self.buf, self.start + offset)
+
+    def skip(self, size):
+        self.start += size
+        self.consumed()
+
+    # memoryview на наступні size байтів; викликач має звільнити його (release) до наступного feed
+    def take(self, size):
+        view = memoryview(self.buf)[self.start:self.start + size]
+        self.start += size
+        self.consumed()
+        return view
+
+    # усе розібрано — наступні дані пишемо з початку буфера, без зсувів
+    def consumed(self):
+        if self.start == self.end:
+            self.start = self.end = self.scan = 0
+            if not self.reuse:
+                if self.buf:
+                    self.buf = bytearray()  # з'єднання, що мовчить, не тримає буфер
+            elif len(self.buf) > self.recv_size * 4:
+                # після великого кадру не тримаємо мегабайти на кожне з'єднання
+                self.buf = bytearray(self.recv_size)
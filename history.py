@@ -0,0 +1,266 @@
+import mmap
+import os
+import struct
+import threading
+from bisect import bisect_right
+
+# --- Формат журналу ---
+# Журнал — послідовність сегментів <перший seq>.log, кожен — записи
+# [u32 довжина кадру][u64 seq][кадр у форматі v2], які лише дописуються в кінець.
+# Поруч лежить розріджений індекс <перший seq>.idx: пара [u64 seq][u64 зсув]
+# на кожен INDEX_EVERY-й запис. Індекс читається через mmap, тож пошук місця
+# в сегменті не вантажить у пам'ять ні журнал, ні індекс цілком.
+RECORD = struct.Struct("!IQ")
+INDEX = struct.Struct("!QQ")
+INDEX_EVERY = 64                      # як часто класти запис в індекс
+SEGMENT_BYTES = 64 * 1024 * 1024      # розмір, після якого відкривається новий сегмент
+READ_BATCH = 256                      # скільки записів віддаємо читачу за раз
+
+
+class Segment:
+    __slots__ = ("first_seq", "log_path", "idx_path", "size")
+
+    def __init__(self, directory, first_seq):
+        self.first_seq = first_seq
+        name = f"{first_seq:020d}"
+        self.log_path = os.path.join(directory, name + ".log")
+        self.idx_path = os.path.join(directory, name + ".idx")
+        self.size = 0
+
+    # зсув останнього проіндексованого запису з seq <= target (0 — з початку сегмента)
+    def lookup(self, target):
+        try:
+            with open(self.idx_path, "rb") as f:
+                count = os.fstat(f.fileno()).st_size // INDEX.size
+                if count == 0:
+                    return 0
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as index:
+                    lo, hi = 0, count
+                    while lo < hi:
+                        mid = (lo + hi) // 2
+                        seq, _ = INDEX.unpack_from(index, mid * INDEX.size)
+                        if seq <= target:
+                            lo = mid + 1
+                        else:
+                            hi = mid
+                    if lo == 0:
+                        return 0
+                    return INDEX.unpack_from(index, (lo - 1) * INDEX.size)[1]
+        except FileNotFoundError:
+            return 0
+
+    def remove(self):
+        for path in (self.log_path, self.idx_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+# сегменти каталогу за зростанням першого seq
+def list_segments(directory):
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    firsts = sorted(int(name[:-4]) for name in names if name.endswith(".log") and name[:-4].isdigit())
+    return [Segment(directory, first) for first in firsts]
+
+
+# --- Читання журналу (спільне для письменника й читача) ---
+# Нащадок задає snapshot(): межу читання і сегменти з їхніми розмірами на цю мить.
+class HistoryView:
+    next_seq = 1
+
+    @property
+    def last_seq(self):
+        return self.next_seq - 1
+
+    def read_last(self, count, batch=READ_BATCH):
+        end_seq, segments = self.snapshot()
+        return self.scan(end_seq - count, end_seq, segments, batch)
+
+    # записи з seq > after_seq пачками по batch; межа читання фіксується одразу,
+    # тож кадри, записані після виклику, сюди не потраплять (їх клієнт отримає наживо)
+    def read_since(self, after_seq, batch=READ_BATCH):
+        end_seq, segments = self.snapshot()
+        return self.scan(after_seq + 1, end_seq, segments, batch)
+
+    def snapshot(self):
+        raise NotImplementedError
+
+    def scan(self, start, end_seq, segments, batch):
+        if not segments:
+            return
+        start = max(start, segments[0][0].first_seq)
+        firsts = [segment.first_seq for segment, _ in segments]
+        pending = []
+        for segment, size in segments[max(0, bisect_right(firsts, start) - 1):]:
+            if start >= end_seq:
+                break
+            offset = segment.lookup(start)
+            try:
+                f = open(segment.log_path, "rb")
+            except FileNotFoundError:
+                continue  # сегмент встигли прибрати за лімітом — беремо наступний
+            with f:
+                f.seek(offset)
+                while offset < size:
+                    header = f.read(RECORD.size)
+                    if len(header) < RECORD.size:
+                        break
+                    length, seq = RECORD.unpack(header)
+                    if seq >= end_seq:
+                        break
+                    if seq < start:
+                        f.seek(length, os.SEEK_CUR)
+                    else:
+                        pending.append((seq, f.read(length)))
+                        start = seq + 1
+                        if len(pending) >= batch:
+                            yield pending
+                            pending = []
+                    offset += RECORD.size + length
+        if pending:
+            yield pending
+
+
+# --- Журнал історії чату ---
+# append() присвоює кадру наступний seq і дописує його; read_since() віддає записи
+# пачками прямо з файлів. Читачі відкривають сегменти самі й читають лише до межі,
+# зафіксованої на момент запиту, тож не заважають письменнику.
+class HistoryLog(HistoryView):
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, max_segments=0):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments  # 0 — зберігати все
+        self.lock = threading.Lock()
+        self.segments = []
+        self.next_seq = 1
+        self.log_file = None
+        self.idx_file = None
+        self.since_index = 0              # записів після останнього запису в індексі
+
+        os.makedirs(directory, exist_ok=True)
+        self.segments = list_segments(directory)
+        if self.segments:
+            self.recover(self.segments[-1])
+        else:
+            self.open_segment(self.next_seq)
+
+    @property
+    def first_seq(self):
+        return self.segments[0].first_seq
+
+    # --- Відновлення після перезапуску: дочитуємо хвіст останнього сегмента ---
+    # Обірваний запис у кінці (сервер упав посеред запису) відрізаємо.
+    def recover(self, segment):
+        offset = segment.lookup(2 ** 64 - 1)
+        seq = segment.first_seq - 1
+        since_index = 0
+        with open(segment.log_path, "rb") as f:
+            f.seek(offset)
+            while True:
+                header = f.read(RECORD.size)
+                if len(header) < RECORD.size:
+                    break
+                length, record_seq = RECORD.unpack(header)
+                if len(f.read(length)) < length:
+                    break
+                seq = record_seq
+                offset += RECORD.size + length
+                since_index += 1
+        with open(segment.log_path, "r+b") as f:
+            f.truncate(offset)
+        segment.size = offset
+        self.next_seq = seq + 1
+        # індекс міг піти далі за обрізаний хвіст — прибираємо зайві записи
+        if os.path.exists(segment.idx_path):
+            with open(segment.idx_path, "r+b") as f:
+                count = os.fstat(f.fileno()).st_size // INDEX.size
+                keep = count
+                while keep:
+                    f.seek((keep - 1) * INDEX.size)
+                    _, entry_offset = INDEX.unpack(f.read(INDEX.size))
+                    if entry_offset < offset:
+                        break
+                    keep -= 1
+                f.truncate(keep * INDEX.size)
+        self.since_index = since_index
+        self.log_file = open(segment.log_path, "ab")
+        self.idx_file = open(segment.idx_path, "ab")
+
+    def open_segment(self, first_seq):
+        if self.log_file is not None:
+            self.log_file.close()
+            self.idx_file.close()
+        segment = Segment(self.directory, first_seq)
+        self.segments.append(segment)
+        self.log_file = open(segment.log_path, "ab")
+        self.idx_file = open(segment.idx_path, "ab")
+        self.since_index = 0
+        while self.max_segments and len(self.segments) > self.max_segments:
+            self.segments.pop(0).remove()
+
+    # --- Запис ---
+    def append(self, payload: bytes) -> int:
+        with self.lock:
+            segment = self.segments[-1]
+            if segment.size >= self.segment_bytes:
+                self.open_segment(self.next_seq)
+                segment = self.segments[-1]
+            seq = self.next_seq
+            if self.since_index % INDEX_EVERY == 0:
+                self.idx_file.write(INDEX.pack(seq, segment.size))
+                self.idx_file.flush()
+            self.since_index += 1
+            self.log_file.write(RECORD.pack(len(payload), seq))
+            self.log_file.write(payload)
+            self.log_file.flush()  # читачі відкривають файл окремо — дані мають бути в ОС
+            segment.size += RECORD.size + len(payload)
+            self.next_seq = seq + 1
+            return seq
+
+    def snapshot(self):
+        with self.lock:
+            return self.next_seq, [(segment, segment.size) for segment in self.segments]
+
+    def close(self):
+        with self.lock:
+            if self.log_file is not None:
+                self.log_file.close()
+                self.idx_file.close()
+                self.log_file = self.idx_file = None
+
+
+# --- Журнал лише для читання (воркер у режимі кількох процесів) ---
+# Пише журнал один процес-концентратор; воркер лише читає файли. Межу читання воркер
+# посуває сам (advance), коли отримує від концентратора кадр з новим seq: до цього
+# моменту запис уже повністю лежить у файлі. Список сегментів і їхні розміри
+# беруться з диска на кожен запит — концентратор міг відкрити новий чи прибрати старий.
+class HistoryReader(HistoryView):
+    def __init__(self, directory, last_seq=0):
+        self.directory = directory
+        self.next_seq = last_seq + 1
+
+    def advance(self, seq):
+        if seq >= self.next_seq:
+            self.next_seq = seq + 1
+
+    def close(self):
+        pass  # файли відкриваються лише на час читання
+
+    @property
+    def first_seq(self):
+        segments = list_segments(self.directory)
+        return segments[0].first_seq if segments else self.next_seq
+
+    def snapshot(self):
+        end_seq = self.next_seq
+        segments = []
+        for segment in list_segments(self.directory):
+            try:
+                segments.append((segment, os.path.getsize(segment.log_path)))
+            except FileNotFoundError:
+                pass
+        return end_seq, segments
@@ -0,0 +1,62 @@
+# --- Розкладка головного вікна чату (спільна для client.py і show.py) ---
+# Геометрія перераховується лише тоді, коли справді змінився розмір вікна (<Configure>)
+# або ширина бокового меню, а не таймером. Кілька подій поспіль зливаються
+# в один перерахунок на after_idle, а однаковий стан не застосовується вдруге.
+class ChatLayout:
+    def __init__(self, window, menu_frame, chat_field, message_entry, send_btn, top=30):
+        self.window = window
+        self.menu_frame = menu_frame
+        self.chat_field = chat_field
+        self.message_entry = message_entry
+        self.send_btn = send_btn
+        self.top = top                # висота смуги з кнопкою меню над чатом
+        self.menu_width = 0
+        self.applied = None           # (ширина, висота, меню) останньої застосованої розкладки
+        self.pending = None           # id запланованого перерахунку
+
+        window.bind("<Configure>", self.on_configure, add="+")
+        self.request()
+
+    # <Configure> приходить і від дочірніх віджетів — нас цікавить лише саме вікно
+    def on_configure(self, event):
+        if event.widget is self.window:
+            self.request()
+
+    # викликається анімацією меню на кожному кроці
+    def set_menu_width(self, width):
+        width = max(0, width)
+        if width != self.menu_width:
+            self.menu_width = width
+            self.request()
+
+    def request(self):
+        if self.pending is None:
+            self.pending = self.window.after_idle(self.apply)
+
+    def apply(self):
+        self.pending = None
+        win_w = self.window.winfo_width()
+        win_h = self.window.winfo_height()
+        if win_w <= 1 or win_h <= 1:
+            return  # вікно ще не показане — дочекаємось першого <Configure>
+        state = (win_w, win_h, self.menu_width)
+        if state == self.applied:
+            return
+        resized = self.applied is None or self.applied[:2] != state[:2]
+        self.applied = state
+
+        menu_w = self.menu_width
+        send_w = self.send_btn.winfo_reqwidth()
+        send_h = self.send_btn.winfo_reqheight()
+        entry_h = self.message_entry.winfo_reqheight()
+
+        if resized:
+            self.menu_frame.configure(height=win_h)
+
+        self.chat_field.configure(width=win_w - menu_w - 20, height=win_h - entry_h - 50)
+        self.chat_field.place(x=menu_w, y=self.top)
+
+        self.message_entry.configure(width=win_w - menu_w - send_w)
+        self.message_entry.place(x=menu_w, y=win_h - entry_h)
+
+        self.send_btn.place(x=win_w - send_w, y=win_h - send_h)
@@ -0,0 +1,133 @@
+import math
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- Метрики у текстовому форматі Prometheus ---
+# Лічильники й гістограми оновлюються просто в гарячому шляху: кожне оновлення —
+# одна операція зі словником чи списком під замком самої метрики. Те, що сервер і так
+# тримає у своїх структурах (кількість клієнтів, розмір сховища аватарів), не
+# дублюється — Gauge читає значення функцією лише тоді, коли приходить запит /metrics.
+registry = []  # усі метрики в порядку створення — в такому ж порядку й віддаються
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.values = {} if labels else {(): 0}  # кортеж значень міток -> лічильник
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        for label_values, value in items:
+            yield self.name, dict(zip(self.labels, label_values)), value
+
+
+# значення рахується в момент запиту: read() — без аргументів, повертає число
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help_text, read):
+        self.name = name
+        self.help = help_text
+        self.read = read
+        registry.append(self)
+
+    def samples(self):
+        yield self.name, {}, self.read()
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # останній — усе, що більше за верхню межу
+        self.total = 0.0
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)  # перша межа, не менша за value (le)
+        with self.lock:
+            self.counts[index] += 1
+            self.total += value
+
+    def samples(self):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.total
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            yield self.name + "_bucket", {"le": format_value(bound)}, cumulative
+        yield self.name + "_sum", {}, total
+        yield self.name + "_count", {}, cumulative
+
+
+# --- Текстовий формат ---
+def render():
+    lines = []
+    for metric in list(registry):
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{escape(str(value))}"' for key, value in labels.items())
+    return "{" + pairs + "}"
+
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+# --- Адмін-порт: GET /metrics ---
+# Окремий потік із власним HTTP-сервером, тож працює з будь-яким рушієм чату
+# і не займає цикл подій asyncio.
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # кожен збір метрик у консоль не пишемо
+
+
+def serve(host, port):
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
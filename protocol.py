@@ -0,0 +1,341 @@
+import base64
+import binascii
+import hashlib
+import re
+import socket
+import struct
+import zlib
+
+from framing import MAX_FRAME, FrameBuffer, ProtocolError
+
+# --- Версії протоколу ---
+PROTO_TEXT = 1     # старий формат: TYPE@поле@поле\n, аватари в base64
+PROTO_BINARY = 2   # v2: [u32 довжина][u8 тип][u32 довжина поля][поле]...
+HELLO_TIMEOUT = 2.0  # скільки чекаємо на HELLO від сервера/клієнта, перш ніж вважати його старим
+
+# --- Можливості, які сторони узгоджують у HELLO ---
+FEATURE_AVATAR_REF = "avatar-ref"  # аватари як user -> hash, байти — лише на запит AVATARGET
+FEATURE_HISTORY = "history"        # сервер веде журнал і відповідає на HISTORY
+FEATURE_RESUME = "resume"          # кадри розсилки мають seq, сесію можна відновити через RESUME (лише v2)
+FEATURE_BLOB = "blob"              # потокові завантаження шматками (BLOB*) і файли (FILE*)
+FEATURE_DEFLATE = "deflate"        # великі кадри v2 стискаються zlib зі спільним словником (лише v2)
+FEATURE_ROOMS = "rooms"            # кімнати: JOIN, список ROOMS, присутність MEMBERS
+
+DEFAULT_ROOM = "general"  # кімната, у яку потрапляє кожен клієнт після входу (і старі клієнти — назавжди)
+
+# --- Типи кадрів ---
+# скільки полів має кожен тип (останнє поле може містити "@")
+FIELD_COUNTS = {
+    "TEXT": 2, "AVATAR": 3, "RENAME": 2, "HELLO": 2,
+    "AVATARREF": 3,   # user@filename@hash
+    "AVATARGET": 1,   # hash
+    "AVATARDATA": 2,  # hash@bytes
+    "HISTORY": 2,     # last@N | since@seq від клієнта; end@seq від сервера після підвантаження
+    "SESSION": 1,     # token — сервер видає токен сесії для RESUME
+    "RESUME": 2,      # token@seq від клієнта; ok@seq або fail@ від сервера
+    "BLOBSTART": 5,   # id@kind@size@user@name — початок завантаження (kind: avatar | file)
+    "BLOBCHUNK": 2,   # id@bytes
+    "BLOBEND": 2,     # id@sha256 від клієнта; id@ok від сервера
+    "BLOBACK": 2,     # id@скільки байтів записано — кредит для наступних шматків
+    "BLOBFAIL": 2,    # id@причина
+    "FILE": 4,        # user@hash@size@name — у чаті з'явився файл
+    "FILEGET": 1,     # hash
+    "FILEDATA": 3,    # hash@offset@bytes
+    "FILEEND": 2,     # hash@ok | hash@missing
+    "JOIN": 1,        # room — перейти в кімнату; сервер відповідає тим самим кадром, коли перевів
+    "ROOMS": 1,       # назви кімнат через кому
+    "MEMBERS": 2,     # room@ніки через ", " — хто зараз у кімнаті
+}
+# які поля бінарні: у v2 йдуть як є, у текстовому протоколі — base64
+BINARY_FIELDS = {"AVATAR": (2,), "AVATARDATA": (1,), "BLOBCHUNK": (1,), "FILEDATA": (2,)}
+# кадри, які політика skip-avatars може викинути першими
+AVATAR_TYPES = {"AVATAR", "AVATARDATA"}
+# коди типів для v2; 0 — довільний тип, назва якого йде першим полем
+TYPE_CODES = {
+    "TEXT": 1, "AVATAR": 2, "RENAME": 3, "AVATARREF": 4, "AVATARGET": 5, "AVATARDATA": 6,
+    "HISTORY": 7, "SESSION": 8, "RESUME": 9,
+    "BLOBSTART": 10, "BLOBCHUNK": 11, "BLOBEND": 12, "BLOBACK": 13, "BLOBFAIL": 14,
+    "FILE": 15, "FILEGET": 16, "FILEDATA": 17, "FILEEND": 18,
+    "JOIN": 19, "ROOMS": 20, "MEMBERS": 21,
+}
+TYPE_NAMES = {code: name for name, code in TYPE_CODES.items()}
+# назва довільного типу (код 0) — лише латиниця, цифри, "_" і "-": у v1 вона стоїть на початку
+# рядка, тож перенос рядка чи "@" у ній дописали б отримувачу чужі кадри
+TYPE_NAME = re.compile(r"[A-Za-z0-9_-]{1,32}")
+
+LENGTH = struct.Struct("!I")
+HEADER = struct.Struct("!IB")
+SEQ = struct.Struct("!Q")
+FLAG_SEQ = 0x80      # біт у коді типу: одразу після нього йде u64 seq кадру
+FLAG_DEFLATE = 0x40  # біт у коді типу: поля кадру стиснуті (raw deflate з ZDICT)
+# коди типів мають лишатись меншими за 0x40 — старші біти зайняті прапорцями
+
+# --- Стиснення кадрів v2 ---
+# Стискається кожен кадр окремо, а не весь потік: тоді стиснені байти кадру розсилки
+# однакові для всіх отримувачів і рахуються один раз (див. Frame.encode_for).
+# Щоб короткі кадри теж щось вигравали, обидві сторони беруть спільний словник
+# з типових для чату фрагментів. Словник — частина протоколу: змінювати його
+# можна лише разом із назвою FEATURE_DEFLATE.
+COMPRESS_MIN = 256    # кадри з меншим тілом не стискаємо — заголовок zlib з'їсть виграш
+COMPRESS_LEVEL = 6
+ZDICT = b"".join(part.encode() if isinstance(part, str) else part for part in (
+    b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x1e\x00\x00\x00\x1e\x08\x06\x00\x00\x00",
+    "0123456789abcdef", ".png", ".jpg", ".gif", "avatar", "file", "last", "since", "end", "ok",
+    "Аватар ", " відхилено: файл пошкоджений або завеликий",
+    " вошёл в тёмную комнату", " вийшов з чату", " підключився",
+    b"\x00\x00\x00\x06SYSTEM\x00\x00\x00", b"\x00\x00\x00@", b"\x00\x00\x00",
+))
+
+
+# --- Адреса вмісту аватара: однакові картинки мають однаковий хеш ---
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+# --- Кодування одного кадру ---
+def encode(proto, msg_type, fields, compressed=False) -> bytes:
+    if proto == PROTO_BINARY:
+        data = encode_binary(msg_type, fields)
+        return compress_binary(data) if compressed else data
+    return encode_line(msg_type, fields)
+
+
+def encode_line(msg_type, fields) -> bytes:
+    if msg_type not in TYPE_CODES and not valid_type(msg_type):
+        msg_type = re.sub(r"[^A-Za-z0-9_-]", "_", msg_type[:32]) or "_"
+    binary = BINARY_FIELDS.get(msg_type, ())
+    parts = [msg_type]
+    for i, field in enumerate(fields):
+        if i in binary:
+            field = base64.b64encode(field).decode()
+        else:
+            field = field.replace("\n", " ")  # у v1 кадр закінчується переносом рядка
+        parts.append(field)
+    return ("@".join(parts) + "\n").encode()
+
+
+def encode_binary(msg_type, fields) -> bytes:
+    code = TYPE_CODES.get(msg_type, 0)
+    if code == 0:
+        fields = (msg_type, *fields)
+    chunks = []
+    for field in fields:
+        if isinstance(field, str):
+            field = field.encode()
+        chunks.append(LENGTH.pack(len(field)))
+        chunks.append(field)
+    body = b"".join(chunks)
+    return HEADER.pack(len(body) + 1, code) + body
+
+
+# той самий кадр v2, але з номером seq (для клієнтів з FEATURE_RESUME)
+def stamp_binary(data, seq) -> bytes:
+    length, code = HEADER.unpack_from(data)
+    return HEADER.pack(length + SEQ.size, code | FLAG_SEQ) + SEQ.pack(seq) + data[HEADER.size:]
+
+
+# стиснений варіант кадру v2 (без seq); якщо стиснення не дає виграшу — кадр як є
+def compress_binary(data, minimum=None) -> bytes:
+    body = memoryview(data)[HEADER.size:]
+    if len(body) < (COMPRESS_MIN if minimum is None else minimum):
+        return data
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -15, zdict=ZDICT)
+    packed = compressor.compress(body) + compressor.flush()
+    if len(packed) >= len(body):
+        return data  # картинки й архіви вже стиснені
+    return HEADER.pack(len(packed) + 1, data[LENGTH.size] | FLAG_DEFLATE) + packed
+
+
+def inflate(data, limit=MAX_FRAME) -> bytes:
+    decompressor = zlib.decompressobj(-15, zdict=ZDICT)
+    try:
+        body = decompressor.decompress(data, limit)
+    except zlib.error:
+        raise ProtocolError("зіпсований стиснений кадр")
+    if decompressor.unconsumed_tail:
+        raise ProtocolError("розпакований кадр завеликий")
+    return body
+
+
+# --- Розбір кадрів ---
+def parse_line(line: str):
+    msg_type, _, rest = line.partition("@")
+    count = FIELD_COUNTS.get(msg_type, 3)
+    fields = rest.split("@", count - 1) if rest else []
+    for i in BINARY_FIELDS.get(msg_type, ()):
+        if i < len(fields):
+            try:
+                fields[i] = base64.b64decode(fields[i])
+            except (binascii.Error, ValueError):
+                raise ProtocolError(f"зіпсований base64 у кадрі {msg_type}")
+    return msg_type, fields
+
+
+def valid_type(msg_type) -> bool:
+    return TYPE_NAME.fullmatch(msg_type) is not None
+
+
+# повертає (тип, поля, seq); seq — None, якщо кадр без номера
+def decode_binary(body) -> tuple:
+    code = body[0]
+    raw = []
+    pos = 1
+    end = len(body)
+    seq = None
+    if code & FLAG_SEQ:
+        if end < pos + SEQ.size:
+            raise ProtocolError("обрізаний seq кадру")
+        code &= ~FLAG_SEQ
+        (seq,) = SEQ.unpack_from(body, pos)
+        pos += SEQ.size
+    if code & FLAG_DEFLATE:
+        code &= ~FLAG_DEFLATE
+        body = inflate(body[pos:])
+        pos = 0
+        end = len(body)
+    while pos < end:
+        if pos + LENGTH.size > end:
+            raise ProtocolError("обрізане поле кадру")
+        (size,) = LENGTH.unpack_from(body, pos)
+        pos += LENGTH.size
+        if pos + size > end:
+            raise ProtocolError("обрізане поле кадру")
+        raw.append(bytes(body[pos:pos + size]))
+        pos += size
+    if code == 0:
+        if not raw:
+            raise ProtocolError("кадр без типу")
+        msg_type = raw.pop(0).decode(errors="replace")
+        if not valid_type(msg_type):
+            raise ProtocolError("недопустима назва типу кадру")
+    else:
+        msg_type = TYPE_NAMES.get(code)
+        if msg_type is None:
+            raise ProtocolError(f"невідомий тип кадру {code}")
+    binary = BINARY_FIELDS.get(msg_type, ())
+    fields = [field if i in binary else field.decode(errors="replace") for i, field in enumerate(raw)]
+    return msg_type, fields, seq
+
+
+# --- Кадр для розсилки: кодується один раз для кожної версії протоколу ---
+# seq присвоює сервер під час розсилки; кадр з номером кодується окремо
+# для тих, хто погодив FEATURE_RESUME. Стиснений варіант теж рахується раз
+# і спільний для всіх з FEATURE_DEFLATE (seq лежить поза стисненою частиною).
+class Frame:
+    __slots__ = ("msg_type", "fields", "kind", "encoded", "seq")
+
+    def __init__(self, msg_type, fields):
+        self.msg_type = msg_type
+        self.fields = tuple(fields)
+        self.kind = "avatar" if msg_type in AVATAR_TYPES else "text"
+        self.encoded = {}
+        self.seq = None
+
+    def encode_for(self, proto, stamped=False, compressed=False) -> bytes:
+        stamped = stamped and self.seq is not None and proto == PROTO_BINARY
+        compressed = compressed and proto == PROTO_BINARY
+        key = (proto, stamped, compressed)
+        data = self.encoded.get(key)
+        if data is None:
+            if stamped:
+                data = stamp_binary(self.encode_for(PROTO_BINARY, False, compressed), self.seq)
+            elif compressed:
+                data = compress_binary(self.encode_for(PROTO_BINARY))
+            else:
+                data = encode(proto, self.msg_type, self.fields)
+            self.encoded[key] = data
+        return data
+
+
+# --- Потоковий розбір вхідних байтів у кадри ---
+# proto можна змінити посеред потоку (після HELLO) — наступні кадри читаються вже в новому форматі.
+# Байти накопичуються у FrameBuffer: recv_from() читає з сокета просто в нього,
+# feed() — для тих, хто вже отримав bytes (asyncio, залишок після рукостискання).
+class FrameReader:
+    def __init__(self, proto=PROTO_TEXT, max_frame=MAX_FRAME):
+        self.proto = proto
+        self.max_frame = max_frame
+        self.buffer = FrameBuffer(max_frame)
+        self.seq = 0  # seq останнього кадру з номером
+        self.size = 0  # скільки байтів займав у потоці останній розібраний кадр (для метрик)
+
+    def recv_from(self, sock) -> int:
+        return self.buffer.recv_into(sock)
+
+    def feed(self, data):
+        if data:
+            self.buffer.feed(data)
+        return self.frames()
+
+    def frames(self):
+        buffer = self.buffer
+        while buffer:
+            if self.proto == PROTO_BINARY:
+                if len(buffer) < LENGTH.size:
+                    return
+                (length,) = buffer.peek(LENGTH)
+                if length == 0 or length > self.max_frame:
+                    raise ProtocolError(f"неприпустима довжина кадру {length}")
+                if len(buffer) < LENGTH.size + length:
+                    return
+                buffer.skip(LENGTH.size)
+                self.size = LENGTH.size + length
+                body = buffer.take(length)
+                try:
+                    msg_type, fields, seq = decode_binary(body)
+                finally:
+                    body.release()
+                if seq is not None:
+                    self.seq = seq
+                yield msg_type, fields
+            else:
+                line = buffer.take_line()
+                if line is None:
+                    return
+                self.size = len(line) + 1
+                line = line.decode(errors="ignore").strip()
+                if not line:
+                    continue
+                try:
+                    frame = parse_line(line)
+                except ProtocolError:
+                    continue  # рядок самодостатній — пропускаємо лише його
+                yield frame
+
+
+# --- Рукостискання ---
+def hello_line(proto, features=()) -> bytes:
+    return encode_line("HELLO", (str(proto), ",".join(sorted(features))))
+
+
+def parse_hello(fields):
+    try:
+        proto = int(fields[0])
+    except (IndexError, ValueError):
+        proto = PROTO_TEXT
+    features = set(filter(None, fields[1].split(","))) if len(fields) > 1 else set()
+    return proto, features
+
+
+# клієнт пропонує v2 і чекає відповіді; старий сервер HELLO не знає — тоді лишаємось на v1
+def client_handshake(sock, features=(), timeout=HELLO_TIMEOUT):
+    sock.sendall(hello_line(PROTO_BINARY, features))
+    data = b""
+    sock.settimeout(timeout)
+    try:
+        while b"\n" not in data:
+            chunk = sock.recv(8192)
+            if not chunk:
+                break
+            data += chunk
+    except socket.timeout:
+        pass
+    finally:
+        sock.settimeout(None)
+    line, sep, rest = data.partition(b"\n")
+    if sep and line.startswith(b"HELLO@"):
+        _, fields = parse_line(line.decode(errors="ignore").strip())
+        proto, accepted = parse_hello(fields)
+        return min(proto, PROTO_BINARY), accepted, rest
+    # усе, що вже прочитали, — звичайні текстові кадри старого сервера
+    return PROTO_TEXT, set(), data
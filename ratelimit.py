@@ -0,0 +1,85 @@
+import time
+
+# --- Обмеження потоку від одного клієнта (відра токенів) ---
+# Кожен кадр, який сервер розсилає, множиться на кількість отримувачів, тож
+# відправника стримуємо на вході. Токени беруться наперед, у борг: невеликий борг
+# клієнт "відсиджує" — сервер просто не читає його сокет, поки борг не покриється
+# (TCP сам пригальмує відправника). Якщо чекати довелося б довше за max_delay, кадр
+# відкидається, а хто відкинутого набирає забагато, той відключається.
+OK = "ok"
+DELAY = "delay"
+DROP = "drop"
+DISCONNECT = "disconnect"
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate, burst):
+        self.rate = rate    # токенів за секунду
+        self.burst = burst  # скільки може накопичитись
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    # повертає, скільки секунд чекати, поки борг покриється (0 — токенів вистачило)
+    def take(self, amount, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def refund(self, amount):
+        self.tokens += amount
+
+
+def bucket(rate, burst):
+    if rate <= 0:
+        return None  # обмеження вимкнено
+    return TokenBucket(rate, max(burst, 1))
+
+
+# --- Налаштування обмежень (спільні для всіх з'єднань) ---
+class Limits:
+    __slots__ = ("messages", "bytes", "avatars", "max_delay", "strikes")
+
+    def __init__(self, messages, bytes_, avatars, max_delay=1.0, strikes=50):
+        self.messages = messages    # (кадрів за секунду, запас)
+        self.bytes = bytes_         # (байтів за секунду, запас)
+        self.avatars = avatars      # (аватарів за секунду, запас)
+        self.max_delay = max_delay  # довше не затримуємо — відкидаємо
+        self.strikes = strikes      # скільки відкинутих кадрів терпимо (запас відновлюється по одному за секунду)
+
+
+# --- Відра одного з'єднання ---
+class FloodControl:
+    __slots__ = ("messages", "bytes", "avatars", "strikes", "max_delay", "dropped_run")
+
+    def __init__(self, limits):
+        self.messages = bucket(*limits.messages)
+        self.bytes = bucket(*limits.bytes)
+        self.avatars = bucket(*limits.avatars)
+        self.strikes = bucket(1.0, limits.strikes) if limits.strikes > 0 else None
+        self.max_delay = limits.max_delay
+        self.dropped_run = 0  # скільки кадрів відкинуто поспіль (1 — щойно почали відкидати)
+
+    # size — байти, що підлягають обмеженню (0 — кадр не рахується в байтах); avatar — кадр аватара.
+    # Повертає (дія, секунди затримки)
+    def admit(self, size, avatar, now=None):
+        now = time.monotonic() if now is None else now
+        wait = 0.0
+        taken = []
+        for limit, amount in ((self.messages, 1), (self.bytes, size), (self.avatars, 1 if avatar else 0)):
+            if limit is not None and amount:
+                wait = max(wait, limit.take(amount, now))
+                taken.append((limit, amount))
+        if wait <= self.max_delay:
+            self.dropped_run = 0
+            return (OK, 0.0) if wait == 0 else (DELAY, wait)
+        for limit, amount in taken:  # кадр не пройшов — токени не витрачено
+            limit.refund(amount)
+        self.dropped_run += 1
+        if self.strikes is not None and self.strikes.take(1, now) > 0:
+            return DISCONNECT, 0.0
+        return DROP, 0.0
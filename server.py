@@ -1,126 +1,1839 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import itertools
+import multiprocessing
+import os
+import re
+import signal
 import socket
+import sys
 import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import federation
+import metrics
+import protocol
+import ratelimit
+import shards
+import thumbnails
+import tracing
+import transfers
+from history import HistoryLog, HistoryReader
+from protocol import Frame
 
 # --- Налаштування сервера ---
 HOST = '0.0.0.0'  # адреса сервера (локальний комп'ютер)
 PORT = 12345        # порт для з'єднання
 
+# --- Вхід нових клієнтів ---
+# Приймання з'єднань нічого не чекає: HELLO, вхід у кімнату і знімок (аватари, список кімнат)
+# обробляє вже потік чи корутина клієнта, а знімок іде в сокет через чергу його письменника.
+listen_backlog = socket.SOMAXCONN  # скільки з'єднань ядро тримає, поки сервер їх не прийняв
+MAX_HANDSHAKES = 64                # скільки рукостискань потоковий рушій обробляє одночасно
+admission = threading.BoundedSemaphore(MAX_HANDSHAKES)
+ACCEPT_POLL = 1.0                  # як часто головний потік прокидається з accept()
+
+# --- Черги відправки ---
+SEND_QUEUE_SIZE = 1024          # максимум кадрів у черзі одного клієнта
+OVERFLOW_POLICIES = ("drop-oldest", "disconnect", "skip-avatars")
+overflow_policy = "drop-oldest"  # що робити, коли черга клієнта переповнена
+IOV_MAX = 64                     # скільки кадрів віддаємо одним sendmsg
+HAVE_SENDMSG = hasattr(socket.socket, "sendmsg")  # на Windows sendmsg немає
+
+# --- Захист від флуду (див. ratelimit.py) ---
+# Кадри, що розсилаються, стримуються відрами токенів на кожне з'єднання: за кількістю,
+# за байтами і окремо, суворіше, — аватари. None — обмеження вимкнено.
+flood_limits = ratelimit.Limits(
+    messages=(20, 60),                 # кадрів за секунду, запас
+    bytes_=(256 * 1024, 1024 * 1024),  # байтів за секунду, запас (аватари й завантаження рахуються окремо)
+    avatars=(6 / 60, 3),               # аватарів за секунду, запас
+)
+FLOOD_EXEMPT = {"HELLO", "BLOBCHUNK", "BLOBEND"}  # шматки завантаження і так стримують кредити BLOBACK
+FLOOD_UNMETERED_BYTES = {"AVATAR", "BLOBSTART"}    # великі за природою — для них є відро аватарів і MAX_UPLOADS
+
+# --- Історія повідомлень ---
+HISTORY_DIR = "history"    # каталог журналу історії
+history_dir = None         # None — історія вимкнена; інакше кожна кімната має свій журнал
+history_segment_bytes = 64 * 1024 * 1024
+history_segments = 0
+AUTHOR_FIELDS = {"TEXT": 0, "FILE": 0, "RENAME": 1}  # поле з ніком автора: такі кадри автору наживо не розсилаються
+
+# --- Файли ---
+FILES_DIR = "files"        # каталог сховища файлів
+file_store = None          # transfers.FileStore; None — обмін файлами вимкнено
+MAX_FILE_BYTES = transfers.MAX_FILE_BYTES
+
 # --- Глобальні структури ---
-clients = []          # список усіх підключених клієнтів
-usernames = {}        # словник: socket -> username (нік користувача)
-avatars = {}          # словник: username -> (filename, base64) для збереження аватарів
+SYSTEM_NAME = "SYSTEM"  # автор службових повідомлень — ніком бути не може
+connection_ids = itertools.count(1)  # номери з'єднань — щоб назвати клієнта іншому процесу
+avatars = {}          # словник: username -> (filename, hash) — самі байти лежать у avatar_store
+avatar_frames = {}    # словник: username -> (hash, повний кадр AVATAR) для старих клієнтів
+avatars_lock = threading.Lock()  # avatars і avatar_store змінюють потоки клієнтів, пул і шина
+SERVER_FEATURES = {
+    protocol.FEATURE_AVATAR_REF, protocol.FEATURE_RESUME, protocol.FEATURE_BLOB, protocol.FEATURE_ROOMS,
+}
+V2_FEATURES = {protocol.FEATURE_RESUME, protocol.FEATURE_DEFLATE}  # можливі лише в кадрах v2
+
+# --- Нумерація кадрів і сесії ---
+broadcast_lock = threading.Lock()  # seq присвоюється і кадр ставиться в черги атомарно — порядок у всіх однаковий
+RESUME_GRACE = 15.0                # стільки секунд чекаємо на RESUME, перш ніж оголосити, що користувач вийшов
+pending_leaves = {}                # нік -> відкладене оголошення виходу (Timer або asyncio.TimerHandle)
+session_key = os.urandom(32)       # ключ підпису токенів; з журналом історії зберігається поруч, щоб пережити перезапуск
+
+# --- Обробка аватарів ---
+thumbnail_pool = None  # ProcessPoolExecutor: Pillow не блокує мережевий цикл і не тримає GIL
+engine_loop = None     # цикл подій asyncio-рушія; None — потоковий рушій
+client_tasks = set()   # корутини з'єднань asyncio-рушія — щоб закрити їх при зупинці
+
+# --- Кілька процесів (--processes) ---
+shard = None           # shards.Bus воркера; None — сервер працює в одному процесі
+remote_presence = {}   # номер воркера або вузла -> {кімната: ніки там}; у концентратора — усі воркери
+
+# --- Кілька вузлів (--relay-port, --peer) ---
+relay = None           # federation.Relay; None — вузол сам по собі
+RELAY_KEY_ENV = "LOGITALK_RELAY_KEY"
+
+
+# --- Сховище аватарів за хешем вмісту ---
+# Однакові картинки від різних користувачів зберігаються один раз;
+# блоб видаляється, коли на нього більше не посилається жоден нік.
+class AvatarStore:
+    def __init__(self):
+        self.frames = {}  # hash -> Frame("AVATARDATA") — і байти, і готові кодування
+        self.refs = {}    # hash -> скільки ніків його використовують
+
+    def put(self, data: bytes) -> str:
+        digest = protocol.content_hash(data)
+        if digest not in self.frames:
+            self.frames[digest] = Frame("AVATARDATA", (digest, data))
+        self.refs[digest] = self.refs.get(digest, 0) + 1
+        return digest
+
+    def release(self, digest):
+        count = self.refs.get(digest, 0) - 1
+        if count > 0:
+            self.refs[digest] = count
+        else:
+            self.refs.pop(digest, None)
+            self.frames.pop(digest, None)
+
+    def data(self, digest) -> bytes:
+        return self.frames[digest].fields[1]
+
+    def frame(self, digest):
+        return self.frames.get(digest)
+
+    @property
+    def size_bytes(self):
+        return sum(len(frame.fields[1]) for frame in list(self.frames.values()))
+
+
+avatar_store = AvatarStore()
+
+
+# --- Реєстр сесій: хто в чаті і під яким ніком ---
+# Нік лежить у самому з'єднанні, а реєстр тримає зворотний індекс нік -> з'єднання,
+# тож пошук в обидва боки — O(1). Список клієнтів — незмінний кортеж: його перебудовують
+# лише вхід і вихід, а всі, хто обходить, беруть поточний кортеж без копії й без замка.
+class SessionRegistry:
+    __slots__ = ("lock", "clients", "by_name")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clients = ()  # Connection у чаті
+        self.by_name = {}  # нік -> кортеж з'єднань (з одним ніком можна сидіти з кількох вікон)
+
+    def __len__(self):
+        return len(self.clients)
+
+    def add(self, client):
+        with self.lock:
+            self.clients += (client,)
+
+    # повертає нік, під яким був клієнт (None — не представився)
+    def remove(self, client):
+        with self.lock:
+            self.clients = tuple(other for other in self.clients if other is not client)
+            name = client.name
+            self.unindex(client)
+            client.name = None
+            return name
+
+    # False — нік той самий, нічого не змінилось
+    def rename(self, client, name) -> bool:
+        with self.lock:
+            if client.name == name:
+                return False
+            self.unindex(client)
+            client.name = name
+            self.by_name[name] = self.by_name.get(name, ()) + (client,)
+            return True
+
+    def unindex(self, client):
+        if client.name is None:
+            return
+        rest = tuple(other for other in self.by_name.get(client.name, ()) if other is not client)
+        if rest:
+            self.by_name[client.name] = rest
+        else:
+            del self.by_name[client.name]
+
+    def online(self, name) -> bool:
+        return name in self.by_name
+
+
+sessions = SessionRegistry()
+
+
+# --- Метрики (віддаються на адмін-порт, див. --metrics-port) ---
+# Тип кадру в мітках — лише відомі протоколу: інакше клієнт роздуває метрики довільними типами.
+FRAMES_IN = metrics.Counter("logitalk_frames_received_total", "Кадри від клієнтів за типом", ("type",))
+BYTES_IN = metrics.Counter("logitalk_received_bytes_total", "Байти кадрів від клієнтів за типом", ("type",))
+FRAMES_OUT = metrics.Counter("logitalk_frames_sent_total", "Кадри, поставлені в черги відправки, за типом", ("type",))
+BYTES_OUT = metrics.Counter("logitalk_sent_bytes_total", "Байти кадрів, поставлених у черги відправки, за типом", ("type",))
+SEND_DROPS = metrics.Counter(
+    "logitalk_send_dropped_total", "Кадри, що не потрапили до клієнта через переповнену чергу чи закрите з'єднання", ("reason",)
+)
+SEND_ERRORS = metrics.Counter("logitalk_send_errors_total", "Помилки запису в сокет клієнта", ("error",))
+RECV_ERRORS = metrics.Counter("logitalk_receive_errors_total", "З'єднання, обірвані помилкою читання чи розбору", ("error",))
+AVATAR_ERRORS = metrics.Counter("logitalk_avatar_pool_errors_total", "Збої процесу пулу під час обробки аватара")
+CONNECTIONS = metrics.Counter("logitalk_connections_total", "Прийняті з'єднання")
+FLOOD_ACTIONS = metrics.Counter(
+    "logitalk_flood_actions_total", "Кадри, що перевищили ліміт клієнта: затримані, відкинуті, відключення", ("action",)
+)
+RELAY_EVENTS = metrics.Counter("logitalk_relay_events_total", "Події між вузлами: надіслані й прийняті", ("direction",))
+FANOUT_SECONDS = metrics.Histogram(
+    "logitalk_broadcast_fanout_seconds", "Час розсилки кадру кімнаті: seq, журнал і постановка в черги",
+    (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+metrics.Gauge("logitalk_connected_clients", "Клієнти в чаті", lambda: len(sessions))
+metrics.Gauge("logitalk_rooms", "Кімнати", lambda: len(rooms))
+metrics.Gauge("logitalk_send_queue_frames", "Кадри в чергах відправки всіх клієнтів",
+              lambda: sum(client.queue_depth for client in sessions.clients))
+metrics.Gauge("logitalk_send_queue_max_frames", "Найдовша черга відправки одного клієнта",
+              lambda: max((client.queue_depth for client in sessions.clients), default=0))
+metrics.Gauge("logitalk_avatar_store_bytes", "Байти аватарів у сховищі", lambda: avatar_store.size_bytes)
+metrics.Gauge("logitalk_avatar_store_blobs", "Різні аватари у сховищі", lambda: len(avatar_store.frames))
+metrics.Gauge("logitalk_relay_peers", "Сусідні вузли на зв'язку", lambda: relay.peers if relay is not None else 0)
+
+
+def type_label(msg_type):
+    return msg_type if msg_type in protocol.FIELD_COUNTS else "other"
+
+
+def count_out(msg_type, frames, size):
+    if frames:
+        label = type_label(msg_type)
+        FRAMES_OUT.inc(label, amount=frames)
+        BYTES_OUT.inc(label, amount=size)
+
+
+# --- Кімнати ---
+# Кожна кімната — власний набір підписників, журнал історії й нумерація seq,
+# тож розсилка коштує O(учасників кімнати), а не O(усіх клієнтів).
+ROOM_NAME = re.compile(r"[\w-]{1,32}")  # назва ще й ім'я каталогу журналу — без крапок і слешів
+MAX_ROOMS = 1000
+rooms = {}                    # назва -> Room
+rooms_lock = threading.Lock()
+
 
+class Room:
+    def __init__(self, name, log=None):
+        self.name = name
+        self.members = frozenset()        # Connection, які отримують розсилки кімнати; змінюється лише заміною
+        self.log = log                    # HistoryLog кімнати; None — історія вимкнена
+        self.counter = itertools.count(1)  # без журналу seq рахуємо в пам'яті
+        self.last_seq = log.last_seq if log is not None else 0
 
-# --- Відправка даних одному клієнту ---
-def send_to_client(client_socket, data: str):
+    # наступний seq; кадр, якщо є журнал, у нього записується
+    def stamp(self, frame):
+        if self.log is not None:
+            # у журнал іде вже закодований для v2 кадр — його ж отримають клієнти v2
+            frame.seq = self.log.append(frame.encode_for(protocol.PROTO_BINARY))
+        else:
+            frame.seq = next(self.counter)
+        self.last_seq = frame.seq
+
+    # склад міняється під broadcast_lock новим знімком — розсилка обходить старий без копії
+    def add(self, client):
+        self.members = self.members | {client}
+
+    def discard(self, client):
+        if client in self.members:
+            self.members = self.members - {client}
+
+    # воркер: seq уже присвоїв концентратор
+    def advance(self, seq):
+        self.last_seq = seq
+        if self.log is not None:
+            self.log.advance(seq)
+
+
+def get_room(name):
+    with rooms_lock:
+        room = rooms.get(name)
+        if room is None:
+            log = None
+            if history_dir and shard is not None:
+                log = HistoryReader(room_history_dir(name))  # журнал пише концентратор
+            elif history_dir:
+                log = HistoryLog(
+                    room_history_dir(name),
+                    segment_bytes=history_segment_bytes,
+                    max_segments=history_segments,
+                )
+            room = rooms[name] = Room(name, log)
+        return room
+
+
+# загальна кімната лежить у корені каталогу історії — журнал до появи кімнат лишається її історією
+def room_history_dir(name):
+    if name == protocol.DEFAULT_ROOM:
+        return history_dir
+    return os.path.join(history_dir, "rooms", name)
+
+
+# кімнати, що мають журнал з минулих запусків, одразу з'являються у списку
+def load_rooms():
+    get_room(protocol.DEFAULT_ROOM)
+    if not history_dir:
+        return
     try:
-        client_socket.sendall(data.encode())  # відправляємо повідомлення у байтах
-    except:
-        pass  # якщо помилка — нічого не робимо
+        names = os.listdir(os.path.join(history_dir, "rooms"))
+    except FileNotFoundError:
+        return
+    for name in sorted(names)[:MAX_ROOMS - 1]:
+        if ROOM_NAME.fullmatch(name):
+            get_room(name)
 
 
-# --- Розсилка повідомлення усім клієнтам ---
-def broadcast(data: str, exclude_socket=None):
-    for client in clients:
-        if client != exclude_socket:  # не відправляти назад відправнику
-            send_to_client(client, data)
+# --- З'єднання з власною обмеженою чергою відправки ---
+# Розсилка лише кладе кадр у чергу, а віддає його в сокет окремий
+# "письменник" (потік або корутина), тож повільний клієнт не гальмує інших.
+class Connection:
+    __slots__ = (
+        "addr", "id", "queue", "lock", "closed", "dropped", "proto", "reader", "joined",
+        "features", "stamped", "deflate", "uploads", "room", "name", "flood",
+    )
 
+    def __init__(self, addr):
+        self.addr = addr
+        self.id = next(connection_ids)
+        self.queue = deque()               # (kind, data) — data: спільні для всіх отримувачів bytes
+        self.lock = threading.Condition()  # захищає чергу (потоковий рушій)
+        self.closed = False
+        self.dropped = 0                   # скільки кадрів викинуто через переповнення
+        self.proto = protocol.PROTO_TEXT   # версія протоколу, узгоджена через HELLO
+        self.reader = protocol.FrameReader()
+        self.joined = False                # True — клієнт у реєстрі sessions і в одній з кімнат
+        self.features = set()              # можливості, узгоджені в HELLO
+        self.stamped = False               # True — кадри розсилки йдуть з seq (FEATURE_RESUME)
+        self.deflate = False               # True — великі кадри шлемо стиснутими (FEATURE_DEFLATE)
+        self.uploads = {}                  # id -> transfers.Upload, що ще приймаються
+        self.room = None                   # назва кімнати, розсилки якої отримує клієнт
+        self.name = None                   # нік; змінює лише sessions.rename
+        self.flood = ratelimit.FloodControl(flood_limits) if flood_limits is not None else None
 
-# --- Обробка клієнта в окремому потоці ---
-def handle_client(client_socket):
-    buffer = ""
-    while True:
+    @property
+    def queue_depth(self):
+        return len(self.queue)
+
+    def send(self, data: bytes, kind="text"):
+        with self.lock:
+            if self.closed:
+                SEND_DROPS.inc("closed")
+                return
+            if len(self.queue) >= SEND_QUEUE_SIZE and not self.make_room(kind):
+                return
+            self.queue.append((kind, data))
+            self.wake_writer()
+
+    # звільняє місце в черзі згідно з overflow_policy; False — новий кадр не ставимо
+    def make_room(self, kind):
+        self.dropped += 1
+        if overflow_policy == "disconnect":
+            SEND_DROPS.inc("disconnect")
+            print(f"Клієнт {self.addr} не встигає читати — відключаємо")
+            self.close()
+            return False
+        if overflow_policy == "skip-avatars":
+            for i, (queued_kind, _) in enumerate(self.queue):
+                if queued_kind == "avatar":
+                    SEND_DROPS.inc("avatar")
+                    del self.queue[i]
+                    return True
+            if kind == "avatar":
+                SEND_DROPS.inc("avatar")  # у черзі аватарів немає — не ставимо новий
+                return False
+        SEND_DROPS.inc("oldest")
+        self.queue.popleft()  # drop-oldest (і запасний варіант для skip-avatars)
+        return True
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.queue.clear()
+            self.wake_writer()
+        self.shutdown()
+
+    def wake_writer(self):
+        raise NotImplementedError
+
+    def shutdown(self):
+        raise NotImplementedError
+
+
+# --- З'єднання потокового рушія ---
+class ThreadConnection(Connection):
+    __slots__ = ("sock",)
+
+    def __init__(self, sock, addr):
+        super().__init__(addr)
+        self.sock = sock
+        threading.Thread(target=self.writer_loop, daemon=True).start()
+
+    def wake_writer(self):
+        self.lock.notify_all()  # крім письменника, на умові може чекати потік історії
+
+    def writer_loop(self):
+        while True:
+            with self.lock:
+                while not self.queue and not self.closed:
+                    self.lock.wait()
+                if self.closed:
+                    break
+                batch = [data for _, data in self.queue]
+                self.queue.clear()
+                self.lock.notify_all()  # у черзі з'явилось місце
+            try:
+                with tracing.root("write", "net", frames=len(batch)):
+                    self.send_batch(batch)
+            except OSError as e:
+                if not self.closed:  # сокет закрили ми самі — це не помилка відправки
+                    SEND_ERRORS.inc(type(e).__name__)
+                self.close()
+                break
+
+    # scatter-gather: кілька кадрів з черги йдуть одним системним викликом без склеювання
+    def send_batch(self, batch):
+        if not HAVE_SENDMSG or len(batch) == 1:
+            for data in batch:
+                self.sock.sendall(data)
+            return
+        views = deque(memoryview(data) for data in batch)
+        while views:
+            sent = self.sock.sendmsg(list(itertools.islice(views, IOV_MAX)))
+            # прибираємо повністю відправлені буфери, частково відправлений зсуваємо
+            while sent:
+                head = views[0]
+                if sent >= len(head):
+                    sent -= len(head)
+                    views.popleft()
+                else:
+                    views[0] = head[sent:]
+                    sent = 0
+
+    def shutdown(self):
         try:
-            # отримання даних від клієнта
-            chunk = client_socket.recv(8192)
-            if not chunk:
-                break  # клієнт відключився
-            buffer += chunk.decode(errors="ignore")
+            self.sock.shutdown(socket.SHUT_RDWR)  # будить потік читання
+        except OSError:
+            pass
+        self.sock.close()
+
+    # підвантаження історії чекає, поки письменник розгребе чергу, а не витісняє живі кадри
+    def wait_room(self, limit):
+        with self.lock:
+            while len(self.queue) >= limit and not self.closed:
+                self.lock.wait()
+            return not self.closed
+
+
+# --- З'єднання asyncio-рушія ---
+class AsyncConnection(Connection):
+    __slots__ = ("writer", "ready", "drained", "task")
+
+    def __init__(self, writer):
+        super().__init__(writer.get_extra_info("peername"))
+        self.writer = writer
+        self.ready = asyncio.Event()
+        self.drained = asyncio.Event()  # письменник віддав чергу в сокет
+        self.task = asyncio.ensure_future(self.writer_loop())
+
+    def wake_writer(self):
+        self.ready.set()
+
+    async def writer_loop(self):
+        try:
+            while not self.closed:
+                await self.ready.wait()
+                self.ready.clear()
+                batch = [data for _, data in self.queue]
+                self.queue.clear()
+                with tracing.root("write", "net", frames=len(batch)):
+                    self.writer.writelines(batch)  # транспорт сам збирає буфери без копій у Python
+                    await self.writer.drain()  # чекаємо, поки TCP-вікно звільниться
+                self.drained.set()
+        except Exception as e:
+            if not self.closed:  # сокет закрили ми самі — це не помилка відправки
+                SEND_ERRORS.inc(type(e).__name__)
+            self.close()
+
+    def shutdown(self):
+        self.writer.transport.abort()  # reader.read() у корутині клієнта завершиться
+        self.drained.set()
+
+    async def wait_room(self, limit):
+        while len(self.queue) >= limit and not self.closed:
+            self.drained.clear()
+            await self.drained.wait()
+        return not self.closed
 
-            # розділяємо повідомлення по символу "\n"
-            while "\n" in buffer:
-                line, buffer = buffer.split("\n", 1)
-                handle_line(client_socket, line.strip())  # обробляємо рядок
-        except:
-            break
+
+# --- Періодичний звіт про черги тих клієнтів, що відстають ---
+def queue_report_loop(interval):
+    while True:
+        time.sleep(interval)
+        for client in sessions.clients:
+            if client.queue_depth or client.dropped:
+                name = client.name or client.addr
+                print(f"Черга {name}: {client.queue_depth} кадрів, викинуто {client.dropped}")
+
+
+# --- Відправка кадру одному клієнту ---
+def send_to_client(client, frame: Frame):
+    count_out(frame.msg_type, 1, queue_frame(client, frame))
+
+
+# лише ставимо в чергу — не блокує; стиснення рахується раз на кадр, а не на отримувача
+def queue_frame(client, frame: Frame):
+    data = frame.encode_for(client.proto, client.stamped, client.deflate)
+    client.send(data, frame.kind)
+    return len(data)
+
+
+# --- Розсилка кадру учасникам кімнати: кожна версія протоколу кодується один раз ---
+def broadcast(frame: Frame, exclude_socket=None, room=protocol.DEFAULT_ROOM):
+    if shard is not None:
+        # seq присвоїть концентратор; кадр повернеться до нас разом з іншими воркерами (apply_bus)
+        shard.send(("frame", room, connection_id(exclude_socket), frame))
+        return
+    fanout(get_room(room), frame, exclude_socket)
+    relay_publish(("frame", room, frame.msg_type, frame.fields))  # сусідні вузли нумерують кадр у своїх журналах
+
+
+# кадр без seq нумеруємо тут; з seq — уже пронумерований концентратором
+def fanout(room, frame: Frame, exclude_socket=None):
+    started = time.perf_counter()
+    with tracing.span("broadcast", "fanout", room=room.name, type=frame.msg_type), broadcast_lock:
+        if frame.seq is None:
+            room.stamp(frame)
+        else:
+            room.advance(frame.seq)
+        send_to_room(room, frame, exclude_socket)
+    FANOUT_SECONDS.observe(time.perf_counter() - started)
+
+
+# без seq і журналу — для службових кадрів на кшталт присутності
+def send_to_room(room, frame: Frame, exclude_socket=None):
+    frames = size = 0
+    for client in room.members:  # знімок: вхід і вихід під час розсилки його не змінюють
+        if client != exclude_socket:  # не відправляти назад відправнику
+            with tracing.span("send", "fanout"):
+                size += queue_frame(client, frame)
+            frames += 1
+    count_out(frame.msg_type, frames, size)  # метрики — раз на розсилку, а не на отримувача
+
+
+# --- Обробка клієнта в окремому потоці ---
+def handle_client(client):
+    # клієнт нової версії першим надсилає HELLO; старий може мовчати — тоді приєднуємо за тайм-аутом.
+    # Чекати можуть усі одразу, а обробляти рукостискання — не більше MAX_HANDSHAKES потоків:
+    # під час масового перепідключення тисячі потоків не товчуться за GIL, і ті, хто вже
+    # почав, швидко доходять до кінця.
+    # Чекаємо тайм-аутом сокета, а не select(): той не приймає дескриптори ≥ 1024
+    client.sock.settimeout(protocol.HELLO_TIMEOUT)
+    try:
+        count = client.reader.recv_from(client.sock)
+    except socket.timeout:
+        count = None
+    except Exception as e:
+        receive_failed(client, e)
+        count = 0
+    client.sock.settimeout(None)
+    with admission:
+        if count is None:
+            join_client(client)
+            alive = True
+        else:
+            alive = handle_chunk(client, count)
+    while alive:
+        alive = receive_chunk(client)
 
     # якщо клієнт відключився
-    if client_socket in clients:
-        clients.remove(client_socket)
-    if client_socket in usernames:
-        left_user = usernames[client_socket]
-        del usernames[client_socket]
-        # повідомляємо іншим, що користувач вийшов
-        broadcast(f"TEXT@SYSTEM@{left_user} вийшов з чату\n")
-    client_socket.close()
+    disconnect_client(client)
 
 
-# --- Обробка конкретного рядка повідомлення ---
-def handle_line(client_socket, line: str):
-    if not line:
+# False — клієнт відключився або з'єднання обірвалось
+def receive_chunk(client) -> bool:
+    try:
+        # отримання даних від клієнта просто в буфер розбору
+        count = client.reader.recv_from(client.sock)
+    except Exception as e:
+        receive_failed(client, e)
+        return False
+    return handle_chunk(client, count)
+
+
+# розбір і обробка count щойно прочитаних байтів
+def handle_chunk(client, count) -> bool:
+    try:
+        if not count:
+            return False
+        # спан охоплює розбір і обробку всіх кадрів з цієї порції байтів
+        with tracing.root("recv", "net", bytes=count):
+            for msg_type, fields in client.reader.frames():
+                delay = flood_check(client, msg_type, fields)
+                if delay is None:
+                    continue
+                if delay:
+                    time.sleep(delay)  # не читаємо сокет — TCP пригальмує відправника
+                handle_message(client, msg_type, fields)
+        return True
+    except Exception as e:
+        receive_failed(client, e)
+        return False
+
+
+# --- Захист від флуду: скільки чекати перед обробкою кадру; None — кадр відкинуто ---
+def flood_check(client, msg_type, fields):
+    if client.flood is None or msg_type in FLOOD_EXEMPT:
+        return 0.0
+    avatar = msg_type == "AVATAR" or (msg_type == "BLOBSTART" and len(fields) >= 2 and fields[1] == "avatar")
+    size = 0 if msg_type in FLOOD_UNMETERED_BYTES else client.reader.size
+    action, delay = client.flood.admit(size, avatar)
+    if action == ratelimit.OK:
+        return 0.0
+    FLOOD_ACTIONS.inc(action)
+    if action == ratelimit.DELAY:
+        return delay
+    if action == ratelimit.DISCONNECT:
+        print(f"Клієнт {client.addr} перевищує ліміти — відключаємо")
+        client.close()
+        return None
+    if msg_type == "BLOBSTART" and fields:
+        send_to_client(client, Frame("BLOBFAIL", (fields[0], "забагато завантажень, спробуйте пізніше")))
+    elif client.flood.dropped_run == 1:  # попереджаємо раз на серію, а не на кожен кадр
+        send_to_client(client, Frame("TEXT", ("SYSTEM", "Забагато повідомлень — частину не доставлено, пишіть повільніше")))
+    return None
+
+
+# обрив через помилку рахуємо; несподівані (не мережа і не протокол) ще й друкуємо
+def receive_failed(client, error):
+    RECV_ERRORS.inc(type(error).__name__)
+    if not isinstance(error, (OSError, protocol.ProtocolError)):
+        print(f"Помилка обробки клієнта {client.addr}: {error!r}")
+
+
+# --- Прибирання після відключення клієнта (спільне для обох рушіїв) ---
+def disconnect_client(client):
+    left_user = sessions.remove(client)
+    room = rooms.get(client.room)
+    if room is not None:
+        with broadcast_lock:
+            room.discard(client)
+    if left_user is not None:
+        if client.stamped:
+            # клієнт може повернутись через RESUME — не оголошуємо вихід одразу
+            pending_leaves[left_user] = call_later_in_engine(RESUME_GRACE, announce_leave, left_user, client.room)
+        else:
+            announce_leave(left_user, client.room)
+        send_presence(room)
+    for upload in client.uploads.values():  # недокачане не лишаємо на диску
+        upload.discard()
+    client.uploads.clear()
+    client.close()
+
+
+# повідомляємо іншим, що користувач вийшов (якщо він тим часом не повернувся)
+def announce_leave(user, room):
+    pending_leaves.pop(user, None)
+    if not user_online(user):
+        broadcast(Frame("TEXT", ("SYSTEM", f"{user} вийшов з чату")), room=room)
+
+
+# --- Приєднання до чату: з цього моменту клієнт отримує розсилки загальної кімнати ---
+def join_client(client):
+    if client.joined:
         return
+    client.joined = True
+    sessions.add(client)
+    enter_room(client, protocol.DEFAULT_ROOM)
+
 
-    parts = line.split("@", 3)  # розбиваємо рядок по символу "@"
-    msg_type = parts[0]
+# --- Перехід між кімнатами ---
+# Клієнт переходить з кімнати в кімнату під broadcast_lock: жоден кадр розсилки
+# не загубиться і не прийде з обох кімнат. Підтвердження JOIN іде в тій самій черзі,
+# тож усе, що клієнт отримає після нього, — вже з нової кімнати.
+def enter_room(client, name):
+    room = get_room(name)
+    with broadcast_lock:
+        moving = client.room is not None  # при вході в чат загальна кімната мається на увазі — без JOIN
+        if moving:
+            rooms[client.room].discard(client)
+        client.room = name
+        room.add(client)
+        if moving and protocol.FEATURE_ROOMS in client.features:
+            send_to_client(client, Frame("JOIN", (name,)))
+    send_room_snapshot(client, room)
+    return room
+
+
+def switch_room(client, name):
+    if not ROOM_NAME.fullmatch(name) or (name not in rooms and len(rooms) >= MAX_ROOMS):
+        send_to_client(client, Frame("TEXT", ("SYSTEM", f"Кімната {name} недоступна")))
+        return
+    old = rooms[client.room]
+    if name == old.name:
+        send_to_client(client, Frame("JOIN", (name,)))  # клієнт після перепідключення підтверджує кімнату
+        return
+    room = enter_room(client, name)
+    user = client.name
+    if user is not None:
+        broadcast(Frame("TEXT", ("SYSTEM", f"{user} перейшов до кімнати {name}")), room=old.name)
+        broadcast(Frame("TEXT", ("SYSTEM", f"{user} приєднався до кімнати")), exclude_socket=client, room=name)
+        if user in avatars:
+            share_avatar(user, None, None, client, name)
+    send_presence(old)
+    send_presence(room)
+
+
+# --- Присутність: хто зараз у кімнаті (лише клієнтам з FEATURE_ROOMS) ---
+# Склад кімнати на цьому процесі змінився: інші воркери дізнаються через концентратор.
+def send_presence(room):
+    if room is None:
+        return
+    if shard is not None:
+        shard.send(("presence", room.name, local_names(room)))
+    relay_publish(("presence", room.name, local_names(room)))
+    send_members(room)
+
+
+def send_members(room):
+    if room is None:
+        return
+    members = [client for client in room.members if protocol.FEATURE_ROOMS in client.features]
+    if not members:
+        return
+    frame = Frame("MEMBERS", (room.name, ", ".join(room_names(room))))
+    for client in members:
+        send_to_client(client, frame)
+
+
+def local_names(room):
+    return sorted({client.name for client in room.members if client.name is not None})
+
+
+# ніки кімнати разом з тими, хто сидить на інших воркерах
+def room_names(room):
+    names = set(local_names(room))
+    for presence in list(remote_presence.values()):
+        names.update(presence.get(room.name, ()))
+    return sorted(names)
+
+
+def user_online(user):
+    if sessions.online(user):
+        return True
+    return any(user in names for presence in list(remote_presence.values()) for names in presence.values())
+
+
+# --- Узгодження версії протоколу ---
+def handle_hello(client, fields):
+    requested, offered = protocol.parse_hello(fields)
+    proto = min(requested, protocol.PROTO_BINARY)
+    client.features = offered & SERVER_FEATURES
+    if proto != protocol.PROTO_BINARY:
+        client.features -= V2_FEATURES  # seq і стиснення передаються лише в кадрах v2
+    client.stamped = protocol.FEATURE_RESUME in client.features
+    client.deflate = protocol.FEATURE_DEFLATE in client.features
+    # відповідь завжди текстом — її зрозуміє будь-який клієнт
+    client.send(protocol.hello_line(proto, client.features))
+    client.proto = client.reader.proto = proto
+    join_client(client)
+
+
+# --- Обробка розібраного кадру (однаково для v1 і v2) ---
+def handle_message(client, msg_type, parts):
+    label = type_label(msg_type)
+    FRAMES_IN.inc(label)
+    BYTES_IN.inc(label, amount=client.reader.size)
+    with tracing.span(label, "handle"):
+        dispatch_message(client, msg_type, parts)
+
+
+def dispatch_message(client, msg_type, parts):
+    if not client.joined:
+        if msg_type == "HELLO":
+            handle_hello(client, parts)
+            return
+        join_client(client)  # старий клієнт — одразу пише повідомлення
 
     # --- Текстове повідомлення ---
-    if msg_type == "TEXT" and len(parts) >= 3:
-        author = parts[1]
-        message = parts[2]
-        usernames[client_socket] = author  # запам'ятовуємо нік користувача
-        # розсилаємо іншим клієнтам
-        broadcast(f"TEXT@{author}@{message}\n", exclude_socket=client_socket)
+    if msg_type == "TEXT" and len(parts) >= 2:
+        author = parts[0]
+        message = parts[1]
+        set_username(client, author)  # запам'ятовуємо нік користувача (привітання від SYSTEM ніка не дає)
+        # розсилаємо іншим клієнтам кімнати
+        broadcast(Frame("TEXT", (author, message)), exclude_socket=client, room=client.room)
 
     # --- Аватар ---
-    elif msg_type == "AVATAR" and len(parts) >= 4:
-        author = parts[1]
-        filename = parts[2]
-        encoded = parts[3]
-        usernames[client_socket] = author
-        avatars[author] = (filename, encoded)  # зберігаємо аватар
-        # повідомляємо інших
-        broadcast(f"AVATAR@{author}@{filename}@{encoded}\n", exclude_socket=client_socket)
+    elif msg_type == "AVATAR" and len(parts) >= 3 and parts[0] != SYSTEM_NAME:
+        author = parts[0]
+        filename = parts[1]
+        data = parts[2]  # сирі байти: у v2 — як є, з v1 base64 вже розкодовано
+        set_username(client, author)
+        # перевіряємо і зменшуємо картинку у пулі процесів, зберігаємо — коли буде готово
+        submit_avatar(client, author, filename, data)
 
     # --- Зміна ніка ---
-    elif msg_type == "RENAME" and len(parts) >= 3:
-        old = parts[1]
-        new = parts[2]
-        usernames[client_socket] = new  # оновлюємо нік
-        if old in avatars:
-            avatars[new] = avatars.pop(old)  # переносимо аватар на новий нік
+    elif msg_type == "RENAME" and len(parts) >= 2 and parts[1] != SYSTEM_NAME:
+        old = parts[0]
+        new = parts[1]
+        set_username(client, new)  # оновлюємо нік
+        if shard is not None:
+            shard.send(("rename", old, new))  # аватар переносять усі воркери, в порядку концентратора
+        else:
+            move_avatar(old, new)
+            relay_publish(("rename", old, new))
         # повідомляємо інших
-        broadcast(f"RENAME@{old}@{new}\n", exclude_socket=client_socket)
+        broadcast(Frame("RENAME", (old, new)), exclude_socket=client, room=client.room)
+
+    # --- Запит байтів аватара за хешем ---
+    elif msg_type == "AVATARGET" and parts:
+        frame = avatar_store.frame(parts[0])
+        if frame is not None:
+            send_to_client(client, frame)
+
+    # --- Перехід у кімнату: JOIN@room ---
+    elif msg_type == "JOIN" and parts:
+        switch_room(client, parts[0])
+
+    # --- Запит історії: HISTORY@last@N або HISTORY@since@seq ---
+    elif msg_type == "HISTORY" and len(parts) >= 2:
+        send_history(client, parts[0], parts[1])
+
+    # --- Відновлення сесії після обриву: RESUME@token@seq ---
+    elif msg_type == "RESUME" and len(parts) >= 2:
+        resume_session(client, parts[0], parts[1])
+
+    # --- Потокове завантаження: BLOBSTART@id@kind@size@user@name, BLOBCHUNK@id@bytes, BLOBEND@id@sha256 ---
+    elif msg_type == "BLOBSTART" and len(parts) >= 5:
+        start_upload(client, *parts[:5])
+    elif msg_type == "BLOBCHUNK" and len(parts) >= 2:
+        upload_chunk(client, parts[0], parts[1])
+    elif msg_type == "BLOBEND" and len(parts) >= 2:
+        finish_upload(client, parts[0], parts[1])
+
+    # --- Запит файлу за хешем ---
+    elif msg_type == "FILEGET" and parts:
+        send_file(client, parts[0])
+
+    # --- Повторне HELLO після приєднання ігноруємо ---
+    elif msg_type == "HELLO":
+        return
 
     # --- Інші випадки ---
+    # типи протоколу сервер обробив вище; решту (службові кадри сервера, неповні кадри)
+    # не пересилаємо — інакше клієнт міг би підробити SESSION, RESUME чи AVATARREF для всієї кімнати.
+    # Назву типу від старого клієнта теж перевіряємо: клієнти v2 відкидають кадр з недопустимою
+    elif msg_type not in protocol.FIELD_COUNTS and protocol.valid_type(msg_type):
+        broadcast(Frame(msg_type, parts), exclude_socket=client, room=client.room)
+
+
+# --- Нік клієнта; клієнтам з FEATURE_RESUME видаємо під нього токен сесії ---
+def set_username(client, name):
+    if name == SYSTEM_NAME:
+        return
+    with tracing.span("usernames", "state"):
+        if not sessions.rename(client, name):
+            return
+    if client.stamped:
+        send_to_client(client, Frame("SESSION", (session_token(name),)))
+    send_presence(rooms.get(client.room))
+
+
+# токен — нік, підписаний ключем сервера: перевіряється без таблиці сесій
+def session_token(user):
+    name = base64.urlsafe_b64encode(user.encode()).decode().rstrip("=")
+    mac = hmac.new(session_key, user.encode(), hashlib.sha256).hexdigest()[:32]
+    return f"{name}.{mac}"
+
+
+def session_user(token):
+    name, _, mac = token.partition(".")
+    try:
+        user = base64.urlsafe_b64decode(name + "=" * (-len(name) % 4)).decode()
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if hmac.compare_digest(session_token(user).partition(".")[2], mac):
+        return user
+    return None
+
+
+def load_session_key(directory):
+    global session_key
+    path = os.path.join(directory, "session.key")
+    try:
+        with open(path, "rb") as f:
+            session_key = f.read()
+    except FileNotFoundError:
+        with open(path, "wb") as f:
+            f.write(session_key)
+
+
+# --- Відновлення сесії: нік повертається, пропущене досилається з журналу ---
+# Догнати можна, якщо клієнт нічого не пропустив або пропущене ще є в журналі;
+# інакше (журналу немає, сегменти прибрано, сервер перезапущено без журналу) — fail,
+# і клієнт входить наново.
+def resume_session(client, token, seq):
+    user = session_user(token)
+    try:
+        seq = int(seq)
+    except ValueError:
+        send_to_client(client, Frame("RESUME", ("fail", "")))
+        return
+    room = rooms[client.room]  # кімнату клієнт повідомив через JOIN ще до RESUME
+    current = room.last_seq
+    can_replay = seq == current or (
+        room.log is not None and room.log.first_seq - 1 <= seq < current
+    )
+    if user is None or not client.stamped or not can_replay:
+        send_to_client(client, Frame("RESUME", ("fail", "")))
+        return
+    sessions.rename(client, user)
+    leave = pending_leaves.pop(user, None)
+    if leave is not None:
+        leave.cancel()
+    send_presence(room)
+    send_to_client(client, Frame("RESUME", ("ok", str(current))))
+    if seq < current:
+        send_history(client, "since", seq, skip_author=user)
+
+
+# --- Виклик у потоці рушія (для колбеків з пулу процесів) ---
+def call_in_engine(callback, *args):
+    if engine_loop is not None:
+        engine_loop.call_soon_threadsafe(callback, *args)
     else:
-        broadcast(line + "\n", exclude_socket=client_socket)
+        callback(*args)
 
 
-# --- Відправлення новому клієнту вже існуючих аватарів ---
-def send_existing_data(client_socket):
-    for user, (filename, encoded) in avatars.items():
-        send_to_client(client_socket, f"AVATAR@{user}@{filename}@{encoded}\n")
+# --- Відкладений виклик у рушії; результат має cancel() ---
+def call_later_in_engine(delay, callback, *args):
+    if engine_loop is not None:
+        return engine_loop.call_later(delay, callback, *args)
+    timer = threading.Timer(delay, callback, args)
+    timer.daemon = True
+    timer.start()
+    return timer
 
 
-# --- Запуск сервера ---
-def main():
+# --- Нормалізація аватара у пулі процесів ---
+def submit_avatar(client, author, filename, data: bytes):
+    if thumbnail_pool is None:
+        avatar_ready(client, author, filename, data)  # Pillow немає — зберігаємо як є
+        return
+    if len(data) > thumbnails.MAX_AVATAR_BYTES:
+        avatar_ready(client, author, filename, None)
+        return
+    future = thumbnail_pool.submit(thumbnails.normalize_avatar, data)
+    future.add_done_callback(
+        lambda done: call_in_engine(avatar_ready, client, author, filename, thumbnail_result(done))
+    )
+
+
+# аватар, що прийшов шматками: процес пулу читає тимчасовий файл сам
+def submit_avatar_file(client, author, filename, path):
+    if thumbnail_pool is None:
+        with open(path, "rb") as f:
+            data = f.read()
+        os.remove(path)
+        avatar_ready(client, author, filename, data)
+        return
+
+    def done(future):
+        os.remove(path)
+        call_in_engine(avatar_ready, client, author, filename, thumbnail_result(future))
+
+    thumbnail_pool.submit(thumbnails.normalize_avatar_file, path).add_done_callback(done)
+
+
+def thumbnail_result(future):
+    try:
+        return future.result()
+    except Exception:
+        AVATAR_ERRORS.inc()
+        return None  # процес пулу впав — вважаємо картинку непридатною
+
+
+# --- Аватар оброблено: зберігаємо і розсилаємо ---
+def avatar_ready(client, author, filename, data):
+    if data is None:
+        send_to_client(client, Frame("TEXT", ("SYSTEM", f"Аватар {filename} відхилено: файл пошкоджений або завеликий")))
+        return
+    author = client.name or author  # поки картинка оброблялась, нік могли змінити
+    share_avatar(author, filename, data, client, client.room)
+
+
+# --- Аватар для кімнати: зберігаємо і показуємо; data=None — показати вже відомий ---
+def share_avatar(user, filename, data, exclude_socket, room):
+    if shard is not None:
+        shard.send(("avatar", room, connection_id(exclude_socket), user, filename, data))
+        return
+    if data is not None:
+        set_avatar(user, filename, data)  # зберігаємо аватар
+    # повідомляємо інших у кімнаті: новим клієнтам — лише хеш, старим — повний кадр
+    broadcast_avatar(user, exclude_socket=exclude_socket, room=room)
+    relay_publish(("avatar", room, user, filename, data))
+
+
+# --- Пул процесів для Pillow ---
+def start_thumbnail_pool(workers):
+    global thumbnail_pool
+    if workers <= 0:
+        return
+    if not thumbnails.available():
+        print("Pillow не встановлено — аватари зберігатимуться без обробки")
+        return
+    # spawn: не копіюємо у дочірні процеси потоки й блокування сервера
+    thumbnail_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+# --- Збереження аватара користувача в сховищі за хешем ---
+def set_avatar(user, filename, data: bytes):
+    with tracing.span("avatars", "state"):
+        store_avatar(user, filename, data)
+
+
+def store_avatar(user, filename, data: bytes):
+    with avatars_lock:
+        digest = avatar_store.put(data)
+        previous = avatars.get(user)
+        avatars[user] = (filename, digest)
+        avatar_frames.pop(user, None)
+        if previous is not None:
+            avatar_store.release(previous[1])
+
+
+# --- Зміна ніка: аватар переходить до нового ніка ---
+def move_avatar(old, new):
+    if old == new or old not in avatars:
+        return  # RENAME на той самий нік нічого не переносить (інакше звільнили б свій же аватар)
+    with tracing.span("avatars", "state"), avatars_lock:
+        if old not in avatars:
+            return  # інший потік уже переніс
+        if new in avatars:
+            avatar_store.release(avatars[new][1])
+        avatars[new] = avatars.pop(old)  # переносимо аватар на новий нік
+        avatar_frames.pop(old, None)      # кадр містить старий нік — перекодуємо за потреби
+        avatar_frames.pop(new, None)
+
+
+# --- Розсилка нового аватара: хеш для нових клієнтів, повний кадр для старих ---
+def broadcast_avatar(user, exclude_socket=None, room=protocol.DEFAULT_ROOM):
+    filename, digest = avatars[user]
+    ref_frame = Frame("AVATARREF", (user, filename, digest))
+    for client in get_room(room).members:
+        if client != exclude_socket:
+            if protocol.FEATURE_AVATAR_REF in client.features:
+                send_to_client(client, ref_frame)
+            else:
+                send_to_client(client, avatar_frame(user, filename, digest))
+
+
+# --- Знімок кімнати для того, хто щойно увійшов: аватари учасників і список кімнат ---
+def send_room_snapshot(client, room):
+    with tracing.span("room_snapshot", "join", room=room.name):
+        queue_room_snapshot(client, room)
+
+
+def queue_room_snapshot(client, room):
+    refs = protocol.FEATURE_AVATAR_REF in client.features
+    present = set(room_names(room))
+    for user, (filename, digest) in list(avatars.items()):
+        if user not in present:
+            continue
+        if refs:
+            send_to_client(client, Frame("AVATARREF", (user, filename, digest)))
+        else:
+            send_to_client(client, avatar_frame(user, filename, digest))
+    if protocol.FEATURE_ROOMS in client.features:
+        send_to_client(client, Frame("ROOMS", (",".join(sorted(rooms)),)))
+
+
+# --- Повний кадр AVATAR для старих клієнтів (будуємо лише раз після зміни) ---
+def avatar_frame(user, filename, digest):
+    cached = avatar_frames.get(user)
+    if cached is not None and cached[0] == digest:
+        return cached[1]
+    frame = Frame("AVATAR", (user, filename, avatar_store.data(digest)))
+    avatar_frames[user] = (digest, frame)
+    return frame
+
+
+# --- Підвантаження історії з журналу ---
+# Записи читаються пачками просто з файлів і ставляться в чергу клієнта лише тоді,
+# коли в ній є місце, тож навіть мільйони кадрів ідуть з темпом читання клієнта.
+# skip_author — кадри цього ніка не досилаємо: наживо вони автору не розсилались (exclude_socket),
+# тож його last_seq їх не покриває, а власні повідомлення клієнт уже показав сам
+def send_history(client, mode, value, skip_author=None):
+    log = rooms[client.room].log
+    if log is None:
+        return
+    try:
+        value = int(value)
+    except ValueError:
+        return
+    batch = max(1, min(256, SEND_QUEUE_SIZE // 4))
+    if mode == "last":
+        records = log.read_last(max(0, value), batch)
+    elif mode == "since":
+        records = log.read_since(value, batch)
+    else:
+        return
+    last = [0]
+
+    def batches():
+        for records_batch in records:
+            last[0] = records_batch[-1][0]
+            yield [
+                history_payload(client, seq, payload) for seq, payload in records_batch
+                if skip_author is None or record_author(payload) != skip_author
+            ]
+
+    stream_to_client(
+        client, batches(), SEND_QUEUE_SIZE // 2, lambda: Frame("HISTORY", ("end", str(last[0]))), "HISTORY"
+    )
+
+
+# --- Потокова відправка клієнту ---
+# batches — ітератор списків уже закодованих кадрів; наступна пачка читається
+# лише тоді, коли в черзі клієнта менше limit кадрів. Наприкінці йде кадр finish().
+# msg_type — під яким типом рахувати ці кадри в метриках.
+def stream_to_client(client, batches, limit, finish, msg_type):
+    if engine_loop is not None:
+        asyncio.ensure_future(stream_async(client, batches, limit, finish, msg_type))
+    else:
+        threading.Thread(target=stream_thread, args=(client, batches, limit, finish, msg_type), daemon=True).start()
+
+
+def stream_thread(client, batches, limit, finish, msg_type):
+    for batch in batches:
+        if not client.wait_room(limit):
+            return
+        send_batch(client, batch, msg_type)
+    send_to_client(client, finish())
+
+
+async def stream_async(client, batches, limit, finish, msg_type):
+    while True:
+        # читання з диска — у потоці, щоб не зупиняти цикл подій
+        batch = await asyncio.to_thread(next, batches, None)
+        if batch is None:
+            break
+        if not await client.wait_room(limit):
+            return
+        send_batch(client, batch, msg_type)
+    send_to_client(client, finish())
+
+
+def send_batch(client, batch, msg_type):
+    for data in batch:
+        client.send(data)
+    count_out(msg_type, len(batch), sum(len(data) for data in batch))
+
+
+# нік відправника кадру з журналу (None — кадр не від користувача)
+def record_author(payload):
+    msg_type, fields, _ = protocol.decode_binary(memoryview(payload)[protocol.LENGTH.size:])
+    index = AUTHOR_FIELDS.get(msg_type)
+    if index is None or index >= len(fields):
+        return None
+    return fields[index]
+
+
+# у журналі кадри v2; клієнтам з FEATURE_RESUME додаємо seq, старим — перекодовуємо в рядок
+def history_payload(client, seq, payload):
+    if client.deflate:
+        payload = protocol.compress_binary(payload)
+    if client.stamped:
+        return protocol.stamp_binary(payload, seq)
+    if client.proto == protocol.PROTO_BINARY:
+        return payload
+    msg_type, fields, _ = protocol.decode_binary(memoryview(payload)[protocol.LENGTH.size:])
+    return protocol.encode_line(msg_type, fields)
+
+
+# --- Прийом потокового завантаження ---
+# Кожен шматок одразу пишеться у тимчасовий файл і підтверджується (BLOBACK) —
+# клієнт шле наступні, лише отримавши кредит, тож у пам'яті сервера немає цілого файлу.
+def start_upload(client, upload_id, kind, size, author, name):
+    try:
+        size = int(size)
+    except ValueError:
+        size = -1
+    if kind == "avatar":
+        limit = thumbnails.MAX_AVATAR_BYTES
+    elif kind == "file" and file_store is not None:
+        limit = MAX_FILE_BYTES
+    else:
+        limit = -1
+    if not 0 <= size <= limit:
+        send_to_client(client, Frame("BLOBFAIL", (upload_id, "файл завеликий або не підтримується")))
+        return
+    if author == SYSTEM_NAME:
+        send_to_client(client, Frame("BLOBFAIL", (upload_id, f"нік {SYSTEM_NAME} зарезервовано")))
+        return
+    if upload_id in client.uploads or len(client.uploads) >= transfers.MAX_UPLOADS:
+        send_to_client(client, Frame("BLOBFAIL", (upload_id, "забагато одночасних завантажень")))
+        return
+    set_username(client, author)
+    spool = file_store.spool if file_store is not None else None
+    client.uploads[upload_id] = transfers.Upload(kind, name, size, spool)
+    send_to_client(client, Frame("BLOBACK", (upload_id, "0")))
+
+
+def upload_chunk(client, upload_id, data):
+    upload = client.uploads.get(upload_id)
+    if upload is None:
+        return  # завантаження вже відхилене — решту шматків просто ігноруємо
+    if not upload.write(data):
+        client.uploads.pop(upload_id).discard()
+        send_to_client(client, Frame("BLOBFAIL", (upload_id, "більше даних, ніж заявлено")))
+        return
+    send_to_client(client, Frame("BLOBACK", (upload_id, str(upload.received))))
+
+
+def finish_upload(client, upload_id, digest):
+    upload = client.uploads.pop(upload_id, None)
+    if upload is None:
+        return
+    if not upload.finish(digest):
+        upload.discard()
+        send_to_client(client, Frame("BLOBFAIL", (upload_id, "файл пошкоджено під час передачі")))
+        return
+    send_to_client(client, Frame("BLOBEND", (upload_id, "ok")))
+    author = client.name or "?"
+    if upload.kind == "avatar":
+        submit_avatar_file(client, author, upload.name, upload.path)
+    else:
+        file_store.put(upload.path, digest)
+        broadcast(Frame("FILE", (author, digest, str(upload.size), upload.name)), exclude_socket=client, room=client.room)
+
+
+# --- Видача файлу шматками з темпом читання клієнта ---
+def send_file(client, digest):
+    f = file_store.open(digest) if file_store is not None else None
+    if f is None:
+        send_to_client(client, Frame("FILEEND", (digest, "missing")))
+        return
+    batches = (
+        [Frame("FILEDATA", (digest, str(offset), data)).encode_for(client.proto, False, client.deflate)]
+        for offset, data in transfers.read_chunks(f)
+    )
+    # черга тримає лише кілька шматків: 64 КБ на кадр — не ті кадри, щоб класти їх сотнями
+    stream_to_client(client, batches, transfers.UPLOAD_WINDOW, lambda: Frame("FILEEND", (digest, "ok")), "FILEDATA")
+
+
+# --- Обробка клієнта як корутини (без окремого потоку) ---
+async def handle_client_async(reader, writer):
+    with tracing.root("accept", "net"):
+        client = AsyncConnection(writer)
+    CONNECTIONS.inc()
+    print(f"Підключився клієнт: {client.addr}")
+    task = asyncio.current_task()
+    client_tasks.add(task)
+
+    first_read = True
+    while True:
+        try:
+            if first_read:
+                first_read = False
+                try:
+                    chunk = await asyncio.wait_for(reader.read(8192), protocol.HELLO_TIMEOUT)
+                except asyncio.TimeoutError:
+                    join_client(client)  # старий клієнт мовчить — приєднуємо без HELLO
+                    continue
+            else:
+                chunk = await reader.read(8192)
+            if not chunk:
+                break  # клієнт відключився
+            with tracing.root("recv", "net", bytes=len(chunk)):
+                for msg_type, fields in client.reader.feed(chunk):
+                    delay = flood_check(client, msg_type, fields)
+                    if delay is None:
+                        continue
+                    if delay:
+                        await asyncio.sleep(delay)  # не читаємо сокет — TCP пригальмує відправника
+                    handle_message(client, msg_type, fields)
+        except asyncio.CancelledError:
+            # сервер зупиняється: лише закриваємо з'єднання, без оголошень про вихід у журнал —
+            # клієнти повернуться через RESUME
+            client.close()
+            client_tasks.discard(task)
+            return
+        except Exception as e:
+            receive_failed(client, e)
+            break
+
+    disconnect_client(client)
+    client_tasks.discard(task)
+
+
+# --- Шина між процесами (режим --processes) ---
+# Воркер шле концентратору розсилки, аватари, зміни ніків і свою присутність;
+# концентратор нумерує, пише журнал і повертає кожну подію всім воркерам.
+# Клієнта, якому кадр не треба (автор), воркер знаходить за номером з'єднання.
+def connection_id(client):
+    return client.id if client is not None else None
+
+
+def local_member(room, origin, client_id):
+    if origin != shard.index or client_id is None:
+        return None
+    for client in room.members:
+        if client.id == client_id:
+            return client
+    return None
+
+
+# подія від концентратора (у потоці рушія)
+def apply_bus(message):
+    kind = message[0]
+    if kind == "frame":
+        _, name, origin, client_id, frame = message
+        room = get_room(name)
+        fanout(room, frame, local_member(room, origin, client_id))
+    elif kind == "avatar":
+        _, name, origin, client_id, user, filename, data = message
+        if data is not None:
+            set_avatar(user, filename, data)
+        if user in avatars:
+            room = get_room(name)
+            broadcast_avatar(user, exclude_socket=local_member(room, origin, client_id), room=name)
+    elif kind == "rename":
+        move_avatar(message[1], message[2])
+    elif kind == "presence":
+        _, origin, name, names = message
+        if origin != shard.index:
+            remote_presence.setdefault(origin, {})[name] = set(names)
+            send_members(rooms.get(name))
+
+
+# стан чату на момент підключення воркера до концентратора
+def apply_state(state):
+    _, last_seqs, avatar_state, presence = state
+    for name, seq in last_seqs.items():
+        get_room(name).advance(seq)
+    for user, (filename, data) in avatar_state.items():
+        set_avatar(user, filename, data)
+    for index, names_by_room in presence.items():
+        if index != shard.index:
+            remote_presence[index] = {name: set(names) for name, names in names_by_room.items()}
+
+
+def start_shard():
+    if shard is not None:
+        shard.start(lambda batch: call_in_engine(apply_batch, batch))
+
+
+def apply_batch(batch):
+    for message in batch:
+        apply_bus(message)
+
+
+# --- Концентратор: єдиний порядок подій для всіх воркерів ---
+def hub_message(origin, message):
+    kind = message[0]
+    if kind == "frame":
+        _, name, client_id, frame = message
+        get_room(name).stamp(frame)
+        return ("frame", name, origin, client_id, frame)
+    if kind == "avatar":
+        _, name, client_id, user, filename, data = message
+        if data is not None:
+            set_avatar(user, filename, data)
+        return ("avatar", name, origin, client_id, user, filename, data)
+    if kind == "rename":
+        move_avatar(message[1], message[2])
+        return message
+    if kind == "presence":
+        _, name, names = message
+        remote_presence.setdefault(origin, {})[name] = names
+        return ("presence", origin, name, names)
+    return None
+
+
+def hub_snapshot():
+    last_seqs = {name: room.last_seq for name, room in rooms.items()}
+    avatar_state = {user: (filename, avatar_store.data(digest)) for user, (filename, digest) in avatars.items()}
+    return ("state", last_seqs, avatar_state, {index: dict(names) for index, names in remote_presence.items()})
+
+
+# воркер упав — його клієнти для інших більше не в чаті
+def hub_lost(index):
+    print(f"Воркер {index} завершився")
+    return [("presence", index, name, []) for name in remote_presence.pop(index, {})]
+
+
+# --- Зв'язок з іншими вузлами (режим --relay-port / --peer) ---
+# Вузол пересилає сусідам лише власні події; кадр сусіда розсилається тут як свій —
+# з власним seq і записом у журнал цього вузла, але назад уже не пересилається.
+def relay_publish(message):
+    if relay is not None:
+        RELAY_EVENTS.inc("out")
+        relay.publish(message)
+
+
+# подія від сусіднього вузла (у потоці рушія)
+def apply_relay(node, message):
+    RELAY_EVENTS.inc("in")
+    kind = message[0]
+    if kind == "frame":
+        _, name, msg_type, fields = message
+        if relay_room(name):
+            fanout(get_room(name), Frame(msg_type, fields))
+    elif kind == "avatar":
+        _, name, user, filename, data = message
+        if data is not None:
+            set_avatar(user, filename, data)
+        if user in avatars and name in rooms:
+            broadcast_avatar(user, room=name)
+    elif kind == "rename":
+        move_avatar(message[1], message[2])
+    elif kind == "presence":
+        _, name, names = message
+        if relay_room(name):
+            remote_presence.setdefault(node, {})[name] = set(names)
+            send_members(get_room(name))
+
+
+# назва кімнати від сусіда стає каталогом журналу — перевіряємо так само, як JOIN від клієнта
+def relay_room(name):
+    return ROOM_NAME.fullmatch(name) is not None and (name in rooms or len(rooms) < MAX_ROOMS)
+
+
+# стан цього вузла для щойно підключеного сусіда: хто в яких кімнатах і їхні аватари
+def relay_snapshot():
+    messages = [("presence", name, local_names(room)) for name, room in list(rooms.items()) if room.members]
+    shared = set()
+    with avatars_lock:  # ніки й байти — одним знімком: хеш не звільнять між читаннями
+        for client in sessions.clients:
+            user = client.name
+            if user in avatars and user not in shared:
+                shared.add(user)
+                filename, digest = avatars[user]
+                messages.append(("avatar", client.room, user, filename, avatar_store.data(digest)))
+    return messages
+
+
+# до вузла більше немає з'єднань — його користувачі для нас вийшли з кімнат
+def relay_lost(node):
+    for name in remote_presence.pop(node, {}):
+        send_members(rooms.get(name))
+
+
+def start_relay():
+    if relay is not None:
+        relay.start(
+            lambda node, message: call_in_engine(apply_relay, node, message),
+            relay_snapshot,
+            lambda node: call_in_engine(relay_lost, node),
+        )
+
+
+def configure_relay(args):
+    global relay
+    if not args.relay_key:
+        sys.exit(f"Для зв'язку між вузлами потрібен спільний ключ: --relay-key або змінна {RELAY_KEY_ENV}")
+    peers = []
+    for peer in args.peer:
+        host, _, port = peer.rpartition(":")
+        if not host or not port.isdigit():
+            sys.exit(f"--peer {peer}: очікується АДРЕСА:ПОРТ")
+        peers.append((host, int(port)))
+    listen = (args.relay_host, args.relay_port) if args.relay_port else None
+    node = args.node_id or f"{socket.gethostname()}:{args.port}"
+    relay = federation.Relay(node, args.relay_key.encode(), listen, peers)
+    print(f"Вузол {node}: сусідів {len(peers)}" + (f", зв'язок на {listen[0]}:{listen[1]}" if listen else ""))
+
+
+# --- Запуск воркера (у дочірньому процесі) ---
+def run_worker(index, argv, address, authkey, key):
+    global shard, session_key
+    args = parse_args(argv)
+    session_key = key  # токени сесій дійсні на будь-якому воркері
+    shard = shards.Bus(address, authkey, index)
+    if args.metrics_port:
+        args.metrics_port += index  # кожен воркер — на своєму порту
+    if args.trace:
+        base, ext = os.path.splitext(args.trace)
+        args.trace = f"{base}-{index}{ext}"
+    if args.avatar_workers > 0:
+        args.avatar_workers = max(1, args.avatar_workers // args.processes)
+    configure(args)
+    apply_state(shard.state)
+    serve(args)
+
+
+# --- Запуск концентратора і воркерів ---
+def run_hub(args, argv):
+    if not hasattr(socket, "SO_REUSEPORT"):
+        sys.exit("--processes потребує SO_REUSEPORT (Linux, macOS, BSD)")
+    configure_history(args)
+    if args.files_dir:
+        transfers.FileStore(args.files_dir)  # лише прибрати недокачане з минулого запуску
+    hub = shards.Hub(hub_message, hub_snapshot, hub_lost)
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(target=run_worker, args=(index, argv, hub.address, hub.authkey, session_key),
+                        name=f"worker-{index}")
+        for index in range(args.processes)
+    ]
+    for worker in workers:
+        worker.start()
+    print(f"Сервер запущено на {args.host}:{args.port}, процесів: {args.processes}")
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        hub.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
+        hub.close()
+        for room in rooms.values():
+            if room.log is not None:
+                room.log.close()
+
+
+# --- Підняття ліміту відкритих файлів (кожне з'єднання — дескриптор) ---
+def raise_fd_limit():
+    try:
+        import resource
+    except ImportError:
+        return  # Windows: модуля resource немає
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard or hard == resource.RLIM_INFINITY:
+        target = hard if hard != resource.RLIM_INFINITY else max(soft, 65536)
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        except (ValueError, OSError):
+            pass
+
+
+# --- Запуск asyncio-рушія ---
+async def serve_async(host, port):
+    global engine_loop
+    engine_loop = asyncio.get_running_loop()
+    start_shard()
+    start_relay()
+    server = await asyncio.start_server(
+        handle_client_async, host, port, reuse_address=True, backlog=listen_backlog,
+        reuse_port=shard is not None,
+    )
+    print(f"Сервер (asyncio) запущено на {host}:{port}")
+    # SIGTERM і Ctrl+C зупиняють сервер зсередини циклу подій: спершу перестаємо приймати,
+    # потім закриваємо з'єднання (з Python 3.12 сервер на виході чекає, поки закриються всі),
+    # і лише тоді виходимо — без обриву посеред select() і без скасування serve_forever,
+    # яке саме чекало б на ті самі з'єднання
+    stopping = asyncio.Event()
+    try:
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            engine_loop.add_signal_handler(signum, stopping.set)
+    except NotImplementedError:
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))  # Windows: цикл подій не приймає сигналів
+    async with server:
+        await stopping.wait()
+        server.close()
+        for task in list(client_tasks):
+            task.cancel()
+        await asyncio.gather(*client_tasks, return_exceptions=True)
+
+
+# --- Запуск потокового рушія (потік на клієнта) ---
+def serve_threads(host, port):
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  # створення сокета TCP
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # щоб порт не блокувався після перезапуску
-    server_socket.bind((HOST, PORT))  # прив'язуємо сервер до адреси
-    server_socket.listen(5)  # слухаємо підключення
-    print(f"Сервер запущено на {HOST}:{PORT}")
+    if shard is not None:
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)  # порт ділять усі воркери
+    server_socket.bind((host, port))  # прив'язуємо сервер до адреси
+    server_socket.listen(listen_backlog)  # слухаємо підключення
+    # SIGTERM може дістатися будь-якому потоку, а обробник виконується лише в головному —
+    # тож accept() не блокує назавжди, і головний потік регулярно його перевіряє
+    server_socket.settimeout(ACCEPT_POLL)
+    print(f"Сервер запущено на {host}:{port}")
+    start_shard()
+    start_relay()
 
     while True:
-        client_socket, addr = server_socket.accept()  # приймаємо нове підключення
+        try:
+            client_socket, addr = server_socket.accept()  # приймаємо нове підключення
+        except socket.timeout:
+            continue
+        except OSError as e:
+            # скінчились дескриптори чи пам'ять: з'єднання лишаються в черзі ядра, пробуємо трохи згодом
+            print(f"Не вдалося прийняти з'єднання: {e}")
+            time.sleep(0.1)
+            continue
         print(f"Підключився клієнт: {addr}")
-        clients.append(client_socket)
+        CONNECTIONS.inc()
+        with tracing.root("accept", "net"):
+            client = ThreadConnection(client_socket, addr)
+
+            # запускаємо новий потік для обробки клієнта
+            t = threading.Thread(target=handle_client, args=(client,), daemon=True)
+            t.start()
 
-        # надсилаємо новому клієнту усі існуючі аватари
-        send_existing_data(client_socket)
 
-        # запускаємо новий потік для обробки клієнта
-        t = threading.Thread(target=handle_client, args=(client_socket,))
-        t.start()
+# --- Аргументи командного рядка ---
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Сервер чату LogiTalk")
+    parser.add_argument("--host", default=HOST, help="адреса для прослуховування")
+    parser.add_argument("--port", type=int, default=PORT, help="порт сервера")
+    parser.add_argument(
+        "--engine", choices=("thread", "asyncio"), default="thread",
+        help="thread — потік на клієнта, asyncio — один цикл подій на всі з'єднання",
+    )
+    parser.add_argument(
+        "--send-queue", type=int, default=SEND_QUEUE_SIZE,
+        help="максимум кадрів у черзі відправки одного клієнта",
+    )
+    parser.add_argument(
+        "--overflow", choices=OVERFLOW_POLICIES, default=overflow_policy,
+        help="політика переповнення черги: викинути найстаріший кадр, "
+             "відключити клієнта або спершу викидати аватари",
+    )
+    parser.add_argument(
+        "--queue-report", type=float, default=0, metavar="SECONDS",
+        help="раз на SECONDS секунд друкувати глибину черг клієнтів, що відстають",
+    )
+    parser.add_argument(
+        "--avatar-workers", type=int, default=min(4, os.cpu_count() or 1),
+        help="процеси для перевірки й зменшення аватарів (0 — зберігати без обробки)",
+    )
+    parser.add_argument(
+        "--history-dir", default=HISTORY_DIR,
+        help="каталог журналу історії повідомлень (порожній рядок — не зберігати історію)",
+    )
+    parser.add_argument(
+        "--history-segment-mb", type=int, default=64,
+        help="розмір одного сегмента журналу історії, МБ",
+    )
+    parser.add_argument(
+        "--history-segments", type=int, default=0,
+        help="скільки останніх сегментів історії зберігати (0 — усі)",
+    )
+    parser.add_argument(
+        "--compression", choices=("deflate", "off"), default="deflate",
+        help="стиснення великих кадрів для клієнтів v2, які його підтримують",
+    )
+    parser.add_argument(
+        "--compress-min", type=int, default=protocol.COMPRESS_MIN, metavar="BYTES",
+        help="кадри, менші за BYTES, не стискаються",
+    )
+    parser.add_argument(
+        "--files-dir", default=FILES_DIR,
+        help="каталог для файлів, якими діляться в чаті (порожній рядок — вимкнути обмін файлами)",
+    )
+    parser.add_argument(
+        "--max-file-mb", type=int, default=MAX_FILE_BYTES // (1024 * 1024),
+        help="найбільший файл, який можна надіслати в чат, МБ",
+    )
+    parser.add_argument(
+        "--metrics-port", type=int, default=0,
+        help="порт, на якому віддавати метрики у форматі Prometheus (GET /metrics; 0 — вимкнено)",
+    )
+    parser.add_argument(
+        "--metrics-host", default="127.0.0.1",
+        help="адреса адмін-порту метрик (типово лише локальна)",
+    )
+    parser.add_argument(
+        "--trace", metavar="PATH",
+        help="записувати спани гарячого шляху у PATH (Chrome trace-event JSON) при завершенні сервера",
+    )
+    parser.add_argument(
+        "--trace-sample", type=float, default=0.01, metavar="FRACTION",
+        help="частка прийнятих кадрів і записів у сокет, що трасуються (типово 1%%)",
+    )
+    parser.add_argument(
+        "--processes", type=int, default=1,
+        help="скільки процесів-воркерів приймають клієнтів на одному порту (SO_REUSEPORT); "
+             "головний процес упорядковує розсилки між ними",
+    )
+    parser.add_argument(
+        "--node-id", default=None,
+        help="ім'я цього вузла для сусідів (типово хост:порт)",
+    )
+    parser.add_argument(
+        "--relay-port", type=int, default=0,
+        help="порт, на якому приймати з'єднання від сусідніх вузлів (0 — не приймати)",
+    )
+    parser.add_argument(
+        "--relay-host", default="127.0.0.1",
+        help="адреса для з'єднань від сусідніх вузлів",
+    )
+    parser.add_argument(
+        "--peer", action="append", default=[], metavar="HOST:PORT",
+        help="сусідній вузол (його --relay-port); можна вказати кілька разів",
+    )
+    parser.add_argument(
+        "--relay-key", default=os.environ.get(RELAY_KEY_ENV),
+        help=f"спільний для всіх вузлів ключ (типово зі змінної {RELAY_KEY_ENV})",
+    )
+    parser.add_argument(
+        "--backlog", type=int, default=listen_backlog,
+        help="черга ще не прийнятих з'єднань у ядрі (обмежена net.core.somaxconn)",
+    )
+    parser.add_argument(
+        "--max-handshakes", type=int, default=MAX_HANDSHAKES,
+        help="скільки нових клієнтів потоковий рушій приєднує одночасно (asyncio обробляє їх по одному й так)",
+    )
+    parser.add_argument(
+        "--msg-rate", type=float, default=flood_limits.messages[0],
+        help="скільки кадрів за секунду може надсилати один клієнт (0 — без обмеження)",
+    )
+    parser.add_argument(
+        "--msg-burst", type=int, default=flood_limits.messages[1],
+        help="скільки кадрів клієнт може надіслати одним сплеском",
+    )
+    parser.add_argument(
+        "--byte-rate", type=int, default=flood_limits.bytes[0] // 1024, metavar="KB",
+        help="скільки КБ за секунду може надсилати один клієнт, не рахуючи аватарів і файлів (0 — без обмеження)",
+    )
+    parser.add_argument(
+        "--byte-burst", type=int, default=flood_limits.bytes[1] // 1024, metavar="KB",
+        help="скільки КБ клієнт може надіслати одним сплеском",
+    )
+    parser.add_argument(
+        "--avatar-rate", type=float, default=flood_limits.avatars[0] * 60, metavar="PER_MINUTE",
+        help="скільки аватарів за хвилину може надсилати один клієнт (0 — без обмеження)",
+    )
+    parser.add_argument(
+        "--avatar-burst", type=int, default=flood_limits.avatars[1],
+        help="скільки аватарів клієнт може надіслати поспіль",
+    )
+    parser.add_argument(
+        "--flood-delay", type=float, default=flood_limits.max_delay, metavar="SECONDS",
+        help="на скільки найбільше затримувати кадр понад ліміт; що довше — відкидається",
+    )
+    parser.add_argument(
+        "--flood-strikes", type=int, default=flood_limits.strikes,
+        help="скільки відкинутих кадрів терпіти (запас відновлюється по одному за секунду), "
+             "перш ніж відключити клієнта (0 — не відключати)",
+    )
+    parser.add_argument(
+        "--no-flood-limits", action="store_true",
+        help="вимкнути всі обмеження потоку від клієнтів",
+    )
+    return parser.parse_args(argv)
+
+
+# --- Запуск сервера ---
+def main(argv=None):
+    args = parse_args(argv)
+    if args.processes > 1 and (args.relay_port or args.peer):
+        sys.exit("--processes не поєднується зі зв'язком між вузлами: запустіть кілька вузлів")
+    if args.processes > 1:
+        run_hub(args, sys.argv[1:] if argv is None else list(argv))
+        return
+    configure(args)
+    serve(args)
+
+
+def configure_history(args):
+    global history_dir, history_segment_bytes, history_segments
+    if args.history_dir:
+        history_dir = args.history_dir
+        history_segment_bytes = max(1, args.history_segment_mb) * 1024 * 1024
+        history_segments = max(0, args.history_segments)
+        SERVER_FEATURES.add(protocol.FEATURE_HISTORY)
+        os.makedirs(history_dir, exist_ok=True)
+        if shard is None:
+            load_session_key(history_dir)  # токени сесій лишаються дійсними після перезапуску
+    load_rooms()
+    if history_dir:
+        print(f"Історія: {history_dir}, кімнат {len(rooms)}")
+
+
+def configure_flood(args):
+    global flood_limits
+    if args.no_flood_limits:
+        flood_limits = None
+        return
+    flood_limits = ratelimit.Limits(
+        messages=(args.msg_rate, args.msg_burst),
+        bytes_=(args.byte_rate * 1024, args.byte_burst * 1024),
+        avatars=(args.avatar_rate / 60, args.avatar_burst),
+        max_delay=max(0.0, args.flood_delay),
+        strikes=max(0, args.flood_strikes),
+    )
+
+
+def configure(args):
+    global SEND_QUEUE_SIZE, overflow_policy, file_store, MAX_FILE_BYTES, listen_backlog, admission
+    SEND_QUEUE_SIZE = max(1, args.send_queue)
+    listen_backlog = max(1, args.backlog)
+    configure_flood(args)
+    admission = threading.BoundedSemaphore(max(1, args.max_handshakes))
+    overflow_policy = args.overflow
+    raise_fd_limit()
+    start_thumbnail_pool(args.avatar_workers)
+    if args.compression == "deflate":
+        SERVER_FEATURES.add(protocol.FEATURE_DEFLATE)
+        protocol.COMPRESS_MIN = max(0, args.compress_min)
+    configure_history(args)
+    if args.files_dir:
+        file_store = transfers.FileStore(args.files_dir, clean=shard is None)
+        MAX_FILE_BYTES = max(0, args.max_file_mb) * 1024 * 1024
+    if args.trace:
+        tracing.configure(args.trace, args.trace_sample, "server")
+    if args.relay_port or args.peer:
+        configure_relay(args)
+    if args.metrics_port:
+        metrics.serve(args.metrics_host, args.metrics_port)
+        print(f"Метрики: http://{args.metrics_host}:{args.metrics_port}/metrics")
+    if args.queue_report > 0:
+        threading.Thread(target=queue_report_loop, args=(args.queue_report,), daemon=True).start()
+
+
+def serve(args):
+    try:
+        if args.engine == "asyncio":
+            asyncio.run(serve_async(args.host, args.port))
+        else:
+            # SIGTERM завершує сервер так само, як Ctrl+C — щоб встигнути зупинити пул процесів
+            signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+            serve_threads(args.host, args.port)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if thumbnail_pool is not None:
+            # воркер --processes сам є дочірнім процесом multiprocessing: на виході він чекає
+            # власних дочірніх, тож пул треба дочекатися тут, інакше процес не завершиться
+            thumbnail_pool.shutdown(wait=shard is not None, cancel_futures=True)
+        for room in rooms.values():
+            if room.log is not None:
+                room.log.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,119 @@
+import os
+import signal
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener, wait
+
+# --- Шина між процесами сервера (режим --processes N) ---
+# Воркери приймають клієнтів на одному порту (SO_REUSEPORT — ядро саме розкидає
+# з'єднання між процесами), а все, що змінює спільний стан чату — розсилки, аватари,
+# зміни ніків, присутність, — надсилають концентратору (головному процесу).
+# Концентратор обробляє повідомлення строго по одному: присвоює seq, пише журнал
+# і розсилає результат усім воркерам, включно з автором. Кожен воркер застосовує
+# ті самі події в тому самому порядку, тож клієнти бачать один чат.
+# Транспорт — multiprocessing.connection поверх Unix-сокета: кадри з довжиною,
+# pickle всередині, автентифікація випадковим ключем.
+POLL_INTERVAL = 0.5  # як часто концентратор перевіряє, чи не підключився новий воркер
+MAX_BATCH = 256      # скільки подій воркер застосовує за один прохід
+
+
+# --- Концентратор ---
+# handle(worker, message) повертає повідомлення для всіх воркерів (або None);
+# snapshot() — стан для воркера, що щойно підключився; lost(worker) — воркер зник.
+class Hub:
+    def __init__(self, handle, snapshot, lost):
+        self.handle = handle
+        self.snapshot = snapshot
+        self.lost = lost
+        self.authkey = os.urandom(32)
+        self.listener = Listener(authkey=self.authkey)  # адресу (файл сокета) вибирає сама
+        self.address = self.listener.address
+        self.workers = {}              # з'єднання -> номер воркера
+        self.lock = threading.Lock()   # новий воркер отримує знімок і далі — усі події, без пропусків
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+
+    def accept_loop(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except AuthenticationError:
+                continue  # чужий процес без ключа
+            except OSError:
+                return  # слухача закрито
+            try:
+                _, index = conn.recv()  # ("hello", номер)
+            except (OSError, EOFError):
+                conn.close()
+                continue
+            with self.lock:
+                conn.send(self.snapshot())
+                self.workers[conn] = index
+
+    def run(self):
+        while True:
+            with self.lock:
+                conns = list(self.workers)
+            if not conns:
+                time.sleep(POLL_INTERVAL)
+                continue
+            for conn in wait(conns, POLL_INTERVAL):
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    self.drop(conn)
+                    continue
+                with self.lock:
+                    out = self.handle(self.workers[conn], message)
+                    if out is not None:
+                        self.publish(out)
+
+    def publish(self, message):
+        for conn in list(self.workers):
+            try:
+                conn.send(message)
+            except OSError:
+                self.workers.pop(conn, None)
+
+    def drop(self, conn):
+        with self.lock:
+            index = self.workers.pop(conn, None)
+            if index is not None:
+                for message in self.lost(index):
+                    self.publish(message)
+        conn.close()
+
+    def close(self):
+        self.listener.close()
+
+
+# --- Воркер: з'єднання з концентратором ---
+class Bus:
+    def __init__(self, address, authkey, index):
+        self.index = index
+        self.conn = Client(address, authkey=authkey)
+        self.lock = threading.Lock()  # надсилають потоки клієнтів, таймери й цикл подій
+        self.conn.send(("hello", index))
+        self.state = self.conn.recv()
+
+    def send(self, message):
+        with self.lock:
+            self.conn.send(message)
+
+    # події від концентратора читаються окремим потоком; deliver(список подій) сам вирішує,
+    # де їх застосувати. Усе, що вже прийшло, віддаємо однією пачкою — менше передач між потоками.
+    def start(self, deliver):
+        threading.Thread(target=self.recv_loop, args=(deliver,), daemon=True).start()
+
+    def recv_loop(self, deliver):
+        while True:
+            try:
+                batch = [self.conn.recv()]
+                while len(batch) < MAX_BATCH and self.conn.poll():
+                    batch.append(self.conn.recv())
+            except (EOFError, OSError):
+                break
+            deliver(batch)
+        # без концентратора воркер уже не в спільному чаті — завершуємось як від SIGTERM
+        print(f"Воркер {self.index}: зв'язок з головним процесом втрачено")
+        os.kill(os.getpid(), signal.SIGTERM)
@@ -1,12 +1,19 @@
-import threading
-import base64
+import queue
 import io
-from socket import *
+import os
 from customtkinter import *
 from tkinter import filedialog
 from PIL import Image, ImageTk, ImageEnhance
 import random
 
+import protocol
+import tracing
+from avatar_cache import DiskCache, PhotoCache, default_cache_dir
+from chat_view import ChatRecord, MessageRow, VirtualChatView
+from layout import ChatLayout
+from animation import FrameScheduler
+from chat_client import ChatConnection, format_size
+
 # =======================
 #   🩸  FNaF оформление
 # =======================
@@ -17,6 +24,12 @@ FNAF_RED = "#ff2e2e"          # красный FNaF
 FNAF_DARKRED = "#330000"
 FNAF_BLACK = "#000000"
 
+HISTORY_LIMIT = 5000  # сколько сообщений держать в истории чата (None — без ограничения)
+UI_POLL_MS = 30       # как часто главный поток забирает кадры, полученные recv_loop
+UI_BATCH_LIMIT = 500  # сколько кадров обрабатывать за один проход, чтобы не подвешивать интерфейс
+MENU_WIDTH = 200      # ширина открытого бокового меню
+HISTORY_BACKFILL = 50  # сколько последних сообщений просить у сервера после подключения
+
 set_appearance_mode("dark")
 
 # ===== ГОЛОВНЕ ВІКНО ЧАТУ =====
@@ -31,18 +44,27 @@ class MainWindow(CTk):
         self.username = username or "одеяло"
         self.host = host
         self.port = port
-        self.sock = None
+        self.conn = None                  # ChatConnection: подключение, чтение и повторные попытки
 
         self.is_show_menu = False
         self.frame_width = 0
         self.menu_show_speed = 20
 
         self.avatar_path = avatar_path
-        self.avatars: dict[str, bytes] = {}
+        self.avatars: dict[str, str] = {}         # ник -> хеш аватара
+        self.avatar_blobs: dict[str, bytes] = {}  # хеш -> байты картинки (одинаковые хранятся раз)
+        self.avatar_requested = set()             # хеши, которые уже запросили у сервера
+        self.avatar_disk = DiskCache(default_cache_dir("avatars"))  # байты аватаров между запусками
+        # поток соединения не трогает виджеты: кадры идут в очередь, которую разбирает главный поток
+        self.inbox = queue.SimpleQueue()
+        self.in_batch = False
+        self.animator = FrameScheduler(self)    # все анимации окна — в одном таймере
+        # готовые PhotoImage: декодируем, затемняем и масштабируем картинку один раз
+        self.photo_cache = PhotoCache(self.get_avatar_image, effect="brightness-0.7")
 
         # --- Боковое меню ---
         self.menu_frame = CTkFrame(
-            self, width=200, height=self.winfo_height(), fg_color=FNAF_PANEL
+            self, width=MENU_WIDTH, height=self.winfo_height(), fg_color=FNAF_PANEL
         )
         self.menu_frame.pack_propagate(False)
         self.menu_frame.configure(width=0)
@@ -71,6 +93,36 @@ class MainWindow(CTk):
         )
         self.avatar_button.pack(pady=10)
 
+        self.file_button = CTkButton(
+            self.menu_frame,
+            text="Передать файл",
+            fg_color=FNAF_DARKRED,
+            hover_color="#550000",
+            text_color=FNAF_RED,
+            command=self.choose_file
+        )
+        self.file_button.pack(pady=10)
+
+        CTkLabel(
+            self.menu_frame, text="Комната", text_color=FNAF_RED, font=("Consolas", 14, "bold")
+        ).pack(pady=(10, 0))
+        self.room_box = CTkComboBox(
+            self.menu_frame,
+            values=[protocol.DEFAULT_ROOM],
+            fg_color=FNAF_DARKRED,
+            button_color="#550000",
+            text_color=FNAF_RED,
+            command=self.switch_room
+        )
+        self.room_box.set(protocol.DEFAULT_ROOM)
+        self.room_box.bind("<Return>", lambda event: self.switch_room(self.room_box.get()))  # новая комната — ввести имя
+        self.room_box.pack()
+        self.members_label = CTkLabel(
+            self.menu_frame, text="", text_color="#aa0000", font=("Consolas", 11),
+            wraplength=MENU_WIDTH - 20, justify="left"
+        )
+        self.members_label.pack(pady=5)
+
         self.theme_menu = CTkOptionMenu(
             self.menu_frame,
             values=["Темница FNaF", "Адская ночь"],
@@ -94,8 +146,10 @@ class MainWindow(CTk):
         self.menu_btn.place(x=0, y=0)
 
         # --- Чат ---
-        self.chat_field = CTkScrollableFrame(
-            self, width=400, height=200, fg_color="#0b0b0b"
+        # виджеты создаются только для видимых строк и переиспользуются при прокрутке
+        self.chat_field = VirtualChatView(
+            self, make_row=self.make_row, bind_row=self.bind_row,
+            history_limit=HISTORY_LIMIT, width=400, height=200, fg_color="#0b0b0b"
         )
         self.chat_field.place(x=0, y=30)
 
@@ -123,76 +177,109 @@ class MainWindow(CTk):
         self.message_entry.place(x=0, y=self.winfo_height() - 40)
         self.send_btn.place(x=self.winfo_width() - 50, y=self.winfo_height() - 40)
 
-        # адаптивність
-        self.after(20, self.adaptive_ui)
+        # адаптивность: геометрия пересчитывается только при изменении размера окна или меню
+        self.layout = ChatLayout(self, self.menu_frame, self.chat_field, self.message_entry, self.send_btn)
 
         # эффект моргания камеры
-        self.after(500, self.flicker_effect)
+        self.animator.call_later("flicker", 500, self.flicker_effect)
 
         # подключение
         self.connect_to_server()
+        # разбор входящих кадров пачками в главном потоке
+        self.after(UI_POLL_MS, self.drain_inbox)
 
     # ===== ЭФФЕКТ МОРГАНИЯ FNAF =====
     def flicker_effect(self):
         if random.randint(0, 12) == 1:
             self.configure(fg_color="#0f0f0f")
-            self.after(60, lambda: self.configure(fg_color=FNAF_BG))
-        self.after(500, self.flicker_effect)
+            self.animator.call_later("flicker-off", 60, lambda: self.configure(fg_color=FNAF_BG))
+        # планировщик спит до следующего мигания и не тикает, пока окно свёрнуто
+        self.animator.call_later("flicker", 500, self.flicker_effect)
 
     # ====== МЕРЕЖА ======
     def connect_to_server(self):
-        try:
-            self.sock = socket(AF_INET, SOCK_STREAM)
-            self.sock.connect((self.host, self.port))
-
-            self.sock.sendall(
-                f"TEXT@SYSTEM@{self.username} вошёл в тёмную комнату\n".encode()
-            )
-
-            self.add_message(
-                f"Подключение к серверу {self.host}:{self.port} установлено",
-                system=True
-            )
-
-            if self.avatar_path:
-                self.send_avatar()
-
-            threading.Thread(target=self.recv_loop, daemon=True).start()
-
-        except Exception as e:
-            self.add_message(f"Ошибка подключения: {e}", system=True)
-
-    def recv_loop(self):
-        buffer = ""
-        while True:
-            try:
-                chunk = self.sock.recv(8192)
-                if not chunk:
-                    break
-                buffer += chunk.decode(errors="ignore")
-                while "\n" in buffer:
-                    line, buffer = buffer.split("\n", 1)
-                    self.handle_line(line.strip())
-            except:
-                break
+        self.conn = ChatConnection(
+            self.host, self.port, {protocol.FEATURE_AVATAR_REF, protocol.FEATURE_HISTORY},
+            on_frame=lambda msg_type, parts: self.inbox.put((msg_type, parts)),
+            on_status=lambda event, detail: self.inbox.put((None, (event, detail))),
+            history=HISTORY_BACKFILL,
+        )
+        self.conn.start()
 
+    # приветствие и свой аватар — только при новом входе, не при восстановлении сессии
+    def join_chat(self):
         try:
-            self.sock.close()
+            self.send_frame("TEXT", "SYSTEM", f"{self.username} вошёл в тёмную комнату")
         except:
             pass
+        if self.avatar_path:
+            self.send_avatar()
 
-        self.add_message("Связь потеряна...", system=True)
-
-    def handle_line(self, line: str):
-        if not line:
-            return
-        
-        parts = line.split("@", 2)
-        msg_type = parts[0]
-
-        if msg_type == "TEXT" and len(parts) >= 3:
-            author = parts[1]
-            message = parts[2]
+    def handle_status(self, event, detail):
+        if event == "connected":
+            self.avatar_requested.clear()  # запросы, отправленные до обрыва, остались без ответа
+            if detail:
+                self.add_message("Камера снова в сети, восстанавливаем сессию...", system=True)
+            else:
+                self.add_message(
+                    f"Подключение к серверу {self.host}:{self.port} установлено",
+                    system=True
+                )
+                self.join_chat()
+        elif event == "resumed":
+            self.add_message("Сессия восстановлена", system=True)
+        elif event == "resume-failed":
+            self.join_chat()
+        elif event == "disconnected":
+            self.add_message(f"Связь потеряна... повтор через {detail:.1f} с", system=True)
+        elif event == "retry":
+            error, delay = detail
+            self.add_message(f"Ошибка подключения: {error}; повтор через {delay:.1f} с", system=True)
+        elif event == "upload-done":
+            kind, name = detail
+            if kind == "file":
+                self.add_message(f"📎 {name}", username=self.username, self_message=True)
+        elif event == "upload-failed":
+            kind, name, reason = detail
+            what = "аватар" if kind == "avatar" else "файл"
+            self.add_message(f"Не удалось передать {what} {name}: {reason}", system=True)
+        elif event == "download-done":
+            self.add_message(f"Файл сохранён: {detail}", system=True)
+        elif event == "download-failed":
+            name, reason = detail
+            self.add_message(f"Не удалось скачать {name}: {reason}", system=True)
+
+    def send_frame(self, msg_type, *fields):
+        self.conn.send(msg_type, *fields)
+
+    # выполняется в главном потоке: вся пачка — одна перерисовка и одна прокрутка
+    def drain_inbox(self):
+        count = 0
+        self.in_batch = True
+        try:
+            with tracing.root("drain_inbox", "ui"):
+                while count < UI_BATCH_LIMIT:
+                    try:
+                        msg_type, parts = self.inbox.get_nowait()
+                    except queue.Empty:
+                        break
+                    count += 1
+                    if msg_type is None:
+                        self.handle_status(*parts)
+                    else:
+                        with tracing.span(msg_type, "handle"):
+                            self.handle_frame(msg_type, parts)
+        finally:
+            self.in_batch = False
+            if count:
+                self.smooth_scroll_to_bottom()
+            # очередь не опустела — продолжаем сразу, но даём Tk обработать события
+            self.after(1 if count >= UI_BATCH_LIMIT else UI_POLL_MS, self.drain_inbox)
+
+    def handle_frame(self, msg_type, parts):
+        if msg_type == "TEXT" and len(parts) >= 2:
+            author = parts[0]
+            message = parts[1]
 
             if author == "SYSTEM":
                 self.add_message(message, system=True)
@@ -203,29 +290,96 @@ class MainWindow(CTk):
                     self_message=(author == self.username)
                 )
 
-        elif msg_type == "AVATAR" and len(parts) >= 4:
-            author = parts[1]
-            filename = parts[2]
-            encoded = parts[3]
-            try:
-                self.avatars[author] = base64.b64decode(encoded)
-                self.add_message(f"{author} сменил аватар ({filename})", system=True)
-            except:
-                pass
-
-        elif msg_type == "RENAME" and len(parts) >= 3:
-            old = parts[1]
-            new = parts[2]
+        elif msg_type == "AVATAR" and len(parts) >= 3:
+            # старый сервер присылает картинку целиком (base64 v1 раскодирован в protocol)
+            author = parts[0]
+            filename = parts[1]
+            digest = protocol.content_hash(parts[2])
+            self.avatar_blobs[digest] = parts[2]
+            self.avatar_disk.put(digest, parts[2])
+            self.avatars[author] = digest
+            self.photo_cache.invalidate(author)
+            self.add_message(f"{author} сменил аватар ({filename})", system=True)
+
+        elif msg_type == "AVATARREF" and len(parts) >= 3:
+            # только ник -> хеш; байты запрашиваем, если такой картинки ещё нет
+            author = parts[0]
+            filename = parts[1]
+            digest = parts[2]
+            if self.avatars.get(author) == digest:
+                return  # после восстановления сессии сервер повторяет уже известные аватары
+            self.avatars[author] = digest
+            self.photo_cache.invalidate(author)
+            self.request_avatar(digest)
+            self.add_message(f"{author} сменил аватар ({filename})", system=True)
+
+        elif msg_type == "AVATARDATA" and len(parts) >= 2:
+            digest = parts[0]
+            if protocol.content_hash(parts[1]) == digest:
+                self.avatar_blobs[digest] = parts[1]
+                self.avatar_disk.put(digest, parts[1])
+                self.chat_field.rebind()  # показанные строки получат картинку
+            self.avatar_requested.discard(digest)
+
+        elif msg_type == "RENAME" and len(parts) >= 2:
+            old = parts[0]
+            new = parts[1]
             self.add_message(f"{old} → {new}", system=True)
             if old in self.avatars:
                 self.avatars[new] = self.avatars.pop(old)
+            self.photo_cache.invalidate(old)
+            self.photo_cache.invalidate(new)
+            self.chat_field.rebind()
             if old == self.username:
                 self.username = new
                 self.name_entry.delete(0, "end")
                 self.name_entry.insert(0, new)
 
+        elif msg_type == "FILE" and len(parts) >= 4:  # FILE@name@hash@size@filename
+            author, digest, size, filename = parts[:4]
+            size = format_size(int(size)) if size.isdigit() else "?"
+            self.add_message(
+                f"📎 {filename} ({size}) — нажмите, чтобы сохранить",
+                username=author, self_message=(author == self.username),
+                action=lambda: self.download_file(digest, filename),
+            )
+
+        elif msg_type == "JOIN" and parts:  # сервер перевёл нас в другую комнату
+            room = parts[0]
+            self.chat_field.clear()  # историю новой комнаты сервер пришлёт следом
+            self.room_box.set(room)
+            self.members_label.configure(text="")
+            self.add_message(f"Камера переключена: {room}", system=True)
+
+        elif msg_type == "ROOMS" and parts:
+            self.room_box.configure(values=parts[0].split(","))
+
+        elif msg_type == "MEMBERS" and len(parts) >= 2:
+            if parts[0] == self.conn.room:
+                self.members_label.configure(text=f"На смене: {parts[1]}")
+
+        elif msg_type == "HISTORY":
+            pass  # конец подгрузки истории
+
+        elif msg_type == "HELLO":
+            pass  # старый сервер пересылает чужие HELLO всем — игнорируем
+
         else:
-            self.add_message(line, system=True)
+            self.add_message("@".join([msg_type, *parts]), system=True)
+
+    def request_avatar(self, digest):
+        if digest in self.avatar_blobs or digest in self.avatar_requested:
+            return
+        data = self.avatar_disk.get(digest)
+        if data is not None:
+            self.avatar_blobs[digest] = data
+            self.chat_field.rebind()
+            return
+        self.avatar_requested.add(digest)
+        try:
+            self.send_frame("AVATARGET", digest)
+        except:
+            self.avatar_requested.discard(digest)
 
     def send_message(self):
         text = self.message_entry.get().strip()
@@ -233,10 +387,8 @@ class MainWindow(CTk):
             return
         
         self.username = self.name_entry.get().strip()
-        data = f"TEXT@{self.username}@{text}\n"
-
         try:
-            self.sock.sendall(data.encode())
+            self.send_frame("TEXT", self.username, text)
         except:
             self.add_message("Ошибка отправки", system=True)
 
@@ -258,16 +410,62 @@ class MainWindow(CTk):
         try:
             with open(self.avatar_path, "rb") as f:
                 data = f.read()
-            encoded = base64.b64encode(data).decode()
             filename = self.avatar_path.split("/")[-1]
-            msg = f"AVATAR@{self.username}@{filename}@{encoded}\n"
-            self.sock.sendall(msg.encode())
+            # сервер с BLOB получит файл кусками в фоне; старому — одним кадром
+            if not self.conn.upload(self.avatar_path, "avatar", self.username, filename):
+                # в v2 байты идут как есть, для v1 protocol сам закодирует base64
+                self.send_frame("AVATAR", self.username, filename, data)
         except:
             self.add_message("Ошибка отправки аватара", system=True)
 
+    # ====== КОМНАТЫ ======
+    def switch_room(self, room):
+        room = room.strip()
+        if not room or room == self.conn.room:
+            return
+        try:
+            if not self.conn.join(room):
+                self.add_message("Сервер не поддерживает комнаты", system=True)
+                self.room_box.set(self.conn.room)
+        except OSError:
+            self.add_message("Нет связи с сервером", system=True)
+            self.room_box.set(self.conn.room)
+
+    # ====== ФАЙЛЫ ======
+    def choose_file(self):
+        path = filedialog.askopenfilename(title="Выберите файл")
+        if path:
+            self.send_file(path)
+
+    def send_file(self, path):
+        filename = os.path.basename(path)
+        try:
+            if not self.conn.upload(path, "file", self.username, filename):
+                self.add_message("Сервер не поддерживает передачу файлов", system=True)
+                return
+        except OSError as e:
+            self.add_message(f"Не удалось передать файл {filename}: {e}", system=True)
+            return
+        self.add_message(f"Передаём {filename}...", system=True)
+
+    def download_file(self, digest, filename):
+        path = filedialog.asksaveasfilename(title="Сохранить файл", initialfile=filename)
+        if not path:
+            return
+        try:
+            self.conn.download(digest, path, filename)
+        except OSError as e:
+            self.add_message(f"Не удалось сохранить {filename}: {e}", system=True)
+
     def get_avatar_image(self, data: bytes, size=(30, 30)):
+        with tracing.root("avatar_decode", "ui", bytes=len(data)):
+            return self.decode_avatar(data, size)
+
+    def decode_avatar(self, data: bytes, size):
         try:
-            img = Image.open(io.BytesIO(data)).resize(size, Image.Resampling.LANCZOS)
+            img = Image.open(io.BytesIO(data))
+            if img.size != size:  # сервер уже присылает готовые миниатюры нужного размера
+                img = img.resize(size, Image.Resampling.LANCZOS)
             enhancer = ImageEnhance.Brightness(img)
             img = enhancer.enhance(0.7)
             return ImageTk.PhotoImage(img)
@@ -280,114 +478,89 @@ class MainWindow(CTk):
 
     def toggle_menu(self):
         self.is_show_menu = not self.is_show_menu
-        if self.is_show_menu:
-            self.show_menu()
-        else:
-            self.hide_menu()
-
-    def show_menu(self):
-        if self.frame_width <= 200:
-            self.frame_width += self.menu_show_speed
-            self.menu_frame.configure(width=self.frame_width, height=self.winfo_height())
-            if self.frame_width >= 30:
-                self.menu_btn.configure(width=self.frame_width, text="◀️")
-        if self.is_show_menu:
-            self.after(20, self.show_menu)
-
-    def hide_menu(self):
-        if self.frame_width >= 0:
-            self.frame_width -= self.menu_show_speed
+        self.animator.animate("menu", self.slide_menu())
+
+    # меню выезжает/прячется шагами; новый клик заменяет анимацию, которая ещё идёт
+    def slide_menu(self):
+        target = MENU_WIDTH if self.is_show_menu else 0
+        while self.frame_width != target:
+            if target > self.frame_width:
+                self.frame_width = min(self.frame_width + self.menu_show_speed, target)
+            else:
+                self.frame_width = max(self.frame_width - self.menu_show_speed, target)
             self.menu_frame.configure(width=self.frame_width)
+            self.layout.set_menu_width(self.frame_width)
             if self.frame_width >= 30:
-                self.menu_btn.configure(width=self.frame_width, text="▶️")
-        if not self.is_show_menu:
-            self.after(20, self.hide_menu)
-
-    def adaptive_ui(self):
-        menu_w = self.menu_frame.winfo_width()
-        win_w = self.winfo_width()
-        win_h = self.winfo_height()
-
-        self.chat_field.configure(width=win_w - menu_w - 20, height=win_h - 40 - 50)
-        self.chat_field.place(x=menu_w, y=30)
-
-        self.message_entry.configure(width=win_w - menu_w - self.send_btn.winfo_width())
-        self.message_entry.place(x=menu_w, y=win_h - 40)
-
-        self.send_btn.place(
-            x=win_w - self.send_btn.winfo_width(),
-            y=win_h - self.send_btn.winfo_height()
-        )
+                self.menu_btn.configure(width=self.frame_width, text="◀️" if self.is_show_menu else "▶️")
+            yield
 
-        self.after(20, self.adaptive_ui)
-
-    def smooth_scroll_to_bottom(self, steps=10, delay=20):
-        canvas = self.chat_field._parent_canvas
+    def smooth_scroll_to_bottom(self, steps=10):
+        # новая прокрутка заменяет предыдущую в планировщике, а не бежит параллельно
+        self.chat_field.sync_scrollregion()
+        canvas = self.chat_field.canvas
         start = canvas.yview()[0]
         end = 1.0
         diff = (end - start) / steps
 
-        def step(i=0):
-            if i < steps:
-                canvas.yview_moveto(start + diff * (i + 1))
-                self.after(delay, lambda: step(i + 1))
-        step()
-
-    def add_message(self, message, username=None, self_message=False, system=False):
-
-        frame = CTkFrame(self.chat_field, fg_color="transparent")
-        if system:
-            frame.pack(anchor="center", pady=2, padx=5)
-        elif self_message:
-            frame.pack(anchor="e", pady=2, padx=5)
-        else:
-            frame.pack(anchor="w", pady=2, padx=5)
+        def scroll():
+            for i in range(steps):
+                with tracing.root("scroll", "ui", step=i):
+                    canvas.yview_moveto(start + diff * (i + 1))
+                yield
+        self.animator.animate("scroll", scroll())
+
+    def make_row(self, parent):
+        return MessageRow(
+            parent,
+            system_style=dict(text_color=FNAF_RED, font=("Consolas", 12, "bold")),
+            name_style=dict(font=("Consolas", 10, "bold")),
+            text_style=dict(font=("Consolas", 12)),
+        )
 
+    def bind_row(self, row, record):
         # --- SYSTEM MESSAGE (RED WARNING)
-        if system:
-            CTkLabel(
-                frame,
-                text=message,
-                text_color=FNAF_RED,
-                font=("Consolas", 12, "bold")
-            ).pack(anchor="center", padx=5, pady=2)
-            self.smooth_scroll_to_bottom()
+        if record.system:
+            row.system.configure(text=record.message)
+            row.system.pack(anchor="center", padx=5, pady=2)
             return
 
+        side = "right" if record.self_message else "left"
+
         # --- Avatar
-        if username and username in self.avatars:
-            avatar_img = self.get_avatar_image(self.avatars[username])
+        digest = self.avatars.get(record.username)
+        avatar_data = self.avatar_blobs.get(digest)
+        if record.username and avatar_data:
+            avatar_img = self.photo_cache.get(record.username, digest, avatar_data)
             if avatar_img:
-                lbl_img = CTkLabel(frame, image=avatar_img, text="")
-                lbl_img.image = avatar_img
-                lbl_img.pack(side="right" if self_message else "left", padx=5)
+                row.avatar.configure(image=avatar_img)
+                row.avatar.image = avatar_img
+                row.avatar.pack(side=side, padx=5)
 
         # --- Message bubble ---
-        bg_color = FNAF_DARKRED if self_message else "#111111"
-        text_color = FNAF_RED if self_message else "#e5e5e5"
+        bg_color = FNAF_DARKRED if record.self_message else "#111111"
+        text_color = FNAF_RED if record.self_message else "#e5e5e5"
 
-        bubble = CTkFrame(frame, fg_color=bg_color, corner_radius=10)
-        bubble.pack(side="right" if self_message else "left", padx=5, pady=(0, 5))
+        row.bubble.configure(fg_color=bg_color)
+        row.bubble.pack(side=side, padx=5, pady=(0, 5))
 
-        if username:
-            CTkLabel(
-                bubble,
-                text=username,
-                font=("Consolas", 10, "bold"),
-                text_color=text_color
-            ).pack(anchor="w", padx=5, pady=(3, 0))
+        if record.username:
+            row.name.configure(text=record.username, text_color=text_color)
+            row.name.pack(anchor="w", padx=5, pady=(3, 0))
 
-        CTkLabel(
-            bubble,
-            text=message,
-            wraplength=300,
-            justify="left",
-            anchor="w",
-            text_color=text_color,
-            font=("Consolas", 12)
-        ).pack(anchor="w", padx=5, pady=(0, 5))
+        row.text.configure(text=record.message, text_color=text_color)
+        row.text.pack(anchor="w", padx=5, pady=(0, 5))
+        row.action = record.action
 
-        self.smooth_scroll_to_bottom()
+    def add_message(self, message, username=None, self_message=False, system=False, action=None):
+        with tracing.root("add_message", "ui"):
+            self.append_message(message, username, self_message, system, action)
+
+    def append_message(self, message, username, self_message, system, action):
+        # только добавляем запись в модель — виджет появится, когда строка станет видна;
+        # при разборе пачки прокрутка одна, после всей пачки
+        self.chat_field.append(ChatRecord(message, username, self_message, system, action))
+        if not self.in_batch:
+            self.smooth_scroll_to_bottom()
 
 
 # ===== Вікно реєстрації =====
@@ -437,5 +610,6 @@ class RegistrationWindow(CTk):
 
 
 if __name__ == "__main__":
+    tracing.configure_from_env("client")
     reg = RegistrationWindow()
     reg.mainloop()
\ No newline at end of file
@@ -0,0 +1,22 @@
+import pytest
+
+import protocol
+from framing import ProtocolError
+
+
+# --- Назви довільних типів кадрів ---
+def test_binary_frame_with_newline_in_type_is_rejected():
+    data = protocol.encode_binary("X\nRENAME@alice@mallory\nZ", ("a",))
+    with pytest.raises(ProtocolError):
+        protocol.decode_binary(memoryview(data)[protocol.LENGTH.size:])
+
+
+def test_custom_type_round_trips():
+    data = protocol.encode_binary("CUSTOM", ("a", "b"))
+    assert protocol.decode_binary(memoryview(data)[protocol.LENGTH.size:]) == ("CUSTOM", ["a", "b"], None)
+
+
+def test_encode_line_cannot_inject_lines_through_type():
+    line = protocol.encode_line("X\nRENAME@alice@mallory\nZ", ("a",))
+    assert line.count(b"\n") == 1
+    assert protocol.parse_line(line.decode().rstrip("\n"))[0] == "X_RENAME_alice_mallory_Z"
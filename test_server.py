@@ -0,0 +1,47 @@
+import protocol
+import server
+
+
+def setup_function():
+    server.avatars.clear()
+    server.avatar_frames.clear()
+    server.avatar_store = server.AvatarStore()
+
+
+# --- Аватари при зміні ніка ---
+def test_rename_to_same_name_keeps_avatar():
+    server.store_avatar("alice", "a.png", b"picture")
+    digest = server.avatars["alice"][1]
+    server.move_avatar("alice", "alice")
+    assert server.avatars["alice"] == ("a.png", digest)
+    assert server.avatar_frame("alice", "a.png", digest).fields[2] == b"picture"
+
+
+def test_rename_over_existing_avatar_releases_the_displaced_one():
+    server.store_avatar("alice", "a.png", b"alice picture")
+    server.store_avatar("bob", "b.png", b"bob picture")
+    bob_digest = server.avatars["bob"][1]
+    server.move_avatar("alice", "bob")
+    assert "alice" not in server.avatars
+    assert server.avatar_store.frame(bob_digest) is None
+    assert server.avatar_store.data(server.avatars["bob"][1]) == b"alice picture"
+
+
+# --- Відновлення сесії ---
+class RecordingClient:
+    proto = protocol.PROTO_TEXT
+    stamped = False
+    deflate = False
+    room = protocol.DEFAULT_ROOM
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, data, kind="text"):
+        self.sent.append(data)
+
+
+def test_resume_with_non_numeric_seq_fails():
+    client = RecordingClient()
+    server.resume_session(client, server.session_token("alice"), "abc")
+    assert client.sent == [protocol.encode_line("RESUME", ("fail", ""))]
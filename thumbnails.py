@@ -0,0 +1,50 @@
+import io
+import os
+
+try:
+    from PIL import Image
+except ImportError:  # сервер може працювати й без Pillow — тоді аватари зберігаються як є
+    Image = None
+
+# --- Налаштування нормалізації аватарів ---
+AVATAR_SIZE = (30, 30)               # розмір, у якому аватар малюють client.py і show.py
+MAX_AVATAR_BYTES = 10 * 1024 * 1024  # більші завантаження відкидаємо, не декодуючи
+MAX_PIXELS = 4096 * 4096             # захист від "бомб" — величезних картинок у маленькому файлі
+
+
+def available():
+    return Image is not None
+
+
+# --- Перевірка, декодування, зменшення і компактне перекодування ---
+# Виконується у процесі з ProcessPoolExecutor, тому отримує і повертає лише bytes.
+# None — картинка зіпсована або завелика.
+def normalize_avatar(data: bytes, size=AVATAR_SIZE):
+    if len(data) > MAX_AVATAR_BYTES:
+        return None
+    return normalize_image(io.BytesIO(data), size)
+
+
+# аватар, завантажений шматками: процес пулу читає файл сам, байти не ганяються через pipe
+def normalize_avatar_file(path, size=AVATAR_SIZE):
+    try:
+        if os.path.getsize(path) > MAX_AVATAR_BYTES:
+            return None
+    except OSError:
+        return None
+    return normalize_image(path, size)
+
+
+def normalize_image(source, size):
+    try:
+        with Image.open(source) as img:
+            # розміри відомі із заголовка — перевіряємо до декодування пікселів
+            if img.width * img.height > MAX_PIXELS:
+                return None
+            img.seek(0)  # для анімованих GIF беремо перший кадр
+            thumb = img.convert("RGBA").resize(size, Image.Resampling.LANCZOS)
+        out = io.BytesIO()
+        thumb.save(out, format="PNG", optimize=True)
+        return out.getvalue()
+    except Exception:
+        return None
@@ -0,0 +1,133 @@
+import atexit
+import contextlib
+import contextvars
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+
+# --- Трасування гарячого шляху (вмикається явно) ---
+# Спани зберігаються у форматі Chrome trace-event (chrome://tracing, ui.perfetto.dev):
+# подія "X" з початком і тривалістю в мікросекундах. Чи трасувати, вирішується раз
+# на кореневий спан (прийнятий кадр, пачка в UI, запис у сокет) з імовірністю sample;
+# вкладені спани пишуться лише всередині вибраного кореня, тож кожна траса ціла.
+# Вимкнене трасування коштує одну перевірку глобальної змінної на спан.
+# Час — perf_counter (на Linux це CLOCK_MONOTONIC, спільний для всіх процесів машини):
+# траси сервера й клієнта з одного комп'ютера можна злити в одну шкалу (merge нижче).
+MAX_EVENTS = 1_000_000                # зберігаємо найновіші події, старіші витісняються
+ENV_PATH = "LOGITALK_TRACE"           # клієнт: шлях до файлу траси
+ENV_SAMPLE = "LOGITALK_TRACE_SAMPLE"  # клієнт: частка кореневих спанів, що трасуються
+
+enabled = False
+sample = 1.0
+path = None
+process_name = None
+events = deque(maxlen=MAX_EVENTS)  # (назва, категорія, початок нс, тривалість нс, потік, args)
+threads = {}                       # id потоку -> назва; потоки з'єднань до моменту запису вже завершились
+sampled = contextvars.ContextVar("tracing_sampled", default=False)  # окремо для потоку й задачі asyncio
+NO_SPAN = contextlib.nullcontext()
+
+
+class Span:
+    __slots__ = ("name", "cat", "args", "root", "start", "token")
+
+    def __init__(self, name, cat, args, root=False):
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.root = root
+        self.token = None
+
+    def __enter__(self):
+        if self.root:
+            self.token = sampled.set(True)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        tid = threading.get_native_id()
+        events.append((self.name, self.cat, self.start, end - self.start, tid, self.args))
+        if self.token is not None:
+            sampled.reset(self.token)
+            if tid not in threads:
+                threads[tid] = threading.current_thread().name
+
+
+# корінь траси: з імовірністю sample вмикає трасування всього, що всередині
+def root(name, cat, **args):
+    if not enabled:
+        return NO_SPAN
+    if sampled.get():
+        return Span(name, cat, args)  # уже всередині вибраної траси — звичайний вкладений спан
+    if sample < 1.0 and random.random() >= sample:
+        return NO_SPAN
+    return Span(name, cat, args, root=True)
+
+
+def span(name, cat, **args):
+    if not enabled or not sampled.get():
+        return NO_SPAN
+    return Span(name, cat, args)
+
+
+def configure(trace_path, sample_rate=1.0, name=None):
+    global enabled, sample, path, process_name
+    path = trace_path
+    sample = min(1.0, max(0.0, sample_rate))
+    process_name = name
+    enabled = True
+    atexit.register(dump)
+
+
+# клієнт вмикає трасування змінними середовища, щоб не міняти вікно запуску
+def configure_from_env(name):
+    trace_path = os.environ.get(ENV_PATH)
+    if not trace_path:
+        return
+    try:
+        sample_rate = float(os.environ.get(ENV_SAMPLE, "1"))
+    except ValueError:
+        sample_rate = 1.0
+    configure(trace_path, sample_rate, name)
+
+
+# --- Запис у файл ---
+def dump():
+    if not enabled or path is None:
+        return
+    pid = os.getpid()
+    trace = []
+    if process_name:
+        trace.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": process_name}})
+    for tid, name in list(threads.items()):
+        trace.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}})
+    for name, cat, start, duration, tid, args in list(events):
+        event = {"name": name, "cat": cat, "ph": "X", "ts": start / 1000, "dur": duration / 1000,
+                 "pid": pid, "tid": tid}
+        if args:
+            event["args"] = args
+        trace.append(event)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+    print(f"Трасу записано: {path} ({len(events)} подій)")
+
+
+# --- Злиття трас кількох процесів (сервер, його воркери, клієнти) в один файл ---
+def merge(out_path, paths):
+    trace = []
+    for trace_path in paths:
+        with open(trace_path, encoding="utf-8") as f:
+            data = json.load(f)
+        trace.extend(data["traceEvents"] if isinstance(data, dict) else data)
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4 or sys.argv[1] != "merge":
+        sys.exit("використання: python tracing.py merge ВИХІД.json ТРАСА.json [ТРАСА.json ...]")
+    merge(sys.argv[2], sys.argv[3:])
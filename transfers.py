@@ -0,0 +1,90 @@
+import hashlib
+import os
+import tempfile
+
+# --- Потокові передачі (аватари й файли) ---
+# Великі дані йдуть шматками по CHUNK_SIZE окремими кадрами, тож текст
+# проходить між ними. Відправник тримає в дорозі не більше UPLOAD_WINDOW
+# непідтверджених шматків; сервер підтверджує шматок (BLOBACK), лише коли записав його на диск.
+CHUNK_SIZE = 64 * 1024
+UPLOAD_WINDOW = 4
+MAX_FILE_BYTES = 100 * 1024 * 1024  # найбільший файл, який приймає сервер
+MAX_UPLOADS = 4                     # одночасних завантажень від одного клієнта
+
+
+# --- Завантаження на сервер: шматки одразу пишуться у тимчасовий файл ---
+class Upload:
+    def __init__(self, kind, name, size, directory=None):
+        self.kind = kind      # "avatar" або "file"
+        self.name = name
+        self.size = size      # заявлений розмір
+        self.received = 0
+        self.hasher = hashlib.sha256()
+        self.file = tempfile.NamedTemporaryFile(prefix="upload-", dir=directory, delete=False)
+
+    @property
+    def path(self):
+        return self.file.name
+
+    # False — клієнт надіслав більше, ніж заявив
+    def write(self, data) -> bool:
+        if self.received + len(data) > self.size:
+            return False
+        self.file.write(data)
+        self.hasher.update(data)
+        self.received += len(data)
+        return True
+
+    # True — файл повний і хеш збігається із заявленим
+    def finish(self, digest) -> bool:
+        self.file.close()
+        return self.received == self.size and self.hasher.hexdigest() == digest
+
+    def discard(self):
+        self.file.close()
+        try:
+            os.remove(self.file.name)
+        except FileNotFoundError:
+            pass
+
+
+# --- Сховище файлів за хешем вмісту ---
+# Однакові файли зберігаються один раз; тимчасові файли лежать у тому ж каталозі,
+# щоб готове завантаження просто перейменувати, а не копіювати.
+class FileStore:
+    def __init__(self, directory, clean=True):
+        self.directory = directory
+        self.spool = os.path.join(directory, ".spool")
+        os.makedirs(self.spool, exist_ok=True)
+        if not clean:
+            return  # каталог ділять кілька процесів сервера — прибирає лише головний
+        for name in os.listdir(self.spool):  # недокачане з минулого запуску
+            os.remove(os.path.join(self.spool, name))
+
+    def path(self, digest):
+        if len(digest) != 64 or not all(c in "0123456789abcdef" for c in digest):
+            return None  # хеш приходить від клієнта — не даємо вийти за межі каталогу
+        return os.path.join(self.directory, digest)
+
+    def put(self, spool_path, digest):
+        os.replace(spool_path, self.path(digest))
+
+    def open(self, digest):
+        path = self.path(digest)
+        if path is None:
+            return None
+        try:
+            return open(path, "rb")
+        except FileNotFoundError:
+            return None
+
+
+def read_chunks(f, size=CHUNK_SIZE):
+    with f:
+        offset = 0
+        while True:
+            data = f.read(size)
+            if not data:
+                return
+            yield offset, data
+            offset += len(data)